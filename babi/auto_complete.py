@@ -2,9 +2,11 @@ from __future__ import annotations
 
 import curses
 from textwrap import shorten
+from typing import Any
+from typing import Callable
 from typing import Optional
 
-from babi.lsp import LSPClient
+from babi.lsp import LSPDocument
 
 
 class AutoComplete:
@@ -25,8 +27,14 @@ class AutoComplete:
         self.active = True
         self.activation_position = position
 
-    def fetch_suggestions(self, lsp: LSPClient) -> None:
-        lsp.get_autocompletion(self.activation_position[1], self.activation_position[0])
+    def fetch_suggestions(
+            self,
+            lsp: LSPDocument,
+            callback: Callable[[Any], None],
+    ) -> None:
+        assert self.activation_position is not None
+        y, x = self.activation_position
+        lsp.get_autocompletion(y, x, callback)
 
     def select_next_suggestion(self) -> None:
         self.selected_suggestion_index += 1
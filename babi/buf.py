@@ -2,40 +2,58 @@ from __future__ import annotations
 
 import bisect
 import contextlib
-import difflib
+import itertools
 from typing import Callable
 from typing import Generator
 from typing import Iterator
+from typing import List
 from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Union
 
-from babi._types import Protocol
+from babi.chunked_list import ChunkedList
 from babi.dim import Dim
 from babi.horizontal_scrolling import line_x
 from babi.horizontal_scrolling import scrolled_line
 from babi.horizontal_scrolling import wcwidth
+from babi.line_diff import get_opcodes
 
 SetCallback = Callable[['Buf', int, str], None]
 DelCallback = Callable[['Buf', int, str], None]
 InsCallback = Callable[['Buf', int], None]
+# `(buf, idx, victims, count)`: `victims` starting at `idx` were replaced by
+# `count` lines
+SpliceCallback = Callable[['Buf', int, List[str], int], None]
+
+# files at least this long store their lines in a `ChunkedList` so inserting
+# and deleting lines does not shift every line after them
+CHUNKED_LINES = 10_000
+
+_Position = Optional[Sequence[int]]
+_Positions = Union[List[_Position], ChunkedList[_Position]]
 
 
 def _diff_codes(
         a: list[str],
         b: list[str],
 ) -> Generator[tuple[str, int, int, int, int], None, None]:
-    matcher = difflib.SequenceMatcher(a=a, b=b)
-    for op, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
-        if op == 'replace':
-            if i2 - i1 == j2 - j1:
-                yield op, i1, i2, j1, j2
-            else:
-                yield 'delete', i1, i2, j1, j2
-                yield 'insert', i1, i1, j1, j2
-        elif op != 'equal':
+    for op, i1, i2, j1, j2 in reversed(get_opcodes(a, b)):
+        if op != 'equal':
             yield op, i1, i2, j1, j2
 
 
-def _offsets(s: str, tab_size: int) -> tuple[int, ...]:
+def _offsets(s: str, tab_size: int) -> Sequence[int]:
+    """the column each character of `s` starts at (and the end column)
+
+    every character of printable ascii is one column so those positions are
+    a `range` rather than a materialized table
+    """
+    if s.isascii() and s.isprintable():  # no tabs or control characters
+        return range(len(s) + 1)
+    elif '\t' not in s:
+        return (0, *itertools.accumulate(map(wcwidth, s)))
+
     ret = [0]
     for c in s:
         if c == '\t':
@@ -45,36 +63,59 @@ def _offsets(s: str, tab_size: int) -> tuple[int, ...]:
     return tuple(ret)
 
 
-class Modification(Protocol):
-    def __call__(self, buf: Buf) -> None: ...
-
-
-class SetModification(NamedTuple):
-    idx: int
-    s: str
-
-    def __call__(self, buf: Buf) -> None:
-        buf[self.idx] = self.s
-
-
-class InsModification(NamedTuple):
+class Modification(NamedTuple):
+    """undone by replacing lines `[idx, end)` with `lines`"""
     idx: int
-    s: str
-
-    def __call__(self, buf: Buf) -> None:
-        buf.insert(self.idx, self.s)
-
+    end: int
+    lines: list[str]
 
-class DelModification(NamedTuple):
-    idx: int
+    @property
+    def size(self) -> int:
+        return sum(len(line) + 1 for line in self.lines)
 
     def __call__(self, buf: Buf) -> None:
-        del buf[self.idx]
+        buf.splice(self.idx, self.end, self.lines)
+
+
+def add_modification(
+        modifications: list[Modification],
+        modification: Modification,
+) -> None:
+    """append `modification`, coalescing it with the previous one if their
+    ranges touch so consecutive line edits only store the old text once
+    """
+    if not modifications:
+        modifications.append(modification)
+        return
+
+    prev = modifications[-1]
+    # the range `modification` replaced, before it was applied
+    lo, hi = modification.idx, modification.idx + len(modification.lines)
+    if hi < prev.idx or lo > prev.end:
+        modifications.append(modification)
+        return
+
+    # lines outside of what `prev` produced are the original lines
+    lines = modification.lines
+    added = (modification.end - modification.idx) - len(lines)
+    modifications[-1] = Modification(
+        idx=min(lo, prev.idx),
+        end=max(hi, prev.end) + added,
+        lines=[
+            *lines[:max(prev.idx - lo, 0)],
+            *prev.lines,
+            *lines[max(prev.end - lo, 0):],
+        ],
+    )
 
 
 class Buf:
     def __init__(self, lines: list[str], tab_size: int = 4) -> None:
-        self._lines = lines
+        self._lines: list[str] | ChunkedList[str]
+        if len(lines) >= CHUNKED_LINES:
+            self._lines = ChunkedList(lines)
+        else:
+            self._lines = lines
         self.expandtabs = True
         self.tab_size = tab_size
         self.file_y = self.y = self._x = self._x_hint = 0
@@ -82,15 +123,17 @@ class Buf:
         self._set_callbacks: list[SetCallback] = []
         self._del_callbacks: list[DelCallback] = []
         self._ins_callbacks: list[InsCallback] = []
+        self._splice_callbacks: list[SpliceCallback] = []
 
-        self._positions: list[tuple[int, ...] | None] = []
+        self._positions = self._new_positions()
 
     # read only interface
 
     def __repr__(self) -> str:
         return (
             f'{type(self).__name__}('
-            f'{self._lines!r}, x={self.x}, y={self.y}, file_y={self.file_y}'
+            f'{list(self._lines)!r}, '
+            f'x={self.x}, y={self.y}, file_y={self.file_y}'
             f')'
         )
 
@@ -140,6 +183,19 @@ class Buf:
         for ins_callback in self._ins_callbacks:
             ins_callback(self, idx)
 
+    def splice(self, start: int, end: int, lines: list[str]) -> None:
+        """replace lines `[start, end)` with `lines` as a single event
+
+        only the splice callbacks are called
+        """
+        victims = list(self._lines[start:end])
+
+        self._lines[start:end] = lines
+
+        self._splice_cb(self, start, victims, len(lines))
+        for splice_callback in self._splice_callbacks:
+            splice_callback(self, start, victims, len(lines))
+
     # also mutators, but implemented using above functions
 
     def append(self, val: str) -> None:
@@ -151,18 +207,8 @@ class Buf:
         return victim
 
     def replace_lines(self, lines: list[str]) -> None:
-        for op, i1, i2, j1, j2 in _diff_codes(self._lines, lines):
-            if op == 'replace':
-                for i, j in zip(range(i1, i2), range(j1, j2)):
-                    self[i] = lines[j]
-            elif op == 'delete':
-                for i in reversed(range(i1, i2)):
-                    del self[i]
-            elif op == 'insert':
-                for j in reversed(range(j1, j2)):
-                    self.insert(i1, lines[j])
-            else:
-                raise AssertionError(f'{op} {self._lines} {lines} ???')
+        for _, i1, i2, j1, j2 in _diff_codes(list(self._lines), lines):
+            self.splice(i1, i2, lines[j1:j2])
 
     def restore_eof_invariant(self) -> None:
         """the file lines will always contain a blank empty string at the end'
@@ -173,7 +219,7 @@ class Buf:
 
     def set_tab_size(self, tab_size: int) -> None:
         self.tab_size = tab_size
-        self._positions = [None]
+        self._positions = self._new_positions()
 
     # event handling
 
@@ -195,30 +241,46 @@ class Buf:
     def remove_ins_callback(self, cb: InsCallback) -> None:
         self._ins_callbacks.remove(cb)
 
+    def add_splice_callback(self, cb: SpliceCallback) -> None:
+        self._splice_callbacks.append(cb)
+
+    def remove_splice_callback(self, cb: SpliceCallback) -> None:
+        self._splice_callbacks.remove(cb)
+
     def clear_callbacks(self) -> None:
         self._set_callbacks.clear()
         self._ins_callbacks.clear()
         self._del_callbacks.clear()
+        self._splice_callbacks.clear()
 
     @contextlib.contextmanager
     def record(self) -> Generator[list[Modification], None, None]:
         modifications: list[Modification] = []
 
         def set_cb(buf: Buf, idx: int, victim: str) -> None:
-            modifications.append(SetModification(idx, victim))
+            modification = Modification(idx, idx + 1, [victim])
+            add_modification(modifications, modification)
 
         def del_cb(buf: Buf, idx: int, victim: str) -> None:
-            modifications.append(InsModification(idx, victim))
+            modification = Modification(idx, idx, [victim])
+            add_modification(modifications, modification)
 
         def ins_cb(buf: Buf, idx: int) -> None:
-            modifications.append(DelModification(idx))
+            modification = Modification(idx, idx + 1, [])
+            add_modification(modifications, modification)
+
+        def splice_cb(buf: Buf, idx: int, victims: list[str], n: int) -> None:
+            modification = Modification(idx, idx + n, victims)
+            add_modification(modifications, modification)
 
         self.add_set_callback(set_cb)
         self.add_del_callback(del_cb)
         self.add_ins_callback(ins_cb)
+        self.add_splice_callback(splice_cb)
         try:
             yield modifications
         finally:
+            self.remove_splice_callback(splice_cb)
             self.remove_ins_callback(ins_cb)
             self.remove_del_callback(del_cb)
             self.remove_set_callback(set_cb)
@@ -244,6 +306,12 @@ class Buf:
         self._x = x
         self._x_hint = self._cursor_x
 
+    def _new_positions(self) -> _Positions:
+        if isinstance(self._lines, ChunkedList):
+            return ChunkedList()
+        else:
+            return []
+
     def _extend_positions(self, idx: int) -> None:
         self._positions.extend([None] * (1 + idx - len(self._positions)))
 
@@ -259,7 +327,17 @@ class Buf:
         self._extend_positions(idx)
         self._positions.insert(idx, None)
 
-    def line_positions(self, idx: int) -> tuple[int, ...]:
+    def _splice_cb(
+            self,
+            buf: Buf,
+            idx: int,
+            victims: list[str],
+            n: int,
+    ) -> None:
+        self._extend_positions(idx + len(victims))
+        self._positions[idx:idx + len(victims)] = [None] * n
+
+    def line_positions(self, idx: int) -> Sequence[int]:
         self._extend_positions(idx)
         value = self._positions[idx]
         if value is None:
@@ -310,6 +388,10 @@ class Buf:
 
     def _set_x_after_vertical_movement(self) -> None:
         positions = self.line_positions(self.y)
+        if isinstance(positions, range):  # every character is one column
+            self._x = min(len(self._lines[self.y]), self._x_hint)
+            return
+
         x = bisect.bisect_left(positions, self._x_hint)
         x = min(len(self._lines[self.y]), x)
         if positions[x] > self._x_hint:
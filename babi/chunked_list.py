@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+from typing import cast
+from typing import Generic
+from typing import Iterable
+from typing import Iterator
+from typing import overload
+from typing import TypeVar
+
+T = TypeVar('T')
+
+# chunks are split when they grow past twice this size
+CHUNK_SIZE = 512
+
+
+class ChunkedList(Generic[T]):
+    """a list stored as bounded chunks of items
+
+    chunk lengths are kept in a fenwick tree so finding, inserting and
+    deleting an item is O(log n) rather than shifting every later item
+    """
+
+    def __init__(self, items: Iterable[T] = ()) -> None:
+        items = list(items)
+        self._chunks = [
+            items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)
+        ]
+        self._len = len(items)
+        self._build()
+
+    def _build(self) -> None:
+        n = len(self._chunks)
+        self._tree = [0] + [len(chunk) for chunk in self._chunks]
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+        self._step = 1 << n.bit_length() >> 1
+
+    def _update(self, chunk_idx: int, delta: int) -> None:
+        i = chunk_idx + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _locate(self, idx: int) -> tuple[int, int]:
+        """(chunk index, index in chunk) of the (non-negative) `idx`"""
+        chunk_idx = 0
+        step = self._step
+        while step:
+            i = chunk_idx + step
+            if i < len(self._tree) and self._tree[i] <= idx:
+                chunk_idx = i
+                idx -= self._tree[i]
+            step >>= 1
+        return chunk_idx, idx
+
+    def _locate_end(self, idx: int) -> tuple[int, int]:
+        """like `_locate` but also allows the index one past the end"""
+        if idx == self._len:
+            return len(self._chunks) - 1, len(self._chunks[-1])
+        else:
+            return self._locate(idx)
+
+    def _slice(self, slc: slice) -> tuple[int, int]:
+        start, stop, step = slc.indices(self._len)
+        if step != 1:
+            raise ValueError('only contiguous slices are supported')
+        return start, max(start, stop)
+
+    def _index(self, idx: int) -> int:
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('list index out of range')
+        return idx
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self)!r})'
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (ChunkedList, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        else:
+            return NotImplemented
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[T]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    @overload
+    def __getitem__(self, idx: int) -> T: ...
+    @overload
+    def __getitem__(self, idx: slice) -> list[T]: ...
+
+    def __getitem__(self, idx: int | slice) -> T | list[T]:
+        if isinstance(idx, slice):
+            start, stop = self._slice(idx)
+            if start == stop:
+                return []
+            chunk_idx, i = self._locate(start)
+            ret = self._chunks[chunk_idx][i:i + stop - start]
+            while len(ret) < stop - start:
+                chunk_idx += 1
+                ret.extend(self._chunks[chunk_idx][:stop - start - len(ret)])
+            return ret
+
+        chunk_idx, i = self._locate(self._index(idx))
+        return self._chunks[chunk_idx][i]
+
+    @overload
+    def __setitem__(self, idx: int, val: T) -> None: ...
+    @overload
+    def __setitem__(self, idx: slice, val: Iterable[T]) -> None: ...
+
+    def __setitem__(self, idx: int | slice, val: T | Iterable[T]) -> None:
+        if isinstance(idx, slice):
+            start, stop = self._slice(idx)
+            self._splice(start, stop, list(cast(Iterable[T], val)))
+            return
+
+        chunk_idx, i = self._locate(self._index(idx))
+        self._chunks[chunk_idx][i] = cast(T, val)
+
+    def _splice(self, start: int, stop: int, vals: list[T]) -> None:
+        if not self._chunks:
+            self.extend(vals)
+            return
+
+        s_chunk, s_i = self._locate_end(start)
+        e_chunk, e_i = self._locate_end(stop)
+        merged = [
+            *self._chunks[s_chunk][:s_i],
+            *vals,
+            *self._chunks[e_chunk][e_i:],
+        ]
+        self._chunks[s_chunk:e_chunk + 1] = [
+            merged[i:i + CHUNK_SIZE] for i in range(0, len(merged), CHUNK_SIZE)
+        ]
+        self._len += len(vals) - (stop - start)
+        self._build()
+
+    def __delitem__(self, idx: int) -> None:
+        chunk_idx, i = self._locate(self._index(idx))
+        chunk = self._chunks[chunk_idx]
+        del chunk[i]
+        self._len -= 1
+        if chunk:
+            self._update(chunk_idx, -1)
+        else:
+            del self._chunks[chunk_idx]
+            self._build()
+
+    def insert(self, idx: int, val: T) -> None:
+        # same clamping as `list.insert`
+        if idx < 0:
+            idx = max(idx + self._len, 0)
+        idx = min(idx, self._len)
+
+        if not self._chunks:
+            self._chunks.append([val])
+            self._len += 1
+            self._build()
+            return
+
+        chunk_idx, i = self._locate_end(idx)
+        chunk = self._chunks[chunk_idx]
+        chunk.insert(i, val)
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[chunk_idx:chunk_idx + 1] = [
+                chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:],
+            ]
+            self._build()
+        else:
+            self._update(chunk_idx, 1)
+
+    def append(self, val: T) -> None:
+        self.insert(self._len, val)
+
+    def extend(self, vals: Iterable[T]) -> None:
+        vals = list(vals)
+        if not vals:
+            return
+        self._chunks.extend(
+            vals[i:i + CHUNK_SIZE] for i in range(0, len(vals), CHUNK_SIZE)
+        )
+        self._len += len(vals)
+        self._build()
@@ -23,20 +23,26 @@ from typing import TYPE_CHECKING
 from typing import TypeVar
 
 from babi.auto_complete import AutoComplete
+from babi.buf import add_modification
 from babi.buf import Buf
 from babi.buf import Modification
 from babi.diagnostics import Diagnostics
 from babi.dim import Dim
 from babi.hl.interface import FileHL
+from babi.hl.interface import HLs
 from babi.hl.lint_errors import LintErrors
 from babi.hl.replace import Replace
 from babi.hl.selection import Selection
 from babi.hl.syntax import Syntax
 from babi.hl.trailing_whitespace import TrailingWhitespace
-from babi.lsp import LSPClient
+from babi.lsp import content_change
+from babi.lsp import LSPDocument
 from babi.progress_manager import ProgressManager
 from babi.prompt import PromptResult
+from babi.render_cache import RenderCache
 from babi.status import Status
+from babi.undo_log import undo_log_enabled
+from babi.undo_log import UndoLog
 from babi.user_data import xdg_config
 
 if TYPE_CHECKING:
@@ -46,6 +52,11 @@ TCallable = TypeVar('TCallable', bound=Callable[..., Any])
 
 WS_RE = re.compile(r'^\s*')
 
+# undo history beyond either limit is evicted, oldest first
+UNDO_MAX_ACTIONS = 10_000
+# in characters of replaced text
+UNDO_MAX_SIZE = 64 * 2 ** 20
+
 LSP_SERVERS = loads(open(xdg_config('lsp.json')).read()) if os.path.lexists(xdg_config('lsp.json')) else {}
 
 
@@ -92,7 +103,9 @@ class Action:
             final: bool,
     ):
         self.name = name
-        self.modifications = modifications
+        self.modifications: list[Modification] = []
+        self.size = 0
+        self.extend(modifications)
         self.start_x = start_x
         self.start_y = start_y
         self.start_modified = start_modified
@@ -101,9 +114,39 @@ class Action:
         self.end_modified = end_modified
         self.final = final
 
+    def extend(self, modifications: list[Modification]) -> None:
+        for modification in modifications:
+            # the last modification may be coalesced with the new one
+            n = len(self.modifications)
+            prev = self.modifications[-1].size if self.modifications else 0
+            add_modification(self.modifications, modification)
+            if len(self.modifications) == n:
+                self.size += self.modifications[-1].size - prev
+            else:
+                self.size += modification.size
+
+    def to_json(self) -> Any:
+        return [
+            self.name, self.start_x, self.start_y, self.end_x, self.end_y,
+            [[m.idx, m.end, m.lines] for m in self.modifications],
+        ]
+
+    @classmethod
+    def from_json(cls, obj: Any) -> Action:
+        name, start_x, start_y, end_x, end_y, modifications = obj
+        return cls(
+            name=name,
+            modifications=[Modification(*m) for m in modifications],
+            start_x=start_x, start_y=start_y, start_modified=True,
+            end_x=end_x, end_y=end_y, end_modified=True,
+            final=True,
+        )
+
     def apply(self, file: File) -> Action:
+        with file.lsp_changes():
+            modifications = file.buf.apply(self.modifications)
         action = Action(
-            name=self.name, modifications=file.buf.apply(self.modifications),
+            name=self.name, modifications=modifications,
             start_x=self.end_x, start_y=self.end_y,
             start_modified=self.end_modified,
             end_x=self.start_x, end_y=self.start_y,
@@ -243,6 +286,12 @@ class File:
         self._in_edit_action = False
         self.undo_stack: list[Action] = []
         self.redo_stack: list[Action] = []
+        # the total `Action.size` of `undo_stack`
+        self._undo_size = 0
+        self._undo_log: UndoLog | None = None
+        # persisted history is only read when first undoing (or saving)
+        self._undo_sha256: str | None = None
+        self._undo_restored = False
         self._syntax = syntax
         self._file_syntax = syntax.blank_file_highlighter()
         self.lint_errors = LintErrors(syntax.color_manager, syntax.theme)
@@ -250,12 +299,18 @@ class File:
         self._replace_hl = Replace()
         self.selection = Selection()
         self._file_hls: tuple[FileHL, ...] = ()
-        self.lsp: LSPClient | None = None
+        self._render_cache = RenderCache(self._file_hls)
+        # screen row => `(line, line x, regions)` (or `None` if blank) drawn
+        # in the last frame along with the `(dim, tab size)` of that frame
+        self._drawn: dict[int, tuple[str, int, tuple[HLs, ...]] | None] = {}
+        self._drawn_for: tuple[Dim, int] | None = None
+        # the command of the language server for this file, its document
+        # is opened in the server once the file is loaded
+        self.lsp_server: list[str] | None = None
+        self.lsp: LSPDocument | None = None
         if filename is not None and os.path.lexists(filename):
             extension = filename.split('.')[-1]
-            server = LSP_SERVERS.get(extension)
-            if server is not None:
-                self.lsp = LSPClient(server)
+            self.lsp_server = LSP_SERVERS.get(extension)
         self.autocomplete: AutoComplete = AutoComplete()
         self.diagnostics: Diagnostics = Diagnostics()
         self.progressManager: ProgressManager = ProgressManager()
@@ -283,6 +338,10 @@ class File:
                 status.update(str(e))
                 self.filename = None
                 lines, self.nl, mixed, self.sha256 = get_lines(io.StringIO(''))
+            else:
+                if not mixed and undo_log_enabled():
+                    self._undo_log = UndoLog(self.filename)
+                    self._undo_sha256 = self.sha256
         else:
             if self.filename is not None:
                 status.update('(new file)')
@@ -311,6 +370,9 @@ class File:
         else:
             self._file_syntax = self._syntax.blank_file_highlighter()
 
+        if self.sha256 is not None and not self.modified:
+            self._file_syntax.load_checkpoints(self.sha256)
+
         # hack due to https://github.com/python/mypy/issues/12360
         file_hls: tuple[FileHL, ...] = (
             self._file_syntax,
@@ -320,10 +382,12 @@ class File:
             self.selection,
         )
         self._file_hls = file_hls
+        self._render_cache = RenderCache(self._file_hls)
 
         self.buf.clear_callbacks()
         for file_hl in self._file_hls:
             file_hl.register_callbacks(self.buf)
+        self._render_cache.register_callbacks(self.buf)
 
     def reload_theme(self, syntax: Syntax) -> None:
         self._syntax = syntax
@@ -339,6 +403,49 @@ class File:
     def __repr__(self) -> str:
         return f'<{type(self).__name__} {self.filename!r}>'
 
+    def idle_pending(self) -> bool:
+        return bool(self.buf) and self._file_syntax.idle_pending(self.buf)
+
+    def highlight_idle(self, n: int) -> None:
+        self._file_syntax.highlight_idle(self.buf, n)
+        if (
+                self.sha256 is not None and
+                not self.modified and
+                not self._file_syntax.idle_pending(self.buf)
+        ):
+            self._file_syntax.save_checkpoints(self.sha256)
+
+    def restore_undo_log(self) -> None:
+        """put the persisted undo history underneath this session's"""
+        if self._undo_restored:
+            return
+        self._undo_restored = True
+
+        if self._undo_log is None or self._undo_sha256 is None:
+            return
+        actions = self._undo_log.load(self._undo_sha256, Action.from_json)
+        if actions:
+            actions[-1].end_modified = self.sha256 != self._undo_sha256
+            self.undo_stack[:0] = actions
+            self._undo_size += sum(action.size for action in actions)
+            self._evict_undo()
+
+    def save_undo_log(self) -> None:
+        if (
+                self.filename is None or
+                self.sha256 is None or
+                not undo_log_enabled()
+        ):
+            return
+
+        self.restore_undo_log()
+        if (
+                self._undo_log is None or
+                self._undo_log.path != os.path.abspath(self.filename)
+        ):
+            self._undo_log = UndoLog(self.filename)
+        self._undo_log.save(self.sha256, self.undo_stack, Action.to_json)
+
     def reset_modified_state(self) -> None:
         for stack in (self.undo_stack, self.redo_stack):
             first = True
@@ -495,15 +602,15 @@ class File:
                     line = screen.file.buf[line_y]
                     if '\n' in replaced:
                         replaced_lines = replaced.split('\n')
-                        self.buf[line_y] = (
-                            f'{line[:match.start()]}{replaced_lines[0]}'
+                        self.buf.splice(
+                            line_y, line_y + 1,
+                            [
+                                f'{line[:match.start()]}{replaced_lines[0]}',
+                                *replaced_lines[1:-1],
+                                f'{replaced_lines[-1]}{line[end:]}',
+                            ],
                         )
-                        for i, ins_line in enumerate(replaced_lines[1:-1], 1):
-                            self.buf.insert(line_y + i, ins_line)
                         last_insert = line_y + len(replaced_lines) - 1
-                        self.buf.insert(
-                            last_insert, f'{replaced_lines[-1]}{line[end:]}',
-                        )
                         self.buf.y = last_insert
                         self.buf.x = 0
                         search.offset = len(replaced_lines[-1])
@@ -729,9 +836,9 @@ class File:
                 ret.append(self.buf[l_y])
             ret.append(self.buf[e_y][:e_x])
 
-            self.buf[s_y] = self.buf[s_y][:s_x] + self.buf[e_y][e_x:]
-            for _ in range(s_y + 1, e_y + 1):
-                self.buf.pop(s_y + 1)
+            self.buf.splice(
+                s_y, e_y + 1, [self.buf[s_y][:s_x] + self.buf[e_y][e_x:]],
+            )
         self.buf.y = s_y
         self.buf.x = s_x
         self.buf.scroll_screen_if_needed(dim)
@@ -751,13 +858,18 @@ class File:
                 return cut_buffer + (victim,)
 
     def _uncut(self, cut_buffer: tuple[str, ...], dim: Dim) -> None:
-        for cut_line in cut_buffer:
-            line = self.buf[self.buf.y]
-            before, after = line[:self.buf.x], line[self.buf.x:]
-            self.buf[self.buf.y] = before + cut_line
-            self.buf.insert(self.buf.y + 1, after)
+        if not cut_buffer:
+            return
+
+        line = self.buf[self.buf.y]
+        before, after = line[:self.buf.x], line[self.buf.x:]
+        self.buf.splice(
+            self.buf.y, self.buf.y + 1,
+            [before + cut_buffer[0], *cut_buffer[1:], after],
+        )
+        for _ in cut_buffer:
             self.buf.down(dim)
-            self.buf.x = 0
+        self.buf.x = 0
 
     @edit_action('uncut', final=True)
     @clear_selection
@@ -779,8 +891,7 @@ class File:
     def _sort(self, dim: Dim, s_y: int, e_y: int, reverse: bool) -> None:
         # self.buf intentionally does not support slicing so we use islice
         lines = sorted(itertools.islice(self.buf, s_y, e_y), reverse=reverse)
-        for i, line in zip(range(s_y, e_y), lines):
-            self.buf[i] = line
+        self.buf.splice(s_y, e_y, lines)
 
         self.buf.y = s_y
         self.buf.x = 0
@@ -934,8 +1045,6 @@ class File:
         self.buf[self.buf.y] = s[:self.buf.x] + wch + s[self.buf.x:]
         self.buf.x += len(wch)
         self.buf.restore_eof_invariant()
-        if self.lsp is not None:
-            self.lsp.change_document(self.nl.join(self.buf))
 
     def finalize_previous_action(self) -> None:
         assert not self._in_edit_action, 'nested edit/movement'
@@ -965,7 +1074,7 @@ class File:
         assert not self._in_edit_action, f'recursive action? {name}'
         self._in_edit_action = True
         try:
-            with self.buf.record() as modifications:
+            with self.buf.record() as modifications, self.lsp_changes():
                 yield
         finally:
             self._in_edit_action = False
@@ -973,7 +1082,9 @@ class File:
             if continue_last:
                 self.undo_stack[-1].end_x = self.buf.x
                 self.undo_stack[-1].end_y = self.buf.y
-                self.undo_stack[-1].modifications.extend(modifications)
+                self._undo_size -= self.undo_stack[-1].size
+                self.undo_stack[-1].extend(modifications)
+                self._undo_size += self.undo_stack[-1].size
             elif modifications:
                 self.modified = True
                 action = Action(
@@ -985,6 +1096,47 @@ class File:
                     final=final,
                 )
                 self.undo_stack.append(action)
+                self._undo_size += action.size
+            self._evict_undo()
+
+    @contextlib.contextmanager
+    def lsp_changes(self) -> Generator[None, None, None]:
+        """tell the language server about the lines modified in the block"""
+        if self.lsp is None:
+            yield
+            return
+
+        before = (len(self.buf), self.buf[-1])
+        with self.buf.record() as modifications:
+            yield
+        if modifications:
+            change = content_change(self.buf, self.nl, before, modifications)
+            self.lsp.change_document([change], lambda: self.nl.join(self.buf))
+
+    def _evict_undo(self) -> None:
+        """drop the oldest undo history when over the limits, the most
+        recent action is always kept so it can be undone
+        """
+        while len(self.undo_stack) > 1 and (
+                len(self.undo_stack) > UNDO_MAX_ACTIONS or
+                self._undo_size > UNDO_MAX_SIZE
+        ):
+            self._undo_size -= self.undo_stack.pop(0).size
+
+    def undo_redo(
+            self,
+            from_stack: list[Action],
+            to_stack: list[Action],
+    ) -> Action:
+        """apply the last action of `from_stack`, pushing its inverse"""
+        action = from_stack.pop()
+        inverse = action.apply(self)
+        to_stack.append(inverse)
+        if from_stack is self.undo_stack:
+            self._undo_size -= action.size
+        else:
+            self._undo_size += inverse.size
+        return action
 
     @contextlib.contextmanager
     def select(self) -> Generator[None, None, None]:
@@ -1006,53 +1158,46 @@ class File:
     ) -> None:
         stdscr.move(*self.buf.cursor_position(dim))
 
+    def touch(self) -> None:
+        """forget what was drawn: the next `draw` redraws every row"""
+        self._drawn.clear()
+
     def draw(self, stdscr: curses._CursesWindow, dim: Dim) -> None:
         to_display = min(self.buf.displayable_count, dim.height)
 
         for file_hl in self._file_hls:
             file_hl.highlight_until(self.buf, self.buf.file_y + to_display)
 
+        drawn_for = (dim, self.buf.tab_size)
+        if drawn_for != self._drawn_for:
+            self._drawn_for = drawn_for
+            self._drawn.clear()
+
         for i in range(to_display):
             draw_y = i + dim.y
             l_y = self.buf.file_y + i
-            stdscr.insstr(draw_y, 0, self.buf.rendered_line(l_y, dim))
-
             l_x = self.buf.line_x(dim) if l_y == self.buf.y else 0
-            l_x_max = l_x + dim.width
-            for file_hl in self._file_hls:
-                for region in file_hl.regions[l_y]:
-                    l_positions = self.buf.line_positions(l_y)
-                    r_x = l_positions[region.x]
-                    # the selection highlight intentionally extends one past
-                    # the end of the line, which won't have a position
-                    if region.end == len(l_positions):
-                        r_end = l_positions[-1] + 1
-                    else:
-                        r_end = l_positions[region.end]
-
-                    if r_x >= l_x_max:
-                        break
-                    elif r_end <= l_x:
-                        continue
-
-                    if l_x and r_x <= l_x:
-                        if file_hl.include_edge:
-                            h_s_x = 0
-                        else:
-                            h_s_x = 1
-                    else:
-                        h_s_x = r_x - l_x
 
-                    if r_end >= l_x_max and l_x_max < l_positions[-1]:
-                        if file_hl.include_edge:
-                            h_e_x = dim.width
-                        else:
-                            h_e_x = dim.width - 1
-                    else:
-                        h_e_x = r_end - l_x
+            # only rows which would look different from the last frame are
+            # redrawn -- the row's text, scroll and highlights determine it
+            regions = tuple(file_hl.regions[l_y] for file_hl in self._file_hls)
+            row = (self.buf[l_y], l_x, regions)
+            if self._drawn.get(draw_y) == row:
+                continue
+            self._drawn[draw_y] = row
 
-                    stdscr.chgat(draw_y, h_s_x, h_e_x - h_s_x, region.attr)
+            text, spans = self._render_cache.row(
+                self.buf, l_y, dim, l_x, regions,
+            )
+            stdscr.insstr(draw_y, 0, text)
+            for x, n, attr in spans:
+                stdscr.chgat(draw_y, x, n, attr)
 
         for i in range(to_display, dim.height):
-            stdscr.move(i + dim.y, 0)
+            draw_y = i + dim.y
+            if draw_y in self._drawn and self._drawn[draw_y] is None:
+                continue
+            self._drawn[draw_y] = None
+
+            stdscr.move(draw_y, 0)
             stdscr.clrtoeol()
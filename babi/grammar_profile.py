@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import os
+import time
+from typing import Generator
+from typing import Iterable
+from typing import Sequence
+
+from babi.highlight import Grammars
+from babi.highlight import highlight_lines
+from babi.reg import collect_stats
+from babi.reg import RegStats
+from babi.user_data import prefix_data
+
+
+def _filenames(paths: Iterable[str]) -> Generator[str, None, None]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, filenames in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for filename in sorted(filenames):
+                    yield os.path.join(root, filename)
+        else:
+            yield path
+
+
+def _pattern(s: str, width: int = 60) -> str:
+    s = repr(s)
+    if len(s) > width:
+        return f'{s[:width - 3]}...'
+    else:
+        return s
+
+
+def _patterns(patterns: tuple[str, ...]) -> str:
+    if len(patterns) == 1:
+        return _pattern(patterns[0])
+    elif not patterns:
+        return '[no patterns]'
+    else:
+        return f'[{len(patterns)} patterns] {_pattern(patterns[0], 45)}'
+
+
+def _print_report(stats: RegStats, top: int) -> None:
+    print()
+    print('slowest searches:')
+    print(f'{"ms":>10} {"searches":>10}  rule: pattern(s)')
+    by_time = sorted(stats.search_time.items(), key=lambda kv: -kv[1])
+    for (rule, patterns), t in by_time[:top]:
+        n = stats.searches[rule, patterns]
+        print(f'{t * 1000:>10.2f} {n:>10}  {rule}: {_patterns(patterns)}')
+
+    print()
+    print('most matched patterns:')
+    print(f'{"matches":>10}  rule: pattern')
+    for (rule, pattern), n in stats.matches.most_common(top):
+        print(f'{n:>10}  {rule}: {_pattern(pattern)}')
+
+    print()
+    print('slowest to compile:')
+    print(f'{"ms":>10}  rule: pattern')
+    by_time_compile = sorted(stats.compile_time.items(), key=lambda kv: -kv[1])
+    for (rule, pattern), t in by_time_compile[:top]:
+        print(f'{t * 1000:>10.2f}  {rule}: {_pattern(pattern)}')
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='tokenize files and report the most expensive patterns',
+    )
+    parser.add_argument('--grammar-dir', default=prefix_data('grammar_v1'))
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args(argv)
+
+    lines_by_scope: collections.Counter[str] = collections.Counter()
+    time_by_scope: dict[str, float] = collections.defaultdict(float)
+
+    with collect_stats() as stats:
+        grammars = Grammars(args.grammar_dir)
+        for filename in _filenames(args.paths):
+            try:
+                with open(filename, encoding='UTF-8') as f:
+                    lines = f.readlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+
+            first_line = lines[0] if lines else ''
+            compiler = grammars.compiler_for_file(filename, first_line)
+
+            t0 = time.perf_counter()
+            for _ in highlight_lines(compiler, compiler.root_state, lines):
+                pass
+            time_by_scope[compiler.root_scope] += time.perf_counter() - t0
+            lines_by_scope[compiler.root_scope] += len(lines)
+
+    print(f'{"lines":>10} {"ms":>10} {"lines/s":>10}  scope')
+    for scope, n in lines_by_scope.most_common():
+        t = time_by_scope[scope]
+        rate = n / t if t else 0
+        print(f'{n:>10} {t * 1000:>10.2f} {rate:>10.0f}  {scope}')
+
+    _print_report(stats, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
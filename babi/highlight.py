@@ -3,7 +3,10 @@ from __future__ import annotations
 import functools
 import json
 import os.path
+import pickle
 from typing import Any
+from typing import Generator
+from typing import Iterable
 from typing import Match
 from typing import NamedTuple
 from typing import Tuple
@@ -26,6 +29,9 @@ Scope = Tuple[str, ...]
 Regions = Tuple['Region', ...]
 Captures = Tuple[Tuple[int, 'Rule'], ...]
 
+# bump when the format of the grammar cache changes
+GRAMMAR_CACHE_VERSION = 4
+
 
 def uniquely_constructed(t: T) -> T:
     """avoid tuple.__hash__ for "singleton" constructed objects"""
@@ -398,6 +404,7 @@ class EndRule(NamedTuple):
     end: str
     regset: _RegSet
     u_rules: tuple[Rule, ...]
+    label: str
 
     def start(
             self,
@@ -409,7 +416,7 @@ class EndRule(NamedTuple):
         next_scope = scope + self.content_name
 
         boundary = match.end() == len(match.string)
-        reg = make_reg(expand_escaped(match, self.end))
+        reg = make_reg(expand_escaped(match, self.end), rule=self.label)
         start = (match.string, match.start())
         state = state.push(Entry(next_scope, self, start, reg, boundary))
         regions = _captures(compiler, scope, match, self.begin_captures)
@@ -469,6 +476,7 @@ class WhileRule(NamedTuple):
     while_: str
     regset: _RegSet
     u_rules: tuple[Rule, ...]
+    label: str
 
     def start(
             self,
@@ -480,7 +488,7 @@ class WhileRule(NamedTuple):
         next_scope = scope + self.content_name
 
         boundary = match.end() == len(match.string)
-        reg = make_reg(expand_escaped(match, self.while_))
+        reg = make_reg(expand_escaped(match, self.while_), rule=self.label)
         start = (match.string, match.start())
         entry = Entry(next_scope, self, start, reg, boundary)
         state = state.push_while(self, entry)
@@ -523,6 +531,7 @@ class Compiler:
 
         self.root_scope = grammar.scope_name
         self._grammars = grammars
+        self._scopes = {grammar.scope_name}
         self._rule_to_grammar: dict[Rule, Grammar] = {}
         self._c_rules: dict[Rule, CompiledRule] = {}
         root = self._compile_root(grammar)
@@ -546,13 +555,18 @@ class Compiler:
         elif s.startswith('#'):
             return self._patterns(grammar, (repository[s[1:]],))
         elif '#' not in s:
-            grammar = self._grammars.grammar_for_scope(s)
+            grammar = self._grammar_for_scope(s)
             return self._include(grammar, grammar.repository, '$self')
         else:
             scope, _, s = s.partition('#')
-            grammar = self._grammars.grammar_for_scope(scope)
+            grammar = self._grammar_for_scope(scope)
             return self._include(grammar, grammar.repository, f'#{s}')
 
+    def _grammar_for_scope(self, scope: str) -> Grammar:
+        ret = self._grammars.grammar_for_scope(scope)
+        self._scopes.add(scope)
+        return ret
+
     def _patterns_(
             self,
             grammar: Grammar,
@@ -590,10 +604,13 @@ class Compiler:
 
     def _compile_root(self, grammar: Grammar) -> PatternRule:
         regs, rules = self._patterns(grammar, grammar.patterns)
-        return PatternRule((grammar.scope_name,), make_regset(*regs), rules)
+        regset = make_regset(*regs, rule=grammar.scope_name)
+        return PatternRule((grammar.scope_name,), regset, rules)
 
     def _compile_rule(self, grammar: Grammar, rule: Rule) -> CompiledRule:
         assert rule.include is None, rule
+        # identifies the rule's regexes in `collect_stats`
+        label = ' '.join((grammar.scope_name, *rule.name))
         if rule.match is not None:
             captures_ref = self._captures_ref(grammar, rule.captures)
             return MatchRule(rule.name, captures_ref)
@@ -605,8 +622,9 @@ class Compiler:
                 self._captures_ref(grammar, rule.begin_captures),
                 self._captures_ref(grammar, rule.end_captures),
                 rule.end,
-                make_regset(*regs),
+                make_regset(*regs, rule=label),
                 rules,
+                label,
             )
         elif rule.begin is not None and rule.while_ is not None:
             regs, rules = self._patterns(grammar, rule.patterns)
@@ -616,12 +634,14 @@ class Compiler:
                 self._captures_ref(grammar, rule.begin_captures),
                 self._captures_ref(grammar, rule.while_captures),
                 rule.while_,
-                make_regset(*regs),
+                make_regset(*regs, rule=label),
                 rules,
+                label,
             )
         else:
             regs, rules = self._patterns(grammar, rule.patterns)
-            return PatternRule(rule.name, make_regset(*regs), rules)
+            regset = make_regset(*regs, rule=label)
+            return PatternRule(rule.name, regset, rules)
 
     def compile_rule(self, rule: Rule) -> CompiledRule:
         try:
@@ -633,24 +653,231 @@ class Compiler:
         ret = self._c_rules[rule] = self._compile_rule(grammar, rule)
         return ret
 
+    def grammar_mtimes(self) -> dict[str, float]:
+        """modification times of the grammar files this compiler has used"""
+        return {
+            scope: mtime
+            for scope in sorted(self._scopes)
+            for mtime in (self._grammars.mtime(scope),)
+            if mtime is not None
+        }
+
+    def grammar_mtimes_match(self, mtimes: dict[str, float]) -> bool:
+        return all(
+            self._grammars.mtime(scope) == mtime
+            for scope, mtime in mtimes.items()
+        )
+
+    def _child_rule(self, parent: CompiledRule, idx: int) -> CompiledRule:
+        if not isinstance(parent, (PatternRule, EndRule, WhileRule)):
+            raise ValueError(f'not a parent rule: {parent}')
+        return self.compile_rule(parent.u_rules[idx])
+
+    def _child_idx(self, parent: CompiledRule, rule: CompiledRule) -> int:
+        if isinstance(parent, (PatternRule, EndRule, WhileRule)):
+            for i, u_rule in enumerate(parent.u_rules):
+                if self._c_rules.get(u_rule) is rule:
+                    return i
+        raise ValueError(f'{rule} is not a child of {parent}')
+
+    def dump_state(self, state: State) -> list[Any]:
+        """serialize `state` to json-compatible data
+
+        rules are identified by their index in the parent entry's rules so
+        the result is stable across runs (as long as the grammars are)
+        """
+        entries: list[Any] = []
+        for i, entry in enumerate(state.entries):
+            if i == 0:
+                if entry.rule is not self.root_state.cur.rule:
+                    raise ValueError(f'not a root rule: {entry.rule}')
+                rule_idx = -1
+            else:
+                parent = state.entries[i - 1].rule
+                rule_idx = self._child_idx(parent, entry.rule)
+            entries.append([
+                list(entry.scope), rule_idx, *entry.start, entry.reg.pattern,
+                entry.boundary,
+            ])
+        return [entries, [idx for _, idx in state.while_stack]]
+
+    def load_state(self, data: list[Any]) -> State:
+        """the inverse of `dump_state`"""
+        entries_data, while_data = data
+        entries: list[Entry] = []
+        for scope, rule_idx, start_s, start_i, reg, boundary in entries_data:
+            if not entries:
+                rule = self.root_state.cur.rule
+            else:
+                rule = self._child_rule(entries[-1].rule, rule_idx)
+            entry = Entry(
+                tuple(scope), rule, (start_s, start_i), make_reg(reg),
+                boundary,
+            )
+            entries.append(entry)
+
+        while_stack = []
+        for idx in while_data:
+            while_rule = entries[idx - 1].rule
+            if not isinstance(while_rule, WhileRule):
+                raise ValueError(f'not a while rule: {while_rule}')
+            while_stack.append((while_rule, idx))
+
+        return State(tuple(entries), tuple(while_stack))
+
 
 class Grammars:
-    def __init__(self, *directories: str) -> None:
+    def __init__(self, *directories: str, cache: str | None = None) -> None:
+        self._directories = tuple(d for d in directories if os.path.exists(d))
         self._scope_to_files = {
             os.path.splitext(filename)[0]: os.path.join(directory, filename)
-            for directory in directories
-            if os.path.exists(directory)
+            for directory in self._directories
             for filename in sorted(os.listdir(directory))
             if filename.endswith('.json')
         }
+        self._grammar_files = dict(self._scope_to_files)
 
         unknown_grammar = {'scopeName': 'source.unknown', 'patterns': []}
         self._raw = {'source.unknown': unknown_grammar}
-        self._file_types: list[tuple[frozenset[str], str]] = []
-        self._first_line: list[tuple[_Reg, str]] = []
+        self._mtimes: dict[str, float] = {}
+        # extension => scope and the combined `firstLineMatch` regset
+        self._extensions: dict[str, str] | None = None
+        self._first_line_scopes: tuple[str, ...] = ()
+        self._first_line = make_regset()
         self._parsed: dict[str, Grammar] = {}
         self._compiled: dict[str, Compiler] = {}
 
+        self._cache_filename = cache
+        self._cache: dict[str, Any] | None = None
+        # where the grammars start in the cache file, after its header
+        self._cache_offset = 0
+
+    def _cache_key(self) -> tuple[tuple[str, float], ...]:
+        # grammars are installed / removed by writing to their directory so
+        # one stat per directory (instead of per grammar) tells if the index
+        # changed.  each grammar also records the mtime of its file which is
+        # checked when that grammar is loaded
+        return tuple(
+            (directory, os.stat(directory).st_mtime)
+            for directory in self._directories
+        )
+
+    def _load_cache(self) -> dict[str, Any]:
+        """the header of the cache (the index and where each grammar is),
+        empty when out of date
+        """
+        if self._cache is not None:
+            return self._cache
+
+        self._cache = {'grammars': {}}
+        if self._cache_filename is None:
+            return self._cache
+
+        try:
+            with open(self._cache_filename, 'rb') as f:
+                data = pickle.load(f)
+                offset = f.tell()
+            if (
+                    data['version'] == GRAMMAR_CACHE_VERSION and
+                    data['directories'] == self._cache_key()
+            ):
+                self._cache, self._cache_offset = data, offset
+        except (
+                OSError, EOFError, pickle.UnpicklingError,
+                ValueError, KeyError, TypeError,
+        ):
+            pass
+        return self._cache
+
+    def _load_cached_grammar(
+            self,
+            scope: str,
+            mtime: float,
+    ) -> dict[str, Any] | None:
+        """read only `scope`'s grammar from the cache file, unless its file
+        was modified (`mtime`) since it was cached
+        """
+        if self._cache_filename is None:
+            return None
+
+        try:
+            pos, size, cached_mtime = self._load_cache()['grammars'][scope]
+            if cached_mtime != mtime:
+                return None
+            with open(self._cache_filename, 'rb') as f:
+                f.seek(self._cache_offset + pos)
+                cached_scope, raw = pickle.loads(f.read(size))
+        except (
+                OSError, EOFError, pickle.UnpicklingError,
+                ValueError, KeyError, TypeError,
+        ):
+            return None
+        # the file may have been rewritten since its header was read
+        if cached_scope != scope:
+            return None
+        return raw
+
+    def _save_cache(
+            self,
+            extensions: dict[str, str],
+            first_line: list[tuple[str, str]],
+    ) -> None:
+        if self._cache_filename is None:
+            return
+
+        # each grammar is pickled separately after the header so it is only
+        # read and unpickled when that grammar is used
+        blobs = [
+            pickle.dumps((scope, self._raw[scope]))
+            for scope in self._grammar_files
+        ]
+        grammars = {}
+        pos = 0
+        for scope, blob in zip(self._grammar_files, blobs):
+            grammars[scope] = (pos, len(blob), self._mtimes[scope])
+            pos += len(blob)
+
+        try:
+            data = {
+                'version': GRAMMAR_CACHE_VERSION,
+                'directories': self._cache_key(),
+                'grammars': grammars,
+                'extensions': extensions,
+                'first_line': first_line,
+            }
+            os.makedirs(os.path.dirname(self._cache_filename), exist_ok=True)
+            tmp_filename = f'{self._cache_filename}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'wb') as f:
+                pickle.dump(data, f)
+                offset = f.tell()
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(tmp_filename, self._cache_filename)
+        except OSError:
+            pass
+        else:
+            self._cache, self._cache_offset = data, offset
+
+    def _build_index(self) -> None:
+        cache = self._load_cache()
+        if 'version' in cache:
+            extensions, first_line = cache['extensions'], cache['first_line']
+        else:
+            # no usable cache, need to read all the json
+            extensions = {}
+            first_line = []
+            for scope in self._grammar_files:
+                raw = self._raw_for_scope(scope)
+                for ext in raw.get('fileTypes', ()):
+                    extensions.setdefault(ext, scope)
+                if 'firstLineMatch' in raw:
+                    first_line.append((raw['firstLineMatch'], scope))
+            self._save_cache(extensions, first_line)
+
+        self._extensions = extensions
+        self._first_line_scopes = tuple(scope for _, scope in first_line)
+        self._first_line = make_regset(*(reg for reg, _ in first_line))
+
     def _raw_for_scope(self, scope: str) -> dict[str, Any]:
         try:
             return self._raw[scope]
@@ -658,16 +885,25 @@ class Grammars:
             pass
 
         grammar_path = self._scope_to_files.pop(scope)
-        with open(grammar_path, encoding='UTF-8') as f:
-            ret = self._raw[scope] = json.load(f)
-
-        file_types = frozenset(ret.get('fileTypes', ()))
-        first_line = make_reg(ret.get('firstLineMatch', '$impossible^'))
+        mtime = self._mtimes[scope] = os.stat(grammar_path).st_mtime
+        cached = self._load_cached_grammar(scope, mtime)
+        if cached is not None:
+            ret = self._raw[scope] = cached
+        else:
+            with open(grammar_path, encoding='UTF-8') as f:
+                ret = self._raw[scope] = json.load(f)
+        return ret
 
-        self._file_types.append((file_types, scope))
-        self._first_line.append((first_line, scope))
+    def mtime(self, scope: str) -> float | None:
+        try:
+            return self._mtimes[scope]
+        except KeyError:
+            pass
 
-        return ret
+        try:
+            return os.stat(self._scope_to_files[scope]).st_mtime
+        except (KeyError, OSError):
+            return None
 
     def grammar_for_scope(self, scope: str) -> Grammar:
         try:
@@ -704,29 +940,32 @@ class Grammars:
             except KeyError:
                 pass
 
-        # didn't find it in the fast path, need to read all the json
-        for k in tuple(self._scope_to_files):
-            self._raw_for_scope(k)
+        # didn't find it in the fast path, need the index of every grammar
+        if self._extensions is None:
+            self._build_index()
+            assert self._extensions is not None
 
         _, _, ext = os.path.basename(filename).rpartition('.')
-        for extensions, scope in self._file_types:
-            if ext in extensions:
-                return self.compiler_for_scope(scope)
+        if ext in self._extensions:
+            return self.compiler_for_scope(self._extensions[ext])
 
-        for reg, scope in self._first_line:
-            if reg.match(first_line, 0, first_line=True, boundary=True):
-                return self.compiler_for_scope(scope)
+        # the leftmost match is the first pattern which matches at 0 (if any)
+        idx, match = self._first_line.search(
+            first_line, 0, first_line=True, boundary=True,
+        )
+        if match is not None and match.start() == 0:
+            return self.compiler_for_scope(self._first_line_scopes[idx])
 
         return self.compiler_for_scope('source.unknown')
 
 
-def highlight_line(
+def _highlight_line(
         compiler: Compiler,
         state: State,
         line: str,
         first_line: bool,
-) -> tuple[State, Regions]:
-    ret: list[Region] = []
+        ret: list[Region],
+) -> State:
     pos = 0
     boundary = state.cur.boundary
 
@@ -760,4 +999,30 @@ def highlight_line(
     if pos < len(line):
         ret.append(Region(pos, len(line), state.cur.scope))
 
+    return state
+
+
+def highlight_line(
+        compiler: Compiler,
+        state: State,
+        line: str,
+        first_line: bool,
+) -> tuple[State, Regions]:
+    ret: list[Region] = []
+    state = _highlight_line(compiler, state, line, first_line, ret)
     return state, tuple(ret)
+
+
+def highlight_lines(
+        compiler: Compiler,
+        state: State,
+        lines: Iterable[str],
+        first_line: bool = True,
+) -> Generator[tuple[State, Regions], None, None]:
+    """lazily highlight consecutive `lines`, starting from `state`"""
+    ret: list[Region] = []
+    for line in lines:
+        state = _highlight_line(compiler, state, line, first_line, ret)
+        yield state, tuple(ret)
+        ret.clear()
+        first_line = False
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import array
+from typing import Iterator
 from typing import NamedTuple
-from typing import Tuple
+from typing import TYPE_CHECKING
 
 from babi._types import Protocol
 from babi.buf import Buf
 
+if TYPE_CHECKING:
+    HLs = array.array[int]
+else:
+    HLs = array.array
+
 
 class HL(NamedTuple):
     x: int
@@ -13,7 +20,33 @@ class HL(NamedTuple):
     attr: int
 
 
-HLs = Tuple[HL, ...]
+# curses attributes do not fit in a C int (`A_ITALIC` is `1 << 31`) so the
+# packed regions refer to them by their index in this table
+ATTRS: list[int] = []
+_ATTR_INDEX: dict[int, int] = {}
+
+
+def attr_index(attr: int) -> int:
+    try:
+        return _ATTR_INDEX[attr]
+    except KeyError:
+        ret = _ATTR_INDEX[attr] = len(ATTRS)
+        ATTRS.append(attr)
+        return ret
+
+
+def make_hls(*hls: HL) -> HLs:
+    """pack regions as flat `(x, end, attr index)` triples"""
+    ret = array.array('i')
+    for hl in hls:
+        ret.extend((hl.x, hl.end, attr_index(hl.attr)))
+    return ret
+
+
+def iter_hls(hls: HLs) -> Iterator[HL]:
+    it = iter(hls)
+    for x, end, idx in zip(it, it, it):
+        yield HL(x=x, end=end, attr=ATTRS[idx])
 
 
 class RegionsMapping(Protocol):
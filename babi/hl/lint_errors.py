@@ -14,6 +14,7 @@ from babi.highlight import Grammars
 from babi.highlight import highlight_line
 from babi.hl.interface import HL
 from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
 from babi.horizontal_scrolling import scrolled_line
 from babi.linting import Error
 from babi.theme import Theme
@@ -57,7 +58,7 @@ class LintErrors:
         self.errors: tuple[Error, ...] = ()
         self._temporary_highlight = False
 
-        self.regions: dict[int, HLs] = collections.defaultdict(tuple)
+        self.regions: dict[int, HLs] = collections.defaultdict(make_hls)
 
     def highlight_until(self, lines: Buf, idx: int) -> None:
         """our highlight regions are populated in other ways"""
@@ -88,10 +89,31 @@ class LintErrors:
         )
         self.set_errors(errors)
 
+    def _splice_cb(
+            self,
+            lines: Buf,
+            idx: int,
+            victims: list[str],
+            n: int,
+    ) -> None:
+        end = idx + len(victims)
+        # errors on replaced lines stay within the replacement
+        last = idx + max(n, 1)
+        errors = tuple(
+            error._replace(lineno=min(error.lineno, last), disabled=True)
+            if idx <= error.line_idx < end else
+            error._replace(lineno=error.lineno + n - len(victims))
+            if error.line_idx >= end else
+            error
+            for error in self.errors
+        )
+        self.set_errors(errors)
+
     def register_callbacks(self, buf: Buf) -> None:
         buf.add_set_callback(self._set_cb)
         buf.add_del_callback(self._del_cb)
         buf.add_ins_callback(self._ins_cb)
+        buf.add_splice_callback(self._splice_cb)
 
     def set_errors(self, errors: tuple[Error, ...]) -> None:
         pair = self._color_manager.raw_color_pair(-1, curses.COLOR_RED)
@@ -100,7 +122,7 @@ class LintErrors:
         self.errors = errors
         self.regions.clear()
         self.regions.update({
-            error.line_idx: (HL(x=0, end=1, attr=attr),)
+            error.line_idx: make_hls(HL(x=0, end=1, attr=attr))
             for error in errors
             if not error.disabled
         })
@@ -8,13 +8,14 @@ from typing import Generator
 from babi.buf import Buf
 from babi.hl.interface import HL
 from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
 
 
 class Replace:
     include_edge = True
 
     def __init__(self) -> None:
-        self.regions: dict[int, HLs] = collections.defaultdict(tuple)
+        self.regions: dict[int, HLs] = collections.defaultdict(make_hls)
 
     def highlight_until(self, lines: Buf, idx: int) -> None:
         """our highlight regions are populated in other ways"""
@@ -26,7 +27,7 @@ class Replace:
     def region(self, y: int, x: int, end: int) -> Generator[None, None, None]:
         # XXX: this assumes pair 1 is the background
         attr = curses.A_REVERSE | curses.A_DIM | curses.color_pair(1)
-        self.regions[y] = (HL(x=x, end=end, attr=attr),)
+        self.regions[y] = make_hls(HL(x=x, end=end, attr=attr))
         try:
             yield
         finally:
@@ -6,13 +6,14 @@ import curses
 from babi.buf import Buf
 from babi.hl.interface import HL
 from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
 
 
 class Selection:
     include_edge = True
 
     def __init__(self) -> None:
-        self.regions: dict[int, HLs] = collections.defaultdict(tuple)
+        self.regions: dict[int, HLs] = collections.defaultdict(make_hls)
         self.start: tuple[int, int] | None = None
         self.end: tuple[int, int] | None = None
 
@@ -27,16 +28,16 @@ class Selection:
         attr = curses.A_REVERSE | curses.A_DIM | curses.color_pair(1)
         (s_y, s_x), (e_y, e_x) = self.get()
         if s_y == e_y:
-            self.regions[s_y] = (HL(x=s_x, end=e_x, attr=attr),)
+            self.regions[s_y] = make_hls(HL(x=s_x, end=e_x, attr=attr))
         else:
-            self.regions[s_y] = (
+            self.regions[s_y] = make_hls(
                 HL(x=s_x, end=len(lines[s_y]) + 1, attr=attr),
             )
             for l_y in range(s_y + 1, e_y):
-                self.regions[l_y] = (
+                self.regions[l_y] = make_hls(
                     HL(x=0, end=len(lines[l_y]) + 1, attr=attr),
                 )
-            self.regions[e_y] = (HL(x=0, end=e_x, attr=attr),)
+            self.regions[e_y] = make_hls(HL(x=0, end=e_x, attr=attr))
 
     def get(self) -> tuple[tuple[int, int], tuple[int, int]]:
         assert self.start is not None and self.end is not None
@@ -49,7 +50,8 @@ class Selection:
         if self.start is not None and self.end is not None:
             (s_y, _), (e_y, _) = self.get()
             for l_y in range(s_y, e_y + 1):
-                del self.regions[l_y]
+                # regions are only populated once the selection is drawn
+                self.regions.pop(l_y, None)
         self.start = self.end = None
 
     def set(self, s_y: int, s_x: int, e_y: int, e_x: int) -> None:
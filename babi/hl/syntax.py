@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import collections
 import curses
-import functools
-import math
+import itertools
+import json
 import os
 from pathlib import Path
-from typing import Callable
-from typing import NamedTuple
+from typing import cast
+from typing import Generator
+from typing import Iterable
+from typing import Iterator
+from typing import Tuple
 
 import babi_grammars
 
@@ -14,119 +18,464 @@ from babi.buf import Buf
 from babi.color_manager import ColorManager
 from babi.highlight import Compiler
 from babi.highlight import Grammars
-from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
+from babi.highlight import Regions
 from babi.highlight import State
-from babi.hl.interface import HL
+from babi.hl.interface import attr_index
 from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
+from babi.hl.interface import RegionsMapping
 from babi.theme import Theme
 from babi.user_data import prefix_data
 from babi.user_data import xdg_config
 from babi.user_data import xdg_data
 
+_Key = Tuple[Compiler, State, str, bool]
 
-class FileSyntax:
-    include_edge = False
+# highlighted lines cached across all files, the docs claim better
+# performance with power of two sizing
+HIGHLIGHT_CACHE_SIZE = 2 ** 16
+# lines between kept tokenizer states, also used for checkpoints on disk
+CHECKPOINT_INTERVAL = 256
+# files at least this long only keep sparse tokenizer states and the regions
+# near the viewport so memory use does not grow with the size of the file
+SPARSE_LINES = 100_000
+# lines above and below the viewport which keep their regions when sparse
+SPARSE_MARGIN = 256
+# checkpoint files kept on disk, the least recently used are removed
+CHECKPOINT_FILES = 128
+
+
+def _checkpoints_filename(sha256: str, scope: str) -> str:
+    return xdg_data('highlight_v1', f'{sha256}-{scope}.json')
+
+
+def _prune_checkpoints(dirname: str) -> None:
+    """remove all but the `CHECKPOINT_FILES` most recently used files"""
+    try:
+        entries = [e for e in os.scandir(dirname) if e.is_file()]
+    except OSError:
+        return
+    if len(entries) <= CHECKPOINT_FILES:
+        return
+
+    def mtime(entry: os.DirEntry[str]) -> float:
+        try:
+            return entry.stat().st_mtime
+        except OSError:  # removed by another babi
+            return 0.
+
+    entries.sort(key=mtime, reverse=True)
+    for entry in entries[CHECKPOINT_FILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _shift(
+        rng: tuple[int, int],
+        idx: int,
+        removed: int,
+        added: int,
+) -> tuple[int, int]:
+    """shift `rng` for `removed` lines at `idx` replaced by `added` lines"""
+    lo, hi = (p if p <= idx else max(p - removed, idx) for p in rng)
+    return lo + added * (lo >= idx), hi + added * (hi > idx)
+
+
+class HighlightCache:
+    """highlighted lines, shared by every file using the same theme"""
 
     def __init__(
             self,
-            compiler: Compiler,
             theme: Theme,
             color_manager: ColorManager,
+            maxsize: int = HIGHLIGHT_CACHE_SIZE,
     ) -> None:
-        self._compiler = compiler
         self._theme = theme
         self._color_manager = color_manager
+        self._maxsize = maxsize
+        self._cache: collections.OrderedDict[_Key, tuple[State, HLs]]
+        self._cache = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def _hls(self, regions: Regions) -> HLs:
+        # remove the trailing newline
+        new_end = regions[-1]._replace(end=regions[-1].end - 1)
+        regions = regions[:-1] + (new_end,)
+
+        ret = make_hls()
+        for r in regions:
+            style = self._theme.select(r.scope)
+            if style == self._theme.default:
+                continue
+
+            idx = attr_index(style.attr(self._color_manager))
+            if ret and ret[-1] == idx and ret[-2] == r.start:
+                ret[-2] = r.end
+            else:
+                ret.extend((r.start, r.end, idx))
+
+        return ret
+
+    def highlight_lines(
+            self,
+            compiler: Compiler,
+            state: State,
+            lines: Iterable[str],
+            first_line: bool,
+    ) -> Generator[tuple[State, HLs], None, None]:
+        """lazily highlight consecutive `lines`, starting from `state`"""
+        lines_iter = iter(lines)
+        for line in lines_iter:
+            try:
+                ret = self._cache[compiler, state, line, first_line]
+            except KeyError:
+                break
+            else:
+                self._cache.move_to_end((compiler, state, line, first_line))
+                self.hits += 1
+                yield ret
+                state, first_line = ret[0], False
+        else:
+            return
+
+        # after a miss the following lines most likely miss as well, so
+        # tokenize the rest in one batch (filling the cache as we go)
+        todo, todo_nl = itertools.tee(itertools.chain((line,), lines_iter))
+        tokens = highlight_lines(
+            compiler, state, (f'{s}\n' for s in todo_nl), first_line,
+        )
+        for line, (new_state, regions) in zip(todo, tokens):
+            ret = (new_state, self._hls(regions))
+            self._cache[compiler, state, line, first_line] = ret
+            if len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+            self.misses += 1
+            yield ret
+            state, first_line = new_state, False
 
-        self.regions: list[HLs] = []
-        self._states: list[State] = []
 
-        # this will be assigned a functools.lru_cache per instance for
-        # better hit rate and memory usage
-        self._hl: Callable[[State, str, bool], tuple[State, HLs]] | None
-        self._hl = None
+class FileSyntax:
+    include_edge = False
+
+    def __init__(self, compiler: Compiler, cache: HighlightCache) -> None:
+        self._compiler = compiler
+        self._cache = cache
+
+        # `None` for lines which are not tokenized or not kept
+        self._regions: list[HLs | None] = []
+        self._states: list[State | None] = []
+        # lines in `[lo, hi)` must be re-tokenized, after that tokenizing
+        # continues until the end-of-line state matches the cached state
+        self._dirty: tuple[int, int] | None = None
+        # when sparse, only every `CHECKPOINT_INTERVAL`th state is kept and
+        # regions are only kept for lines in `[lo, hi)` of `_window`, this is
+        # decided when first highlighting
+        self._sparse: bool | None = None
+        self._window = (0, 0)
+        # line index => state at the start of that line (loaded from disk)
+        self._checkpoints: dict[int, State] = {}
+        self._checkpoints_cached = False
 
     @property
     def root_scope(self) -> str:
         return self._compiler.root_scope
 
-    def _hl_uncached(
+    @property
+    def regions(self) -> RegionsMapping:
+        # `highlight_until` materializes every line up to the viewport
+        return cast(RegionsMapping, self._regions)
+
+    def _highlight(
             self,
             state: State,
-            line: str,
-            first_line: bool,
-    ) -> tuple[State, HLs]:
-        new_state, regions = highlight_line(
-            self._compiler, state, f'{line}\n', first_line=first_line,
+            lines: Buf,
+            start: int,
+            end: int,
+    ) -> Iterator[tuple[int, tuple[State, HLs]]]:
+        todo = range(start, end)
+        hl_lines = (lines[i] for i in todo)
+        highlighted = self._cache.highlight_lines(
+            self._compiler, state, hl_lines, first_line=start == 0,
         )
+        return zip(todo, highlighted)
 
-        # remove the trailing newline
-        new_end = regions[-1]._replace(end=regions[-1].end - 1)
-        regions = regions[:-1] + (new_end,)
+    def _init_sparse(self, lines: Buf) -> None:
+        if self._sparse is None:
+            self._sparse = len(lines) >= SPARSE_LINES
 
-        regs: list[HL] = []
-        for r in regions:
-            style = self._theme.select(r.scope)
-            if style == self._theme.default:
-                continue
+    def _keep_state(self, idx: int) -> bool:
+        return (
+            not self._sparse or
+            idx % CHECKPOINT_INTERVAL == CHECKPOINT_INTERVAL - 1
+        )
 
-            attr = style.attr(self._color_manager)
-            if (
-                    regs and
-                    regs[-1].attr == attr and
-                    regs[-1].end == r.start
-            ):
-                regs[-1] = regs[-1]._replace(end=r.end)
-            else:
-                regs.append(HL(x=r.start, end=r.end, attr=attr))
+    def _keep_regions(self, idx: int) -> bool:
+        return not self._sparse or self._window[0] <= idx < self._window[1]
+
+    def _mark_dirty(self, lo: int, hi: int) -> None:
+        hi = min(hi, len(self._states))
+        if lo >= hi:
+            return
+        elif self._dirty is None:
+            self._dirty = (lo, hi)
+        else:
+            self._dirty = (min(self._dirty[0], lo), max(self._dirty[1], hi))
 
-        return new_state, tuple(regs)
+    def _edited(self, idx: int) -> None:
+        if self._checkpoints:
+            self._checkpoints = {
+                k: v for k, v in self._checkpoints.items() if k <= idx
+            }
 
     def _set_cb(self, lines: Buf, idx: int, victim: str) -> None:
-        del self.regions[idx:]
-        del self._states[idx:]
+        self._edited(idx)
+        self._mark_dirty(idx, idx + 1)
 
     def _del_cb(self, lines: Buf, idx: int, victim: str) -> None:
-        del self.regions[idx:]
-        del self._states[idx:]
+        self._splice_cb(lines, idx, [victim], 0)
 
     def _ins_cb(self, lines: Buf, idx: int) -> None:
-        del self.regions[idx:]
-        del self._states[idx:]
+        self._splice_cb(lines, idx, [], 1)
+
+    def _splice_cb(
+            self,
+            lines: Buf,
+            idx: int,
+            victims: list[str],
+            n: int,
+    ) -> None:
+        self._edited(idx)
+        if idx >= len(self._states):
+            return
+
+        end = min(idx + len(victims), len(self._states))
+        # the following lines were tokenized starting from the state after
+        # the last victim, keep it so convergence is detected correctly
+        if end > idx:
+            after = self._states[end - 1]
+        else:
+            after = self._state_before(idx)
+        self._regions[idx:end] = [None] * n
+        states: list[State | None] = [None] * n
+        if n:
+            states[-1] = after
+        self._states[idx:end] = states
+        if self._dirty is not None:
+            self._dirty = _shift(self._dirty, idx, end - idx, n)
+        self._window = _shift(self._window, idx, end - idx, n)
+        # the following line now starts from a different state
+        self._mark_dirty(idx, idx + max(n, 1))
 
     def register_callbacks(self, buf: Buf) -> None:
         buf.add_set_callback(self._set_cb)
         buf.add_del_callback(self._del_cb)
         buf.add_ins_callback(self._ins_cb)
+        buf.add_splice_callback(self._splice_cb)
 
     def highlight_until(self, lines: Buf, idx: int) -> None:
-        if self._hl is None:
-            # the docs claim better performance with power of two sizing
-            size = max(4096, 2 ** (int(math.log(len(lines), 2)) + 2))
-            self._hl = functools.lru_cache(maxsize=size)(self._hl_uncached)
+        self._init_sparse(lines)
 
-        if not self._states:
-            state = self._compiler.root_state
+        start = min(lines.file_y, idx)
+        self._jump_to_checkpoint(start)
+        if self._sparse:
+            self._move_window(start, idx)
+        self._tokenize_until(lines, idx)
+        self._materialize(lines, start, idx)
+
+    def _state_before(self, idx: int) -> State | None:
+        if idx == 0:
+            return self._compiler.root_state
         else:
-            state = self._states[-1]
+            return self._states[idx - 1]
+
+    def _derive_state_before(self, lines: Buf, idx: int) -> State:
+        """tokenize forward from the nearest kept state before `idx`"""
+        lo = idx
+        while self._state_before(lo) is None:
+            lo -= 1
+        state = self._state_before(lo)
+        assert state is not None
+
+        for i, (state, regions) in self._highlight(state, lines, lo, idx):
+            if self._keep_state(i):
+                self._states[i] = state
+            if self._keep_regions(i):
+                self._regions[i] = regions
+        return state
+
+    def _jump_to_checkpoint(self, idx: int) -> None:
+        k = max((k for k in self._checkpoints if k <= idx), default=0)
+        # only skip ahead if it saves a meaningful amount of tokenizing
+        if k - len(self._states) < CHECKPOINT_INTERVAL:
+            return
+
+        skipped = k - len(self._states)
+        self._states.extend([None] * skipped)
+        self._regions.extend([None] * skipped)
+        for c in [c for c in self._checkpoints if c <= k]:
+            self._states[c - 1] = self._checkpoints.pop(c)
+
+    def _move_window(self, start: int, idx: int) -> None:
+        prev_lo, prev_hi = self._window
+        lo, hi = max(start - SPARSE_MARGIN, 0), idx + SPARSE_MARGIN
+        self._window = (lo, hi)
 
-        for i in range(len(self._states), idx):
-            state, regions = self._hl(state, lines[i], i == 0)
-            self._states.append(state)
-            self.regions.append(regions)
+        prev_hi = min(prev_hi, len(self._regions))
+        for i in range(prev_lo, min(lo, prev_hi)):
+            self._regions[i] = None
+        for i in range(max(hi, prev_lo), prev_hi):
+            self._regions[i] = None
 
+    def _tokenize_until(self, lines: Buf, idx: int) -> None:
+        if self._dirty is not None:
+            self._rehighlight_dirty(lines, idx)
 
-class Syntax(NamedTuple):
-    grammars: Grammars
-    theme: Theme
-    color_manager: ColorManager
+        end = len(self._states)
+        if end >= idx:
+            return
+
+        state = self._derive_state_before(lines, end)
+        # the last state is kept to continue from, it is no longer needed
+        if end and not self._keep_state(end - 1):
+            self._states[end - 1] = None
+
+        for i, (state, regions) in self._highlight(state, lines, end, idx):
+            self._states.append(state if self._keep_state(i) else None)
+            self._regions.append(regions if self._keep_regions(i) else None)
+        self._states[-1] = state
+
+    def _materialize(self, lines: Buf, start: int, end: int) -> None:
+        missing = [i for i in range(start, end) if self._regions[i] is None]
+        if not missing:
+            return
+
+        start, end = missing[0], missing[-1] + 1
+        state = self._derive_state_before(lines, start)
+        for i, (state, regions) in self._highlight(state, lines, start, end):
+            self._regions[i] = regions
+            if self._keep_state(i):
+                self._states[i] = state
+
+    def checkpoints(self) -> dict[int, State]:
+        return {
+            i + 1: state
+            for i, state in enumerate(self._states)
+            if state is not None and (i + 1) % CHECKPOINT_INTERVAL == 0
+        }
+
+    def load_checkpoints(self, sha256: str) -> None:
+        filename = _checkpoints_filename(sha256, self.root_scope)
+        try:
+            with open(filename, encoding='UTF-8') as f:
+                data = json.load(f)
+            if not self._compiler.grammar_mtimes_match(data['grammars']):
+                return
+            checkpoints = {
+                k: self._compiler.load_state(state)
+                for k, state in data['checkpoints']
+            }
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return
+        else:
+            self._checkpoints = checkpoints
+            self._checkpoints_cached = True
+
+        try:  # mark it as recently used
+            os.utime(filename)
+        except OSError:
+            pass
+
+    def save_checkpoints(self, sha256: str) -> None:
+        if self._checkpoints_cached:
+            return
+
+        mtimes = self._compiler.grammar_mtimes()
+        checkpoints = self.checkpoints()
+        if self.root_scope not in mtimes or not checkpoints:
+            return
+
+        try:
+            data = {
+                'grammars': mtimes,
+                'checkpoints': [
+                    [k, self._compiler.dump_state(state)]
+                    for k, state in sorted(checkpoints.items())
+                ],
+            }
+        except ValueError:  # pragma: no cover (defensive)
+            return
+
+        filename = _checkpoints_filename(sha256, self.root_scope)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w', encoding='UTF-8') as f:
+                json.dump(data, f)
+        except OSError:
+            pass
+        else:
+            self._checkpoints_cached = True
+            _prune_checkpoints(os.path.dirname(filename))
+
+    def idle_pending(self, lines: Buf) -> bool:
+        return self._dirty is not None or len(self._states) < len(lines)
+
+    def highlight_idle(self, lines: Buf, n: int) -> None:
+        """tokenize up to `n` lines past what has been highlighted so far"""
+        self._init_sparse(lines)
+        if self._dirty is not None:
+            start = self._dirty[0]
+        else:
+            start = len(self._states)
+        self._tokenize_until(lines, min(start + n, len(lines)))
+
+    def _rehighlight_dirty(self, lines: Buf, idx: int) -> None:
+        assert self._dirty is not None
+        lo, hi = self._dirty
+
+        state = self._derive_state_before(lines, lo)
+        end = len(self._states)
+
+        todo = self._highlight(state, lines, lo, min(idx, end))
+        for i, (state, regions) in todo:
+            self._regions[i] = regions if self._keep_regions(i) else None
+            prev_state = self._states[i]
+            if prev_state is not None or self._keep_state(i):
+                self._states[i] = state
+            if i >= hi - 1 and state == prev_state:
+                # converged: the cached lines below are still valid
+                break
+        else:
+            resume = max(lo, idx)
+            if resume < end:
+                # not needed yet, resume from here next time
+                self._dirty = (resume, max(hi, resume + 1))
+                return
+
+        self._dirty = None
+
+
+class Syntax:
+    def __init__(
+            self,
+            grammars: Grammars,
+            theme: Theme,
+            color_manager: ColorManager,
+    ) -> None:
+        self.grammars = grammars
+        self.theme = theme
+        self.color_manager = color_manager
+        self.cache = HighlightCache(theme, color_manager)
 
     def file_highlighter(self, filename: str, first_line: str) -> FileSyntax:
         compiler = self.grammars.compiler_for_file(filename, first_line)
-        return FileSyntax(compiler, self.theme, self.color_manager)
+        return FileSyntax(compiler, self.cache)
 
     def blank_file_highlighter(self) -> FileSyntax:
         compiler = self.grammars.blank_compiler()
-        return FileSyntax(compiler, self.theme, self.color_manager)
+        return FileSyntax(compiler, self.cache)
 
     def _init_screen(self, stdscr: curses._CursesWindow) -> None:
         default_fg, default_bg = self.theme.default.fg, self.theme.default.bg
@@ -152,7 +501,14 @@ class Syntax(NamedTuple):
             stdscr: curses._CursesWindow,
             color_manager: ColorManager,
     ) -> Syntax:
-        grammars = Grammars(prefix_data('grammar_v1'), xdg_data('grammar_v1'), Path(babi_grammars.__spec__.origin).parent.joinpath('share/babi/grammar_v1'))
+        grammars = Grammars(
+            prefix_data('grammar_v1'),
+            xdg_data('grammar_v1'),
+            Path(babi_grammars.__spec__.origin).parent.joinpath(
+                'share/babi/grammar_v1',
+            ),
+            cache=xdg_data('grammar_cache_v1.pickle'),
+        )
         theme = Theme.from_filename(xdg_config('theme.json'))
         ret = cls(grammars, theme, color_manager)
         ret._init_screen(stdscr)
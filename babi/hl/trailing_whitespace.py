@@ -6,6 +6,7 @@ from babi.buf import Buf
 from babi.color_manager import ColorManager
 from babi.hl.interface import HL
 from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
 
 
 class TrailingWhitespace:
@@ -18,18 +19,18 @@ class TrailingWhitespace:
 
     def _trailing_ws(self, line: str) -> HLs:
         if not line:
-            return ()
+            return make_hls()
 
         i = len(line)
         while i > 0 and line[i - 1].isspace():
             i -= 1
 
         if i == len(line):
-            return ()
+            return make_hls()
         else:
             pair = self._color_manager.raw_color_pair(-1, curses.COLOR_RED)
             attr = curses.color_pair(pair)
-            return (HL(x=i, end=len(line), attr=attr),)
+            return make_hls(HL(x=i, end=len(line), attr=attr))
 
     def _set_cb(self, lines: Buf, idx: int, victim: str) -> None:
         if idx < len(self.regions):
@@ -43,10 +44,23 @@ class TrailingWhitespace:
         if idx < len(self.regions):
             self.regions.insert(idx, self._trailing_ws(lines[idx]))
 
+    def _splice_cb(
+            self,
+            lines: Buf,
+            idx: int,
+            victims: list[str],
+            n: int,
+    ) -> None:
+        if idx < len(self.regions):
+            self.regions[idx:idx + len(victims)] = [
+                self._trailing_ws(lines[i]) for i in range(idx, idx + n)
+            ]
+
     def register_callbacks(self, buf: Buf) -> None:
         buf.add_set_callback(self._set_cb)
         buf.add_del_callback(self._del_cb)
         buf.add_ins_callback(self._ins_cb)
+        buf.add_splice_callback(self._splice_cb)
 
     def highlight_until(self, lines: Buf, idx: int) -> None:
         for i in range(len(self.regions), idx):
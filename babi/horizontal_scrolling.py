@@ -1,8 +1,13 @@
 from __future__ import annotations
 
-import curses
+import functools
+import unicodedata
 
-from babi.cached_property import cached_property
+# "prepended concatenation marks" are format characters which are drawn
+_PREPENDED_MARKS = frozenset((
+    0x600, 0x601, 0x602, 0x603, 0x604, 0x605, 0x6dd, 0x70f, 0x890, 0x891,
+    0x8e2, 0x110bd, 0x110cd,
+))
 
 
 def line_x(x: int, width: int) -> int:
@@ -34,15 +39,31 @@ def scrolled_line(s: str, x: int, width: int) -> str:
         return s.ljust(width)
 
 
-class _CalcWidth:
-    @cached_property
-    def _window(self) -> curses._CursesWindow:
-        return curses.newwin(1, 10)
+def _wcwidth(cp: int) -> int:
+    if cp < 0x20 or cp == 0x7f:
+        # curses draws control characters as `^X`, backspace and carriage
+        # return move the cursor back instead
+        return 0 if cp in (0x08, 0x0d) else 2
+    elif cp < 0xa0:  # C1 controls
+        return 1
 
-    def wcwidth(self, c: str) -> int:
-        self._window.addstr(0, 0, c)
-        return self._window.getyx()[1]
+    c = chr(cp)
+    category = unicodedata.category(c)
+    if category == 'Cn':  # unassigned
+        return 1
+    elif category in {'Mn', 'Me'}:  # combining marks
+        return 0
+    elif category == 'Cf' and cp != 0xad and cp not in _PREPENDED_MARKS:
+        return 0
+    elif 0x1160 <= cp < 0x1200:  # hangul medial vowels and final consonants
+        return 0
+    elif unicodedata.east_asian_width(c) in {'W', 'F'}:
+        return 2
+    else:
+        return 1
 
 
-wcwidth = _CalcWidth().wcwidth
-del _CalcWidth
+@functools.lru_cache(maxsize=None)
+def wcwidth(c: str) -> int:
+    """the number of columns curses uses to draw the character `c`"""
+    return _wcwidth(ord(c))
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import bisect
+import collections
+from typing import Sequence
+from typing import Tuple
+
+Opcode = Tuple[str, int, int, int, int]
+
+# lines occurring more often than this are never used to anchor a match
+MAX_OCCURRENCES = 64
+
+
+def _unique_anchors(
+        a: Sequence[str],
+        b: Sequence[str],
+        alo: int, ahi: int,
+        blo: int, bhi: int,
+) -> list[tuple[int, int]]:
+    """`(i, j)` of lines which occur exactly once in both ranges, the longest
+    run of them which is in the same order on both sides
+
+    this is the "patience diff" heuristic: each unique line can only match
+    one line so the anchors are unambiguous and a single pass finds all of
+    them, instead of one match per pass
+    """
+    # line => index in `a`, or -1 if it is not unique
+    a_index: dict[str, int] = {}
+    for i in range(alo, ahi):
+        a_index[a[i]] = -1 if a[i] in a_index else i
+    b_index: dict[str, int] = {}
+    for j in range(blo, bhi):
+        if a_index.get(b[j], -1) != -1:
+            b_index[b[j]] = -1 if b[j] in b_index else j
+    pairs = [(a_index[line], j) for line, j in b_index.items() if j != -1]
+
+    # longest increasing subsequence (by `i`) with patience sorting, the
+    # first of the longest ones is used
+    tails: list[int] = []
+    tails_k: list[int] = []
+    prev = [-1] * len(pairs)
+    best = -1
+    for k, (i, _) in enumerate(pairs):
+        n = bisect.bisect_left(tails, i)
+        if n:
+            prev[k] = tails_k[n - 1]
+        if n == len(tails):
+            tails.append(i)
+            tails_k.append(k)
+            best = k
+        else:
+            tails[n] = i
+            tails_k[n] = k
+
+    ret = []
+    while best != -1:
+        ret.append(pairs[best])
+        best = prev[best]
+    ret.reverse()
+    return ret
+
+
+def _anchor(
+        a: Sequence[str],
+        b: Sequence[str],
+        alo: int, ahi: int,
+        blo: int, bhi: int,
+) -> tuple[int, int, int] | None:
+    """find the longest match around the rarest line common to both ranges
+
+    this is the "histogram diff" heuristic, used where no line is unique:
+    anchoring on rare lines keeps common lines (blank lines, closing
+    brackets, ...) from producing unhelpful alignments and does not require
+    comparing every pair of lines
+    """
+    positions = collections.defaultdict(list)
+    for i in range(alo, ahi):
+        positions[a[i]].append(i)
+
+    best: tuple[int, int, int] | None = None
+    best_count = MAX_OCCURRENCES + 1
+    j = blo
+    while j < bhi:
+        candidates = positions.get(b[j], ())
+        if not candidates or len(candidates) > best_count:
+            j += 1
+            continue
+
+        j_next = j + 1
+        for i in candidates:
+            start_i, start_j = i, j
+            while start_i > alo and start_j > blo and (
+                    a[start_i - 1] == b[start_j - 1]
+            ):
+                start_i -= 1
+                start_j -= 1
+            end_i, end_j = i + 1, j + 1
+            while end_i < ahi and end_j < bhi and a[end_i] == b[end_j]:
+                end_i += 1
+                end_j += 1
+
+            size = end_i - start_i
+            if (
+                    best is None or
+                    len(candidates) < best_count or
+                    size > best[2]
+            ):
+                best = (start_i, start_j, size)
+                best_count = len(candidates)
+            j_next = max(j_next, end_j)
+        j = j_next
+
+    return best
+
+
+def _matching_blocks(
+        a: Sequence[str],
+        b: Sequence[str],
+) -> list[tuple[int, int, int]]:
+    blocks = []
+    todo = [(0, len(a), 0, len(b))]
+    while todo:
+        alo, ahi, blo, bhi = todo.pop()
+
+        # common prefix and suffix are matched without any bookkeeping
+        prefix = 0
+        while (
+                alo + prefix < ahi and blo + prefix < bhi and
+                a[alo + prefix] == b[blo + prefix]
+        ):
+            prefix += 1
+        if prefix:
+            blocks.append((alo, blo, prefix))
+            alo, blo = alo + prefix, blo + prefix
+
+        suffix = 0
+        while (
+                alo < ahi - suffix and blo < bhi - suffix and
+                a[ahi - suffix - 1] == b[bhi - suffix - 1]
+        ):
+            suffix += 1
+        if suffix:
+            ahi, bhi = ahi - suffix, bhi - suffix
+            blocks.append((ahi, bhi, suffix))
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            # the lines between anchors are diffed separately, their common
+            # prefixes and suffixes extend the anchors' matches
+            for i, j in anchors:
+                blocks.append((i, j, 1))
+                todo.append((alo, i, blo, j))
+                alo, blo = i + 1, j + 1
+            todo.append((alo, ahi, blo, bhi))
+            continue
+
+        anchor = _anchor(a, b, alo, ahi, blo, bhi)
+        if anchor is not None:
+            i, j, size = anchor
+            blocks.append(anchor)
+            todo.append((alo, i, blo, j))
+            todo.append((i + size, ahi, j + size, bhi))
+
+    blocks.sort()
+    return blocks
+
+
+def get_opcodes(a: Sequence[str], b: Sequence[str]) -> list[Opcode]:
+    """like `difflib.SequenceMatcher(a=a, b=b).get_opcodes()` but faster"""
+    ret: list[Opcode] = []
+    i = j = 0
+    for ai, bj, size in (*_matching_blocks(a, b), (len(a), len(b), 0)):
+        if i < ai and j < bj:
+            ret.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            ret.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            ret.append(('insert', i, ai, j, bj))
+
+        if size and ret and ret[-1][0] == 'equal':
+            # adjacent blocks (a prefix, an anchor, a suffix) are merged
+            _, prev_i, _, prev_j, _ = ret.pop()
+            ret.append(('equal', prev_i, ai + size, prev_j, bj + size))
+        elif size:
+            ret.append(('equal', ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return ret
@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+import collections
+import os
+import queue
+import time
 from functools import wraps
 from json import dumps
 from json import loads
@@ -9,8 +13,47 @@ from subprocess import PIPE
 from subprocess import Popen
 from subprocess import STDOUT
 from threading import Thread
+from typing import Any
 from typing import Callable
+from typing import Iterator
+from typing import NamedTuple
 from typing import Optional
+from typing import Sequence
+
+from babi.buf import Buf
+from babi.buf import Modification
+
+# TODO select correct capabilities
+CAPABILITIES = {
+    'workspaceFolders': True,
+    'textDocument': {
+        'completion': {
+            'documentationFormat': ['plaintext'],
+            'insertTextModeSupport': [1],
+        },
+    },
+}
+
+# `TextDocumentSyncKind`: how the server wants document changes sent
+SYNC_NONE = 0
+SYNC_FULL = 1
+SYNC_INCREMENTAL = 2
+
+# document changes are collected for this long (in seconds) and then sent as
+# a single `didChange`
+SYNC_DELAY = .05
+
+# seconds to wait for a response before a request is cancelled
+REQUEST_TIMEOUT = 10.
+# a new request for one of these methods cancels the previous one
+SUPERSEDED = frozenset(('textDocument/completion', 'textDocument/definition'))
+
+# the server's output is read in chunks of this size
+READ_SIZE = 64 * 1024
+# decoded messages waiting for the ui, the reader waits while this is full
+MESSAGE_QUEUE_SIZE = 256
+# messages handled per wake up, so a flood does not hold up typing
+MESSAGES_PER_WAKE = 32
 
 
 @staticmethod
@@ -22,138 +65,563 @@ def requires_lsp(f):
     return decorator
 
 
+def _utf16_len(s: str) -> int:
+    # lsp positions count utf-16 code units by default
+    return len(s.encode('UTF-16-LE')) // 2
+
+
+def _lines(lines: Buf, lo: int, hi: int) -> Iterator[str]:
+    return (lines[i] for i in range(lo, hi))
+
+
+def content_change(
+        lines: Buf,
+        nl: str,
+        before: tuple[int, str],
+        modifications: Sequence[Modification],
+) -> dict[str, Any]:
+    """one ranged `contentChanges` entry for recorded `modifications`
+
+    `before` is the `(line count, last line)` of the document before the
+    modifications and `lines` are the lines after them.  the modified line
+    ranges are united, so the change replaces whole lines
+    """
+    assert modifications
+    first, *rest = modifications
+    lo = first.idx
+    # the end of the modified lines in the original and the current lines
+    old_hi = first.idx + len(first.lines)
+    hi = first.end
+    for modification in rest:
+        end = modification.idx + len(modification.lines)
+        if end > hi:
+            old_hi += end - hi
+        hi = max(hi, end) + (modification.end - end)
+        lo = min(lo, modification.idx)
+
+    before_len, before_last = before
+    if old_hi < before_len:
+        start = {'line': lo, 'character': 0}
+        stop = {'line': old_hi, 'character': 0}
+        text = ''.join(f'{line}{nl}' for line in _lines(lines, lo, hi))
+    else:
+        # the last line has no line ending, so the change starts at the end
+        # of the (unchanged) line before it
+        stop = {'line': before_len - 1, 'character': _utf16_len(before_last)}
+        if lo > 0:
+            start = {'line': lo - 1, 'character': _utf16_len(lines[lo - 1])}
+            text = ''.join(f'{nl}{line}' for line in _lines(lines, lo, hi))
+        else:
+            start = {'line': 0, 'character': 0}
+            text = nl.join(_lines(lines, lo, hi))
+    return {'range': {'start': start, 'end': stop}, 'text': text}
+
+
+def split_frames(buf: bytearray) -> list[bytes]:
+    """remove the complete messages from the start of `buf` and return their
+    bodies, a partial message is left for the next read
+    """
+    ret: list[bytes] = []
+    while True:
+        headers_end = buf.find(b'\r\n\r\n')
+        if headers_end == -1:
+            return ret
+
+        length = None
+        for header in bytes(buf[:headers_end]).split(b'\r\n'):
+            name, _, value = header.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        if length is None:
+            raise ValueError('Content-Length header not found')
+
+        body_start = headers_end + 4
+        if len(buf) < body_start + length:
+            return ret
+        ret.append(bytes(buf[body_start:body_start + length]))
+        del buf[:body_start + length]
+
+
+def _frame(obj: dict[str, Any]) -> bytes:
+    text = dumps(obj).encode('utf-8')
+    header = (
+        f'Content-Length: {len(text)}\r\n'
+        'Content-Type: application/vscode-jsonrpc; charset=utf-8\r\n'
+        '\r\n'
+    )
+    return header.encode() + text
+
+
+class _Change(NamedTuple):
+    uri: str
+    version: int
+    content_changes: list[dict[str, Any]]
+
+    def merge(self, other: _Change) -> _Change:
+        assert other.uri == self.uri, (other.uri, self.uri)
+        if 'range' not in other.content_changes[0]:  # full text
+            return other
+        else:
+            content_changes = [*self.content_changes, *other.content_changes]
+            return other._replace(content_changes=content_changes)
+
+
+class _Request(NamedTuple):
+    method: str
+    callback: Callable[[Any], None] | None
+    deadline: float | None
+
+
 class LSPClient(Thread):
 
-    def __init__(self, server_executable: list[str]) -> None:
+    def __init__(
+            self,
+            server_executable: list[str],
+            sync_delay: float = SYNC_DELAY,
+            request_timeout: float = REQUEST_TIMEOUT,
+    ) -> None:
         super().__init__()
         self.process: Popen | None = Popen(server_executable, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
         self.message_id: int = 0
-        self.opened_document: Path | None = None
-        self.document_version: int = 0
-        self.listeners: list[Callable[[dict], None]] = []
+        # uri => version of the open documents, a document opened by more
+        # than one file is closed along with the last of them
+        self.documents: dict[str, int] = {}
+        self._opened: collections.Counter[str] = collections.Counter()
+        # full text is sent until the server says it supports ranged changes
+        self.sync_kind = SYNC_FULL
+        # requests waiting for a response by id, responses to anything else
+        # (cancelled or timed out requests) are dropped
+        self.request_timeout = request_timeout
+        self._requests: dict[int, _Request] = {}
+        self.listeners: list[Callable[[dict[str, Any]], None]] = []
         self.running: bool = True
+        # messages are written by a separate thread so the editor never
+        # blocks on a slow server, `None` stops it
+        self.sync_delay = sync_delay
+        self._queue: queue.Queue[bytes | _Change | None] = queue.Queue()
+        self._writer = Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        # messages are decoded by this thread and handled by the ui in
+        # `handle_messages`, a byte is written to the pipe to wake it up
+        self._messages: queue.Queue[dict[str, Any]]
+        self._messages = queue.Queue(MESSAGE_QUEUE_SIZE)
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
         self.start()
 
+    def fileno(self) -> int:
+        """readable when there are messages to handle"""
+        return self._wake_r
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_w, b'.')
+        except BlockingIOError:  # already readable
+            pass
+
     def run(self) -> None:
+        buf = bytearray()
         while self.running:
-            content = loads(self.__read_response())
-            for listener in self.listeners:
-                listener(content)
+            data = self.process.stdout.read1(READ_SIZE)
+            if not data:  # the server exited
+                break
+            buf += data
+            for body in split_frames(buf):
+                content = loads(body)
+                while self.running:
+                    try:
+                        self._messages.put(content, timeout=.1)
+                    except queue.Full:
+                        continue
+                    else:
+                        self._wake()
+                        break
+
+    def handle_messages(self, limit: int = MESSAGES_PER_WAKE) -> None:
+        """call listeners and response callbacks for (at most `limit`)
+        received messages, this is called by the ui thread
+        """
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        for _ in range(limit):
+            try:
+                content = self._messages.get_nowait()
+            except queue.Empty:
+                return
+            if 'method' in content:  # a notification or a server request
+                for listener in self.listeners:
+                    listener(content)
+            else:
+                self._handle_response(content)
+
+        if not self._messages.empty():  # handle the rest on the next wake up
+            self._wake()
+
+    def _handle_response(self, content: dict[str, Any]) -> None:
+        request = self._requests.pop(content['id'], None)
+        if (
+                request is None or
+                request.callback is None or
+                'error' in content or
+                (
+                    request.deadline is not None and
+                    time.monotonic() > request.deadline
+                )
+        ):
+            return
+        request.callback(content.get('result'))
 
-    def register_listener(self, listener: Callable[[dict], None]) -> None:
+    def _expire_requests(self) -> None:
+        now = time.monotonic()
+        expired = [
+            message_id
+            for message_id, request in self._requests.items()
+            if request.deadline is not None and now > request.deadline
+        ]
+        for message_id in expired:
+            del self._requests[message_id]
+            self._notify('$/cancelRequest', {'id': message_id})
+
+    def _set_capabilities(self, capabilities: dict[str, Any]) -> None:
+        sync = capabilities.get('textDocumentSync', SYNC_NONE)
+        if isinstance(sync, dict):
+            sync = sync.get('change', SYNC_NONE)
+        self.sync_kind = sync
+
+    def register_listener(
+            self,
+            listener: Callable[[dict[str, Any]], None],
+    ) -> None:
         self.listeners.append(listener)
 
-    def __build_message(self, method: str, param: dict | None) -> bytes:
-        obj = {'jsonrpc': '2.0', 'id': self.message_id, 'method': method, 'params': param}
-        text = dumps(obj)
-        return bytes(
-            'Content-Length: {length}\r\nContent-Type: application/vscode-jsonrpc; charset=utf-8\r\n\r\n{text}'.format(
-                length=len(text), text=text,
-            ), 'utf-8',
-        )
+    def _request(
+            self,
+            method: str,
+            params: dict[str, Any] | None,
+            callback: Callable[[Any], None] | None = None,
+            timeout: float | None = -1.,
+    ) -> int:
+        """send a request, `callback` is called (by `handle_messages`) with
+        the result unless the request is cancelled or takes longer than
+        `timeout` (`request_timeout` by default, `None` to wait forever)
+        """
+        if timeout == -1.:
+            timeout = self.request_timeout
+        self._expire_requests()
+
+        message_id = self.message_id
+        self.message_id += 1
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time.monotonic() + timeout
 
-    def __send_message(self, message: bytes) -> None:
+        if method in SUPERSEDED:
+            superseded = [
+                other_id
+                for other_id, request in self._requests.items()
+                if request.method == method
+            ]
+            for other_id in superseded:
+                del self._requests[other_id]
+                self._notify('$/cancelRequest', {'id': other_id})
+        self._requests[message_id] = _Request(method, callback, deadline)
+
+        obj = {
+            'jsonrpc': '2.0', 'id': message_id,
+            'method': method, 'params': params,
+        }
+        self._queue.put(_frame(obj))
+        return message_id
+
+    def _notify(self, method: str, params: dict[str, Any] | None) -> None:
+        obj = {'jsonrpc': '2.0', 'method': method, 'params': params}
+        self._queue.put(_frame(obj))
+
+    def _write(self, message: bytes) -> None:
         self.process.stdin.write(message)
         self.process.stdin.flush()
 
-    def __read_response(self) -> str:
-        content_size = None
-        while True:
-            line = self.process.stdout.readline().decode('utf-8').strip()
-            if not line:
-                if not content_size:
-                    raise ValueError('Content-Length header not found')
+    def _write_change(self, change: _Change) -> None:
+        document = {'version': change.version, 'uri': change.uri}
+        obj = {
+            'jsonrpc': '2.0',
+            'method': 'textDocument/didChange',
+            'params': {
+                'textDocument': document,
+                'contentChanges': change.content_changes,
+            },
+        }
+        self._write(_frame(obj))
+
+    def _write_loop(self) -> None:
+        """write queued messages, collecting document changes for
+        `sync_delay` -- any other message (such as a request, which needs the
+        server to have the latest text) flushes the changes first
+        """
+        pending: _Change | None = None
+        deadline = 0.
+        try:
+            while True:
+                if pending is None:
+                    timeout = None
                 else:
-                    break
-            if 'Content-Length' in line:
-                content_size = int(line.split(': ')[1])
-        content = self.process.stdout.read(content_size).decode('utf-8')
-        return content
+                    timeout = max(deadline - time.monotonic(), 0)
+
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    assert pending is not None
+                    self._write_change(pending)
+                    pending = None
+                    continue
+
+                if isinstance(item, _Change):
+                    if pending is None:
+                        pending = item
+                        deadline = time.monotonic() + self.sync_delay
+                    elif pending.uri == item.uri:
+                        pending = pending.merge(item)
+                    else:  # another document, keep the changes in order
+                        self._write_change(pending)
+                        pending = item
+                        deadline = time.monotonic() + self.sync_delay
+                    continue
+
+                if pending is not None:
+                    self._write_change(pending)
+                    pending = None
+                if item is None:
+                    return
+                else:
+                    self._write(item)
+        except (OSError, ValueError):  # the server went away
+            return
 
     # TODO maybe change the way workspaces are declared
-    def initialize(self, capabilities: dict) -> None:
+    def initialize(
+            self,
+            capabilities: dict[str, Any],
+            callback: Callable[[Any], None] | None = None,
+    ) -> None:
         workspaceFolders = [environ["WORKSPACE_ROOT"]] if environ.get("WORKSPACE_ROOT") is not None else []
-        message = self.__build_message(
+
+        def initialized(result: Any) -> None:
+            self._set_capabilities(result.get('capabilities', {}))
+            if callback is not None:
+                callback(result)
+
+        self._request(
             'initialize',
             {
                 'processId': getpid(), 'clientInfo': {'client': 'babi', 'version': '1.0'},
                 'locale': 'en', 'capabilities': capabilities, 'trace': 'verbose',
                 'workspaceFolders': workspaceFolders,
             },
+            initialized,
+            # servers may take a while to start up
+            timeout=None,
         )
-        self.message_id += 1
-        self.__send_message(message)
 
-    def open_document(self, file: Path) -> None:
-        message = self.__build_message(
+    def open_document(self, uri: str, text: str) -> None:
+        self._opened[uri] += 1
+        if self._opened[uri] > 1:
+            return
+        self.documents[uri] = 0
+        self._notify(
             'textDocument/didOpen', {
                 'textDocument': {
-                    'uri': file.resolve().as_uri(), 'languageId': 'python', 'version': self.message_id,
-                    'text': file.read_text(),
+                    'uri': uri, 'languageId': 'python', 'version': 0,
+                    'text': text,
                 },
             },
         )
-        self.message_id += 1
-        self.opened_document = file.resolve()
-        self.document_version = 0
-        self.__send_message(message)
 
-    def change_document(self, content: str) -> None:
-        message = self.__build_message(
-            'textDocument/didChange',
-            {
-                'textDocument': {'version': self.document_version, 'uri': self.opened_document.as_uri()},
-                'contentChanges': [{'text': content}],
-            },
-        )
-        self.message_id += 1
-        self.__send_message(message)
+    def change_document(
+            self,
+            uri: str,
+            changes: list[dict[str, Any]],
+            text: Callable[[], str],
+    ) -> None:
+        """queue the ranged `changes`, or the full `text()` if the server
+        does not support incremental sync
 
-    def close_document(self) -> None:
-        message = self.__build_message('textDocument/didClose', {'textDocument': {'uri': self.opened_document.as_uri()}})
-        self.message_id += 1
-        self.__send_message(message)
+        changes are batched into one `didChange` by the writer thread
+        """
+        if uri not in self.documents or self.sync_kind == SYNC_NONE:
+            return
+        elif self.sync_kind == SYNC_INCREMENTAL:
+            content_changes = changes
+        else:
+            content_changes = [{'text': text()}]
+
+        self.documents[uri] += 1
+        self._queue.put(_Change(uri, self.documents[uri], content_changes))
+
+    def close_document(self, uri: str) -> None:
+        self._opened[uri] -= 1
+        if self._opened[uri] > 0:
+            return
+        del self._opened[uri], self.documents[uri]
+        self._notify('textDocument/didClose', {'textDocument': {'uri': uri}})
 
     def initialized(self) -> None:
-        message = self.__build_message('initialized', {})
-        self.message_id += 1
-        self.__send_message(message)
+        self._notify('initialized', {})
 
-    def get_definition(self, cursor_row: int, cursor_column: int) -> None:
-        message = self.__build_message(
+    def get_definition(
+            self,
+            uri: str,
+            cursor_row: int,
+            cursor_column: int,
+            callback: Callable[[Any], None],
+    ) -> None:
+        self._request(
             'textDocument/definition', {
-                'textDocument': {'uri': self.opened_document.as_uri()},
+                'textDocument': {'uri': uri},
                 'position': {
                     'line': cursor_row,
                     'character': cursor_column,
                 },
                 'workDoneToken': None, 'partialResultToken': None,
             },
+            callback,
         )
-        self.message_id += 1
-        self.__send_message(message)
 
-    def get_autocompletion(self, row: int, column: int) -> None:
-        message = self.__build_message(
+    def get_autocompletion(
+            self,
+            uri: str,
+            row: int,
+            column: int,
+            callback: Callable[[Any], None],
+    ) -> None:
+        self._request(
             'textDocument/completion', {
-                'textDocument': {'uri': self.opened_document.as_uri()},
+                'textDocument': {'uri': uri},
                 'position': {'line': row, 'character': column}, 'workDoneToken': None, 'partialResultToken': None,
             },
+            callback,
         )
-        self.message_id += 1
-        self.__send_message(message)
 
-    def get_diagnostics(self) -> None:
-        message = self.__build_message(
+    def get_diagnostics(self, uri: str) -> None:
+        self._request(
             'textDocument/diagnostic', {
-                'textDocument': {'uri': self.opened_document.as_uri()},
+                'textDocument': {'uri': uri},
                 'identifier': None, 'previousResultId': None, 'workDoneToken': None, 'partialResultToken': None,
             },
         )
-        self.message_id += 1
-        self.__send_message(message)
 
     def shutdown(self) -> None:
         self.running = False
-        self.__send_message(self.__build_message('shutdown', None))
-        self.__send_message(self.__build_message('exit', None))
+        self._request('shutdown', None, timeout=None)
+        self._notify('exit', None)
+        self._queue.put(None)
+        # the server may take a while to exit, don't block the ui on it
+        self._closer = Thread(target=self._close, daemon=True)
+        self._closer.start()
+
+    def _close(self) -> None:
+        """close the pipes once the server exited and nothing uses them"""
+        self._writer.join()
+        self.join()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+
+class LSPDocument(NamedTuple):
+    """a file opened in a (possibly shared) language server"""
+    client: LSPClient
+    uri: str
+
+    def change_document(
+            self,
+            changes: list[dict[str, Any]],
+            text: Callable[[], str],
+    ) -> None:
+        self.client.change_document(self.uri, changes, text)
+
+    def get_definition(
+            self,
+            cursor_row: int,
+            cursor_column: int,
+            callback: Callable[[Any], None],
+    ) -> None:
+        self.client.get_definition(
+            self.uri, cursor_row, cursor_column, callback,
+        )
+
+    def get_autocompletion(
+            self,
+            row: int,
+            column: int,
+            callback: Callable[[Any], None],
+    ) -> None:
+        self.client.get_autocompletion(self.uri, row, column, callback)
+
+    def get_diagnostics(self) -> None:
+        self.client.get_diagnostics(self.uri)
+
+
+class LSPServers:
+    """the running language servers, one per `(command, workspace root)`
+
+    files using the same server share its process, which is shut down when
+    the last of their documents is closed
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[tuple[tuple[str, ...], str | None], LSPClient]
+        self._clients = {}
+        self.listeners: list[Callable[[dict[str, Any]], None]] = []
+
+    @property
+    def clients(self) -> tuple[LSPClient, ...]:
+        return tuple(self._clients.values())
+
+    def register_listener(
+            self,
+            listener: Callable[[dict[str, Any]], None],
+    ) -> None:
+        self.listeners.append(listener)
+        for client in self._clients.values():
+            client.register_listener(listener)
+
+    def open_document(
+            self,
+            command: list[str],
+            path: Path,
+            text: str,
+    ) -> LSPDocument:
+        key = (tuple(command), environ.get('WORKSPACE_ROOT'))
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = LSPClient(command)
+            for listener in self.listeners:
+                client.register_listener(listener)
+            client.initialize(CAPABILITIES)
+            client.initialized()
+
+        uri = path.resolve().as_uri()
+        client.open_document(uri, text)
+        return LSPDocument(client, uri)
+
+    def close_document(self, document: LSPDocument) -> None:
+        document.client.close_document(document.uri)
+        if not document.client.documents:
+            document.client.shutdown()
+            self._clients = {
+                k: v for k, v in self._clients.items()
+                if v is not document.client
+            }
+
+    def shutdown(self) -> None:
+        for client in self._clients.values():
+            client.shutdown()
+        self._clients.clear()
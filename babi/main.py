@@ -25,25 +25,18 @@ POSITION_RE = re.compile(r'^\+-?\d+$')
 def _edit(screen: Screen, stdin: str) -> EditResult:
     screen.file.ensure_loaded(screen.status, screen.layout.file, stdin)
 
-    # TODO select correct capabilities
-    if screen.file.lsp is not None:
-        screen.file.lsp.initialize({
-            "workspaceFolders": True,
-            "textDocument": {
-                "completion": {
-                    "documentationFormat": ["plaintext"],
-                    "insertTextModeSupport": [1],
-                    
-                }
-            }
-        })
-        screen.file.lsp.initialized()
-        screen.file.lsp.open_document(Path(screen.file.filename))
+    if screen.file.lsp is None and screen.file.lsp_server is not None:
+        assert screen.file.filename is not None
+        screen.file.lsp = screen.lsp_servers.open_document(
+            screen.file.lsp_server,
+            Path(screen.file.filename),
+            screen.file.nl.join(screen.file.buf),
+        )
 
     while True:
         screen.status.tick(screen.layout.file)
-        screen.draw()
-        screen.file.move_cursor(screen.stdscr, screen.layout.file)
+        screen.render()
+        screen.idle()
         key = screen.get_char()
         keyname = key.keyname
         if screen.file.autocomplete.active and keyname == b'KEY_UP':
@@ -64,7 +57,9 @@ def _edit(screen: Screen, stdin: str) -> EditResult:
         elif key.keyname == b'STRING':
             assert isinstance(key.wch, str), key.wch
             if screen.file.autocomplete.active:
-                screen.file.autocomplete.fetch_suggestions(screen.file.lsp)
+                screen.file.autocomplete.fetch_suggestions(
+                    screen.file.lsp, screen.show_suggestions,
+                )
             #elif not re.compile("\\w").match(key.wch):
             #    screen.start_autocomplete()
             screen.file.c(key.wch, screen.layout.file)
@@ -111,6 +106,7 @@ def c_main(
                 screen.i = len(screen.files) - 1
             else:
                 raise AssertionError(f'unreachable {res}')
+    screen.lsp_servers.shutdown()
     return 0
 
 
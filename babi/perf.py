@@ -12,6 +12,15 @@ class Perf:
         self._records: list[tuple[str, float]] = []
         self._name: str | None = None
         self._time: float | None = None
+        # frame counters are kept whether or not profiling is enabled
+        self._started = time.monotonic()
+        self.frames = 0
+        self.frames_skipped = 0
+        # when the oldest input not yet on screen was read
+        self._input_time: float | None = None
+        self._latency_count = 0
+        self._latency_total = 0.
+        self.latency_max = 0.
 
     def start(self, name: str) -> None:
         if self._prof:
@@ -28,6 +37,33 @@ class Perf:
             self._records.append((self._name, time.monotonic() - self._time))
             self._name = self._time = None
 
+    def input_read(self) -> None:
+        if self._input_time is None:
+            self._input_time = time.monotonic()
+
+    def frame(self, *, skipped: bool = False) -> None:
+        """a frame was drawn (or skipped because more input was pending)"""
+        if skipped:
+            self.frames_skipped += 1
+            return
+
+        self.frames += 1
+        if self._input_time is not None:
+            latency = time.monotonic() - self._input_time
+            self._latency_count += 1
+            self._latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self._input_time = None
+
+    @property
+    def fps(self) -> float:
+        return self.frames / (time.monotonic() - self._started)
+
+    @property
+    def latency_mean(self) -> float:
+        """seconds from reading input until it was drawn"""
+        return self._latency_total / max(self._latency_count, 1)
+
     def init_profiling(self) -> None:
         self._prof = cProfile.Profile()
         self.start('startup')
@@ -39,6 +75,13 @@ class Perf:
             f.write('μs\tevent\n')
             for name, duration in self._records:
                 f.write(f'{int(duration * 1000 * 1000)}\t{name}\n')
+        with open(f'{filename}.frames', 'w', encoding='UTF-8') as f:
+            f.write('frames\tskipped\tfps\tmean μs\tmax μs\n')
+            f.write(
+                f'{self.frames}\t{self.frames_skipped}\t{self.fps:.1f}\t'
+                f'{int(self.latency_mean * 1000 * 1000)}\t'
+                f'{int(self.latency_max * 1000 * 1000)}\n',
+            )
 
 
 @contextlib.contextmanager
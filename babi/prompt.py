@@ -138,6 +138,8 @@ class Prompt:
                 for c in key.wch:
                     reverse_s += c
                     failed, idx = self._check_failed(idx, reverse_s)
+            elif key.keyname == b'LSP':  # handled while waiting for input
+                pass
             else:
                 self._x = len(self._s)
                 return None
@@ -148,6 +150,9 @@ class Prompt:
     def _submit(self) -> str:
         return self._s
 
+    def _lsp_messages(self) -> None:
+        """messages were handled while waiting, the prompt stays open"""
+
     DISPATCH = {
         # movement
         b'KEY_UP': _up,
@@ -169,6 +174,7 @@ class Prompt:
         b'^R': _reverse_search,
         b'^M': _submit,
         b'^C': _cancel,
+        b'LSP': _lsp_messages,
     }
 
     def _c(self, c: str) -> None:
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import collections
+import contextlib
 import functools
 import re
+import time
+from typing import Generator
 from typing import Match
 
 import onigurumacffi
@@ -30,11 +34,11 @@ _FLAGS = {
 
 class _Reg:
     def __init__(self, s: str) -> None:
-        self._pattern = s
-        self._reg = onigurumacffi.compile(self._pattern)
+        self.pattern = s
+        self._reg = onigurumacffi.compile(self.pattern)
 
     def __repr__(self) -> str:
-        return f'{type(self).__name__}({self._pattern!r})'
+        return f'{type(self).__name__}({self.pattern!r})'
 
     def search(
             self,
@@ -74,10 +78,131 @@ class _RegSet:
         return self._set.search(line, pos, flags=_FLAGS[first_line, boundary])
 
 
+class RegStats:
+    """timings and counts collected while `collect_stats` is active
+
+    everything is keyed by the rule the regex was made for, so the same
+    pattern in different rules (or grammars) is counted separately
+    """
+
+    def __init__(self) -> None:
+        # keyed by `(rule, pattern)`
+        self.compile_time: dict[tuple[str, str], float]
+        self.compile_time = collections.defaultdict(float)
+        # keyed by `(rule, patterns)` (a single pattern for a `_Reg`)
+        self.searches: collections.Counter[tuple[str, tuple[str, ...]]]
+        self.searches = collections.Counter()
+        self.search_time: dict[tuple[str, tuple[str, ...]], float]
+        self.search_time = collections.defaultdict(float)
+        # keyed by `(rule, pattern)`
+        self.matches: collections.Counter[tuple[str, str]]
+        self.matches = collections.Counter()
+
+
+class _ProfiledReg(_Reg):
+    def __init__(self, s: str, rule: str, stats: RegStats) -> None:
+        self._rule = rule
+        self._stats = stats
+        t0 = time.perf_counter()
+        super().__init__(s)
+        stats.compile_time[rule, s] += time.perf_counter() - t0
+
+    def _record(self, t0: float, match: Match[str] | None) -> None:
+        key = (self._rule, (self.pattern,))
+        self._stats.searches[key] += 1
+        self._stats.search_time[key] += time.perf_counter() - t0
+        if match is not None:
+            self._stats.matches[self._rule, self.pattern] += 1
+
+    def search(
+            self,
+            line: str,
+            pos: int,
+            first_line: bool,
+            boundary: bool,
+    ) -> Match[str] | None:
+        t0 = time.perf_counter()
+        ret = super().search(line, pos, first_line, boundary)
+        self._record(t0, ret)
+        return ret
+
+    def match(
+            self,
+            line: str,
+            pos: int,
+            first_line: bool,
+            boundary: bool,
+    ) -> Match[str] | None:
+        t0 = time.perf_counter()
+        ret = super().match(line, pos, first_line, boundary)
+        self._record(t0, ret)
+        return ret
+
+
+class _ProfiledRegSet(_RegSet):
+    def __init__(self, *s: str, rule: str, stats: RegStats) -> None:
+        self._rule = rule
+        self._stats = stats
+        t0 = time.perf_counter()
+        super().__init__(*s)
+        elapsed = (time.perf_counter() - t0) / max(len(s), 1)
+        for pattern in s:
+            stats.compile_time[rule, pattern] += elapsed
+
+    def search(
+            self,
+            line: str,
+            pos: int,
+            first_line: bool,
+            boundary: bool,
+    ) -> tuple[int, Match[str] | None]:
+        t0 = time.perf_counter()
+        idx, match = super().search(line, pos, first_line, boundary)
+        key = (self._rule, self._patterns)
+        self._stats.searches[key] += 1
+        self._stats.search_time[key] += time.perf_counter() - t0
+        if match is not None:
+            self._stats.matches[self._rule, self._patterns[idx]] += 1
+        return idx, match
+
+
 def expand_escaped(match: Match[str], s: str) -> str:
     return _BACKREF_RE.sub(lambda m: f'{m[1]}{re.escape(match[int(m[2])])}', s)
 
 
-make_reg = functools.lru_cache(maxsize=None)(_Reg)
-make_regset = functools.lru_cache(maxsize=None)(_RegSet)
+_stats: RegStats | None = None
+_make_reg = functools.lru_cache(maxsize=None)(_Reg)
+_make_regset = functools.lru_cache(maxsize=None)(_RegSet)
+_make_profiled_reg = functools.lru_cache(maxsize=None)(_ProfiledReg)
+_make_profiled_regset = functools.lru_cache(maxsize=None)(_ProfiledRegSet)
+
+
+def make_reg(s: str, *, rule: str = '') -> _Reg:
+    """`rule` names what the regex is for in `collect_stats`"""
+    if _stats is None:
+        return _make_reg(s)
+    else:
+        return _make_profiled_reg(s, rule, _stats)
+
+
+def make_regset(*s: str, rule: str = '') -> _RegSet:
+    if _stats is None:
+        return _make_regset(*s)
+    else:
+        return _make_profiled_regset(*s, rule=rule, stats=_stats)
+
+
+@contextlib.contextmanager
+def collect_stats() -> Generator[RegStats, None, None]:
+    """profile regexes made while active (compile grammars inside this)"""
+    global _stats
+    stats = _stats = RegStats()
+    try:
+        yield stats
+    finally:
+        _stats = None
+        _make_profiled_reg.cache_clear()
+        _make_profiled_regset.cache_clear()
+
+
 ERR_REG = make_reg('$ ^')
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from typing import NamedTuple
+from typing import Sequence
+from typing import Tuple
+
+from babi.buf import Buf
+from babi.buf import CHUNKED_LINES
+from babi.chunked_list import ChunkedList
+from babi.dim import Dim
+from babi.hl.interface import ATTRS
+from babi.hl.interface import FileHL
+from babi.hl.interface import HLs
+
+# `(x, n, attr)` arguments of `chgat`
+Span = Tuple[int, int, int]
+
+
+class _Row(NamedTuple):
+    line: str
+    l_x: int
+    width: int
+    tab_size: int
+    text: str
+    regions: tuple[HLs, ...] | None
+    spans: tuple[Span, ...]
+
+
+def _spans(
+        positions: Sequence[int],
+        file_hls: tuple[FileHL, ...],
+        regions: tuple[HLs, ...],
+        l_x: int,
+        width: int,
+) -> tuple[Span, ...]:
+    ret = []
+    l_x_max = l_x + width
+    for file_hl, hls_packed in zip(file_hls, regions):
+        # regions are packed as flat `(x, end, attr index)` triples
+        hls = iter(hls_packed)
+        for x, end, attr_idx in zip(hls, hls, hls):
+            r_x = positions[x]
+            # the selection highlight intentionally extends one past the end
+            # of the line, which won't have a position
+            if end == len(positions):
+                r_end = positions[-1] + 1
+            else:
+                r_end = positions[end]
+
+            if r_x >= l_x_max:
+                break
+            elif r_end <= l_x:
+                continue
+
+            if l_x and r_x <= l_x:
+                if file_hl.include_edge:
+                    h_s_x = 0
+                else:
+                    h_s_x = 1
+            else:
+                h_s_x = r_x - l_x
+
+            if r_end >= l_x_max and l_x_max < positions[-1]:
+                if file_hl.include_edge:
+                    h_e_x = width
+                else:
+                    h_e_x = width - 1
+            else:
+                h_e_x = r_end - l_x
+
+            ret.append((h_s_x, h_e_x - h_s_x, ATTRS[attr_idx]))
+    return tuple(ret)
+
+
+class RenderCache:
+    """the displayed text and highlight spans of each line
+
+    a line's row is reused while it is drawn with the same content, scroll
+    offset, width and tab size (and the same highlight regions), buf
+    callbacks keep rows aligned with their lines and forget changed lines
+    """
+
+    def __init__(self, file_hls: tuple[FileHL, ...]) -> None:
+        self._file_hls = file_hls
+        self._rows: list[_Row | None] | ChunkedList[_Row | None] = []
+
+    def _set_cb(self, buf: Buf, idx: int, victim: str) -> None:
+        if idx < len(self._rows):
+            self._rows[idx] = None
+
+    def _del_cb(self, buf: Buf, idx: int, victim: str) -> None:
+        if idx < len(self._rows):
+            del self._rows[idx]
+
+    def _ins_cb(self, buf: Buf, idx: int) -> None:
+        if idx < len(self._rows):
+            self._rows.insert(idx, None)
+
+    def _splice_cb(
+            self,
+            buf: Buf,
+            idx: int,
+            victims: list[str],
+            n: int,
+    ) -> None:
+        if idx < len(self._rows):
+            self._rows[idx:idx + len(victims)] = [None] * n
+
+    def register_callbacks(self, buf: Buf) -> None:
+        # like the lines of long files, rows are shifted by every line
+        # inserted or deleted above them
+        if len(buf) >= CHUNKED_LINES:
+            self._rows = ChunkedList()
+        buf.add_set_callback(self._set_cb)
+        buf.add_del_callback(self._del_cb)
+        buf.add_ins_callback(self._ins_cb)
+        buf.add_splice_callback(self._splice_cb)
+
+    def row(
+            self,
+            buf: Buf,
+            idx: int,
+            dim: Dim,
+            l_x: int,
+            regions: tuple[HLs, ...],
+    ) -> tuple[str, tuple[Span, ...]]:
+        """`(text, spans)` to draw line `idx` scrolled to `l_x` with"""
+        if idx >= len(self._rows):
+            self._rows.extend([None] * (1 + idx - len(self._rows)))
+        row = self._rows[idx]
+
+        if (
+                row is None or
+                row.line != buf[idx] or
+                row.l_x != l_x or
+                row.width != dim.width or
+                row.tab_size != buf.tab_size
+        ):
+            text = buf.rendered_line(idx, dim)
+            row = _Row(buf[idx], l_x, dim.width, buf.tab_size, text, None, ())
+
+        if row.regions != regions:
+            positions = buf.line_positions(idx)
+            spans = _spans(positions, self._file_hls, regions, l_x, dim.width)
+            row = row._replace(regions=regions, spans=spans)
+
+        self._rows[idx] = row
+        return row.text, row.spans
@@ -3,15 +3,17 @@ from __future__ import annotations
 import contextlib
 import curses
 import enum
+import functools
 import hashlib
 import os
 import re
+import select
 import signal
 import sre_parse
 import subprocess
 import sys
-from json import dumps
 from types import FrameType
+from typing import Any
 from typing import Callable
 from typing import Generator
 from typing import NamedTuple
@@ -27,6 +29,8 @@ from babi.history import History
 from babi.hl.syntax import Syntax
 from babi.linters.flake8 import Flake8
 from babi.linters.pre_commit import PreCommit
+from babi.lsp import LSPDocument
+from babi.lsp import LSPServers
 from babi.lsp import requires_lsp
 from babi.perf import Perf
 from babi.proc import graceful_terminate
@@ -112,6 +116,9 @@ KEYNAME_REWRITE = {
 
 LINTER_TYPES: tuple[type[linting.Linter], ...] = (PreCommit, Flake8)
 
+# number of lines highlighted between checks for input while idle
+IDLE_HIGHLIGHT_LINES = 256
+
 
 def _get_wch_with_retry(stdscr: curses._CursesWindow) -> str | int:
     while True:
@@ -180,41 +187,31 @@ class Screen:
         self.cut_selection = False
         self._buffered_input: int | str | None = None
         self._retheme = False
+        # the file whose rows are currently on the screen
+        self._drawn_file: File | None = None
+        # a frame was skipped so the screen does not show the latest edits
+        self._frame_skipped = False
         self._linters = tuple(tp() for tp in LINTER_TYPES)
-        if self.file.lsp is not None:
-            self.file.lsp.register_listener(lambda content: self.handle_listener(content))
+        self.lsp_servers = LSPServers()
+        self.lsp_servers.register_listener(self.handle_listener)
 
-    def handle_listener(self, content: dict) -> None:
+    def handle_listener(self, content: dict[str, Any]) -> None:
         match content.get('method'):
             case 'textDocument/publishDiagnostics':
-                self.file.diagnostics.diagnostics = content['params']
+                # servers are shared, so these may be for any open file
+                params = content['params']
+                for file in self.files:
+                    if file.lsp is not None and file.lsp.uri == params['uri']:
+                        file.diagnostics.diagnostics = params
             case '$/progress':
-                match content['params']['value']['kind']:
+                params = content['params']
+                token, value = params['token'], params['value']
+                progress = self.file.progressManager
+                match value['kind']:
                     case 'begin':
-                        self.file.progressManager.add_progress(content['params']['token'], content['params']['value']['title'])
+                        progress.add_progress(token, value['title'])
                     case 'end':
-                        self.file.progressManager.set_completed(content['params']['token'])
-            case 'textDocument/definition':
-                definition = content['result']
-                if len(definition) != 0:
-                    uri = definition[0]['uri']
-                    position = definition[0]['range']['start']
-                    # TODO allow accessing other files
-                    if self.file.file.lsp.opened_document.as_uri() == uri:
-                        self.file.file.go_to_line(position['line'] + 1, self.file.layout.file)
-                        self.file.file.buf.x = position['character']
-                    else:
-                        self.status.update(f'Definition is in external file {uri}')
-                else:
-                    self.status.update('No definition found')
-            case None:
-                # Assume it's a code completion hint
-                if 'isIncomplete' in dumps(content):
-                    self.file.autocomplete.suggestions = content['result']['items']
-                    self.draw()
-                # Assume it's a initialisation response
-                elif 'capabilities' in dumps(content):
-                    pass
+                        progress.set_completed(token)
             case _:
                 print(content)
                 # self.status.update(content)
@@ -223,9 +220,48 @@ class Screen:
     def file(self) -> File:
         return self.files[self.i]
 
+    def _definition(
+            self,
+            file: File,
+            document: LSPDocument,
+            result: Any,
+    ) -> None:
+        # the answer is for a file (or a document of it) left since
+        if file is not self.file or file.lsp is not document:
+            return
+
+        # a `Location`, a list of them or of `LocationLink`s
+        if isinstance(result, dict):
+            result = [result]
+        if result:
+            location = result[0]
+            uri = location.get('targetUri', location.get('uri'))
+            range_ = location.get(
+                'targetSelectionRange', location.get('range'),
+            )
+            position = range_['start']
+            # TODO allow accessing other files
+            if document.uri == uri:
+                file.go_to_line(position['line'] + 1, self.layout.file)
+                file.buf.x = position['character']
+            else:
+                self.status.update(f'Definition is in external file {uri}')
+        else:
+            self.status.update('No definition found')
+
     @requires_lsp
-    def definition(self):
-        self.file.lsp.get_definition(self.file.buf.y, self.file.buf.x)
+    def definition(self) -> None:
+        file, document = self.file, self.file.lsp
+        assert document is not None
+        callback = functools.partial(self._definition, file, document)
+        document.get_definition(file.buf.y, file.buf.x, callback)
+
+    def show_suggestions(self, result: Any) -> None:
+        # a `CompletionList` or a list of `CompletionItem`s
+        if isinstance(result, dict):
+            result = result['items']
+        if self.file.autocomplete.active:
+            self.file.autocomplete.suggestions = result or []
 
     def _draw_header(self, dim: Dim) -> None:
         filename = self.file.filename or '<<new file>>'
@@ -320,6 +356,10 @@ class Screen:
         return wch
 
     def _get_char(self) -> Key:
+        # waiting may buffer the input which arrived, so check for it after
+        if self._handle_lsp_messages():
+            return Key(-1, b'LSP')
+
         if self._buffered_input is not None:
             wch, self._buffered_input = self._buffered_input, None
         elif self._retheme:
@@ -343,20 +383,105 @@ class Screen:
         keyname = KEYNAME_REWRITE.get(keyname, keyname)
         return Key(wch, keyname)
 
+    def input_pending(self) -> bool:
+        """whether input is ready (it is buffered for the next `get_char`)"""
+        if self._buffered_input is not None or self._retheme:
+            return True
+
+        self.stdscr.nodelay(True)
+        try:
+            self._buffered_input = self.stdscr.get_wch()
+        except curses.error:
+            return False
+        else:
+            return True
+        finally:
+            self.stdscr.nodelay(False)
+
+    def _handle_lsp_messages(self) -> bool:
+        """wait for input or language server messages and handle the
+        messages, input always goes first so typing is never held up
+        """
+        clients = self.lsp_servers.clients
+        if not clients:
+            return False
+
+        while not self.input_pending():
+            # curses queues resizes itself so check for those every so often
+            readable, _, _ = select.select((sys.stdin, *clients), (), (), .1)
+            if sys.stdin in readable:  # read by the caller
+                return False
+            elif readable:
+                for client in clients:
+                    if client in readable:
+                        client.handle_messages()
+                return True
+        return False
+
+    def render(self) -> None:
+        """draw a frame, unless more input is pending
+
+        all the input which has arrived is processed before drawing once so
+        held keys and pastes don't redraw the screen for every key
+        """
+        if self.input_pending():
+            self._frame_skipped = True
+            self.perf.frame(skipped=True)
+        else:
+            self.draw()
+            self.file.move_cursor(self.stdscr, self.layout.file)
+            self.perf.frame()
+
+    def idle(self) -> None:
+        """highlight ahead of the viewport until input or language server
+        messages arrive
+        """
+        if self._buffered_input is not None or self._retheme:
+            return
+
+        clients = self.lsp_servers.clients
+        self.stdscr.nodelay(True)
+        try:
+            while self.file.idle_pending():
+                try:
+                    self._buffered_input = self.stdscr.get_wch()
+                except curses.error:
+                    pass
+                else:
+                    break
+
+                # answers are handled by `get_char`, before they go stale
+                if clients and select.select(clients, (), (), 0)[0]:
+                    break
+
+                self.file.highlight_idle(IDLE_HIGHLIGHT_LINES)
+        finally:
+            self.stdscr.nodelay(False)
+
     def get_char(self) -> Key:
         self.perf.end()
         ret = self._get_char()
+        self.perf.input_read()
         self.perf.start(ret.keyname.decode())
         return ret
 
     def draw(self) -> None:
+        self._frame_skipped = False
+        # in tiny windows the header and status are drawn over the file
+        if self.file is not self._drawn_file or self.layout.file.y == 0:
+            self.file.touch()
+            self._drawn_file = self.file
+
         self._draw_header(self.layout.header)
         self.file.draw(self.stdscr, self.layout.file)
         self.status.draw(self.stdscr, self.layout.status)
+        # these are drawn over the file's rows so those must be redrawn
         if self.file.diagnostics.diagnostics is not None:
             self.file.diagnostics.draw(self.stdscr, self.file.buf.file_y - 1, self.layout.file.width, self.layout.file.height, self.file.buf)
+            self.file.touch()
         if self.file.autocomplete.active and self.file.autocomplete.suggestions is not None:
             self.file.autocomplete.display((self.file.buf.y, self.file.buf.x), self.stdscr, self.layout.file.width, self.layout.file.height)
+            self.file.touch()
         self.file.lint_errors.draw(self.stdscr, self.layout.lint_errors)
         self.status.update(self.file.progressManager.as_string())
 
@@ -395,11 +520,17 @@ class Screen:
         self.file.buf.scroll_screen_if_needed(self.layout.file)
         self.draw()
 
+    def _draw_skipped_frame(self) -> None:
+        # prompts wait for input, the screen should show the latest edits
+        if self._frame_skipped:
+            self.draw()
+
     def quick_prompt(
         self,
         prompt: str,
         opt_strs: tuple[str, ...],
     ) -> str | PromptResult:
+        self._draw_skipped_frame()
         opts = {opt[0] for opt in opt_strs}
         while True:
             x = 0
@@ -458,6 +589,7 @@ class Screen:
         else:
             history_data = [default]
 
+        self._draw_skipped_frame()
         ret = Prompt(self, prompt, history_data).run()
 
         if ret is not PromptResult.CANCELLED and history is not None:
@@ -524,13 +656,13 @@ class Screen:
         if not from_stack:
             self.status.update(f'nothing to {op}!')
         else:
-            action = from_stack.pop()
-            to_stack.append(action.apply(self.file))
+            action = self.file.undo_redo(from_stack, to_stack)
             self.file.buf.scroll_screen_if_needed(self.layout.file)
             self.status.update(f'{op}: {action.name}')
             self.file.selection.clear()
 
     def undo(self) -> None:
+        self.file.restore_undo_log()
         self._undo_redo('undo', self.file.undo_stack, self.file.redo_stack)
 
     def redo(self) -> None:
@@ -808,6 +940,7 @@ class Screen:
         lines = 'lines' if num_lines != 1 else 'line'
         self.status.update(f'saved! ({num_lines} {lines} written)')
         self.file.reset_modified_state()
+        self.file.save_undo_log()
         return None
 
     def save_filename(self) -> PromptResult | None:
@@ -840,19 +973,19 @@ class Screen:
             if response == 'y':
                 if self.save_filename() is not PromptResult.CANCELLED:
                     if self.file.lsp is not None:
-                        self.file.lsp.shutdown()
+                        self.lsp_servers.close_document(self.file.lsp)
                     return EditResult.EXIT
                 else:
                     return None
             elif response == 'n':
                 if self.file.lsp is not None:
-                    self.file.lsp.shutdown()
+                    self.lsp_servers.close_document(self.file.lsp)
                 return EditResult.EXIT
             else:
                 assert response is PromptResult.CANCELLED
                 return None
         if self.file.lsp is not None:
-            self.file.lsp.shutdown()
+            self.lsp_servers.close_document(self.file.lsp)
         return EditResult.EXIT
 
     def background(self) -> None:
@@ -867,16 +1000,22 @@ class Screen:
     def retheme(self) -> None:
         self._command_retheme([])
 
+    def lsp_messages(self) -> None:
+        """messages were handled while waiting for input, nothing else to do
+        but draw the result
+        """
+
     @requires_lsp
     def start_if_not_active(self) -> None:
-        if not self.file.autocomplete.active:
-            self.file.autocomplete.start_completion((self.file.buf.y, self.file.buf.x))
-            self.file.autocomplete.fetch_suggestions(self.file.lsp)
-        else:
-            self.file.autocomplete.fetch_suggestions(self.file.lsp)
+        autocomplete, document = self.file.autocomplete, self.file.lsp
+        assert document is not None
+        if not autocomplete.active:
+            autocomplete.start_completion((self.file.buf.y, self.file.buf.x))
+        autocomplete.fetch_suggestions(document, self.show_suggestions)
 
     DISPATCH = {
         b'RETHEME': retheme,
+        b'LSP': lsp_messages,
         b'KEY_RESIZE': resize,
         b'^_': go_to_line,
         b'^C': current_position,
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
 import argparse
+import itertools
 from typing import Sequence
 
 from babi.highlight import Compiler
 from babi.highlight import Grammars
-from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
 from babi.theme import Style
 from babi.theme import Theme
 from babi.user_data import prefix_data
@@ -39,9 +40,9 @@ def _highlight_output(theme: Theme, compiler: Compiler, filename: str) -> int:
     if theme.default.bg is not None:
         print('\x1b[48;2;{r};{g};{b}m'.format(**theme.default.bg._asdict()))
     with open(filename, encoding='UTF-8') as f:
-        for line_idx, line in enumerate(f):
-            first_line = line_idx == 0
-            state, regions = highlight_line(compiler, state, line, first_line)
+        lines, hl_lines = itertools.tee(f)
+        highlighted = highlight_lines(compiler, state, hl_lines)
+        for line, (_, regions) in zip(lines, highlighted):
             for start, end, scope in regions:
                 print_styled(line[start:end], theme.select(scope))
     print('\x1b[m', end='')
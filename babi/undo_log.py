@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os.path
+import weakref
+from typing import Any
+from typing import Callable
+from typing import Sequence
+from typing import TypeVar
+
+from babi.user_data import xdg_data
+
+T = TypeVar('T')
+
+# persistent undo is opt-in: it is enabled by creating this directory
+UNDO_DIR = 'undo_v1'
+# logs which grow past this are started over on the next save
+UNDO_LOG_MAX_SIZE = 64 * 2 ** 20
+
+
+def undo_log_enabled() -> bool:
+    return os.path.isdir(xdg_data(UNDO_DIR))
+
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(',', ':')).encode() + b'\n'
+
+
+class UndoLog:
+    """append-only log of the undo history of a file
+
+    every line is json, either an action `["a", parent, action]` (which is
+    identified by the offset of its line) or a marker `["s", sha256, top]`
+    recording the top of the undo stack when the file had that content
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.path = os.path.abspath(filename)
+        key = hashlib.sha256(self.path.encode()).hexdigest()
+        self.filename = xdg_data(UNDO_DIR, f'{key}.jsonl')
+        # action => (offset, parent offset) of lines already written
+        self._written: weakref.WeakKeyDictionary[Any, tuple[int, int | None]]
+        self._written = weakref.WeakKeyDictionary()
+
+    def save(
+            self,
+            sha256: str,
+            actions: Sequence[T],
+            to_json: Callable[[T], Any],
+    ) -> None:
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            size = 0
+        if size > UNDO_LOG_MAX_SIZE:
+            mode = 'wb'
+            self._written.clear()
+        else:
+            mode = 'ab'
+
+        try:
+            with open(self.filename, mode) as f:
+                parent = None
+                for action in actions:
+                    written = self._written.get(action)
+                    if written is None or written[1] != parent:
+                        written = (f.tell(), parent)
+                        f.write(_dumps(['a', parent, to_json(action)]))
+                        self._written[action] = written
+                    parent = written[0]
+                f.write(_dumps(['s', sha256, parent]))
+        except OSError:  # pragma: no cover (defensive)
+            self._written.clear()
+
+    def load(self, sha256: str, from_json: Callable[[Any], T]) -> list[T]:
+        """the undo stack (bottom first) when the file had `sha256`"""
+        lines = {}
+        top = None
+        try:
+            with open(self.filename, 'rb') as f:
+                offset = 0
+                for line in f:
+                    tp, *rest = json.loads(line)
+                    if tp == 'a':
+                        lines[offset] = rest
+                    elif tp == 's' and rest[0] == sha256:
+                        top = rest[1]
+                    offset += len(line)
+
+            stack = []
+            while top is not None:
+                parent, obj = lines[top]
+                stack.append((top, parent, from_json(obj)))
+                top = parent
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+        ret = []
+        for offset, parent, action in reversed(stack):
+            self._written[action] = (offset, parent)
+            ret.append(action)
+        return ret
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Sequence
+from unittest import mock
+
+from babi.buf import Buf
+
+
+def _buf(lines: list[str], chunked: bool) -> Buf:
+    threshold = 0 if chunked else len(lines) + 1
+    with mock.patch('babi.buf.CHUNKED_LINES', threshold):
+        return Buf(list(lines))
+
+
+def _paste_ms(buf: Buf, y: int, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        buf.insert(y + i, f'pasted {i}')
+    return (time.perf_counter() - t0) * 1000
+
+
+def _delete_ms(buf: Buf, y: int, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        del buf[y]
+    return (time.perf_counter() - t0) * 1000
+
+
+def _read_ms(buf: Buf, y: int, n: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(y, y + n):
+        buf[i]
+    return (time.perf_counter() - t0) * 1000
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--n', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    lines = [f'line {i}' for i in range(args.lines)]
+    y = args.lines // 4
+
+    print('store\tpaste ms\tdelete ms\tread ms')
+    for name, chunked in (('list', False), ('chunked', True)):
+        buf = _buf(lines, chunked)
+        paste = _paste_ms(buf, y, args.n)
+        delete = _delete_ms(buf, y, args.n)
+        read = _read_ms(buf, y, args.n)
+        print(f'{name}\t{paste:.1f}\t{delete:.1f}\t{read:.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
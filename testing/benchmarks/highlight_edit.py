@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Sequence
+
+from babi.buf import Buf
+from babi.color_manager import ColorManager
+from babi.highlight import Grammars
+from babi.hl.syntax import Syntax
+from babi.theme import Theme
+from babi.user_data import prefix_data
+
+SAMPLE = '''\
+import os
+
+
+def f(x: int) -> str:
+    """docstring"""
+    return f'{x} {os.sep}'  # comment
+
+'''
+
+
+def _grammars() -> Grammars:
+    return Grammars(prefix_data('grammar_v1'))
+
+
+def _keystroke_us(
+        grammars: Grammars,
+        lines: list[str],
+        y: int,
+        n: int,
+) -> float:
+    # a new `Syntax` each time, the highlighted lines are cached in it and
+    # the edits of each run are the same
+    syntax = Syntax(grammars, Theme.from_dct({}), ColorManager.make())
+    buf = Buf(list(lines))
+    file_hl = syntax.file_highlighter('t.py', buf[0])
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+
+    # the edited line is on screen, at the top of the viewport like `File`
+    # scrolls it -- highlighting starts at the viewport
+    buf.file_y = y
+    viewport_end = min(y + 50, len(buf))
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        buf[y] = f'{buf[y]}{i % 10}'
+        file_hl.highlight_until(buf, viewport_end)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--keystrokes', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    sample = SAMPLE.splitlines()
+    lines = (sample * (args.lines // len(sample) + 1))[:args.lines] + ['']
+
+    grammars = _grammars()
+    # the first edits compile the grammar's regexes, don't time those
+    _keystroke_us(grammars, lines, 5, 10)
+
+    print('edit line\tμs / keystroke')
+    for frac in (0, .25, .5, .75, 1):
+        # edit inside the comment so the state always converges
+        y = int((args.lines - len(sample)) * frac)
+        y = y - y % len(sample) + 5
+        us = _keystroke_us(grammars, lines, y, args.keystrokes)
+        print(f'{y}\t{us:.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
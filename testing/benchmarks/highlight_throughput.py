@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Sequence
+
+from babi.buf import Buf
+from babi.color_manager import ColorManager
+from babi.highlight import Compiler
+from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
+from babi.hl.syntax import FileSyntax
+from babi.hl.syntax import Syntax
+from babi.theme import Theme
+from testing.benchmarks.highlight_edit import _grammars
+from testing.benchmarks.highlight_edit import SAMPLE
+
+
+def _per_line(syntax: Syntax, compiler: Compiler, lines: list[str]) -> None:
+    state = compiler.root_state
+    for i, line in enumerate(lines):
+        state, _ = highlight_line(compiler, state, line, i == 0)
+
+
+def _batch(syntax: Syntax, compiler: Compiler, lines: list[str]) -> None:
+    for _ in highlight_lines(compiler, compiler.root_state, lines):
+        pass
+
+
+def _file_syntax(
+        syntax: Syntax,
+        compiler: Compiler,
+        lines: list[str],
+) -> None:
+    buf = Buf([line.rstrip('\n') for line in lines])
+    file_hl = FileSyntax(compiler, syntax.cache)
+    file_hl.highlight_until(buf, len(buf))
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('filename', nargs='?')
+    args = parser.parse_args(argv)
+
+    if args.filename is not None:
+        with open(args.filename, encoding='UTF-8') as f:
+            lines = f.readlines()
+        filename = args.filename
+    else:
+        sample = SAMPLE.splitlines(True)
+        lines = (sample * (args.lines // len(sample) + 1))[:args.lines]
+        filename = 't.py'
+
+    grammars = _grammars()
+    compiler = grammars.compiler_for_file(filename, lines[0])
+    syntax = Syntax(grammars, Theme.from_dct({}), ColorManager.make())
+    # compile the regexes up front so the first method isn't penalized
+    _batch(syntax, compiler, lines)
+
+    print('method\tlines / s')
+    for name, func in (
+            ('highlight_line', _per_line),
+            ('highlight_lines', _batch),
+            ('FileSyntax', _file_syntax),
+    ):
+        # a fresh `Syntax` so nothing is served from the shared cache
+        syntax = Syntax(grammars, Theme.from_dct({}), ColorManager.make())
+        t0 = time.perf_counter()
+        func(syntax, compiler, lines)
+        print(f'{name}\t{len(lines) / (time.perf_counter() - t0):.0f}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
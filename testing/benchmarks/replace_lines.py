@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import argparse
+import difflib
+import random
+import time
+from typing import Sequence
+
+from babi.line_diff import get_opcodes
+
+FUNC = '''\
+def func_{n}(x, y):
+    """docstring for func_{n}"""
+    if x > {n}:
+        return {{'x': x, 'y': y}}
+    else:
+        return None
+
+'''
+
+
+def _reformat(lines: list[str], rand: random.Random) -> list[str]:
+    """roughly what a formatter does: requote, rewrap and rewrite a few
+    lines, mostly leaving everything else alone
+    """
+    ret = []
+    for line in lines:
+        r = rand.random()
+        if r < .05:
+            ret.append(line.replace("'", '"'))
+        elif r < .07 and '(' in line:
+            before, _, after = line.partition('(')
+            ret.extend((f'{before}(', f'        {after}'))
+        elif r < .08:
+            continue
+        else:
+            ret.append(line)
+    return ret
+
+
+def _functions(n: int) -> list[str]:
+    """many similar functions (only their names and numbers differ)"""
+    ret: list[str] = []
+    while len(ret) < n:
+        ret.extend(FUNC.format(n=len(ret)).splitlines())
+    return ret
+
+
+def _unique(n: int) -> list[str]:
+    """every line is different, like most real source"""
+    return [f'value_{i} = compute({i}, {i * 7 % 13})' for i in range(n)]
+
+
+def _edit_every_50(lines: list[str], rand: random.Random) -> list[str]:
+    ret = list(lines)
+    for i in range(0, len(ret), 50):
+        ret[i] = f'{ret[i]}  # edited'
+    return ret
+
+
+def _difflib(a: list[str], b: list[str]) -> None:
+    difflib.SequenceMatcher(a=a, b=b).get_opcodes()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    print('case\tengine\tms')
+    for case, make, edit in (
+            ('functions', _functions, _reformat),
+            ('unique', _unique, _edit_every_50),
+    ):
+        lines = make(args.lines)
+        edited = edit(lines, random.Random(0))
+        for name, func in (('difflib', _difflib), ('line_diff', get_opcodes)):
+            t0 = time.perf_counter()
+            func(lines, edited)
+            ms = (time.perf_counter() - t0) * 1000
+            print(f'{case}\t{name}\t{ms:.0f}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
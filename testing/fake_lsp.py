@@ -0,0 +1,105 @@
+"""a minimal language server for tests
+
+it keeps the text of opened documents up to date from `didChange`
+notifications (full or incremental, per `--sync`) and appends every
+message it receives, along with the resulting document text, to `--log`
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any
+from typing import BinaryIO
+from typing import Sequence
+
+
+def _offset(text: str, position: dict[str, int]) -> int:
+    lines = text.splitlines(True)
+    offset = sum(len(line) for line in lines[:position['line']])
+    if position['line'] < len(lines):
+        line = lines[position['line']]
+    else:
+        line = ''
+    # positions count utf-16 code units
+    units = 0
+    for i, c in enumerate(line):
+        if units >= position['character'] or c in '\r\n':
+            return offset + i
+        units += len(c.encode('UTF-16-LE')) // 2
+    return offset + len(line)
+
+
+def apply_change(text: str, change: dict[str, Any]) -> str:
+    if 'range' not in change:
+        return change['text']
+    start = _offset(text, change['range']['start'])
+    end = _offset(text, change['range']['end'])
+    return f'{text[:start]}{change["text"]}{text[end:]}'
+
+
+def _read(f: BinaryIO) -> Any:
+    length = None
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+        elif line == b'\r\n':
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    assert length is not None
+    return json.loads(f.read(length))
+
+
+def _write(f: BinaryIO, obj: Any) -> None:
+    body = json.dumps(obj).encode()
+    f.write(f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    f.flush()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sync', type=int, default=2)
+    parser.add_argument('--log', required=True)
+    args = parser.parse_args(argv)
+
+    documents = {}
+    with open(args.log, 'a', encoding='UTF-8') as log:
+        while True:
+            msg = _read(sys.stdin.buffer)
+            if msg is None:
+                return 0
+
+            method = msg.get('method')
+            params = msg.get('params') or {}
+            if method == 'initialize':
+                capabilities = {'textDocumentSync': {'change': args.sync}}
+                result = {'capabilities': capabilities}
+                _write(sys.stdout.buffer, {'id': msg['id'], 'result': result})
+            elif method == 'shutdown':
+                _write(sys.stdout.buffer, {'id': msg['id'], 'result': None})
+            elif method == 'textDocument/definition':
+                _write(sys.stdout.buffer, {'id': msg['id'], 'result': []})
+            elif method == 'textDocument/diagnostic':
+                report = {'kind': 'full', 'items': []}
+                _write(sys.stdout.buffer, {'id': msg['id'], 'result': report})
+            elif method == 'textDocument/didOpen':
+                doc = params['textDocument']
+                documents[doc['uri']] = doc['text']
+            elif method == 'textDocument/didChange':
+                uri = params['textDocument']['uri']
+                for change in params['contentChanges']:
+                    documents[uri] = apply_change(documents[uri], change)
+
+            uri = params.get('textDocument', {}).get('uri')
+            log.write(f'{json.dumps([msg, documents.get(uri)])}\n')
+            log.flush()
+
+            if method == 'exit':
+                return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
+import random
 from unittest import mock
 
 import pytest
 
 import babi.buf
 from babi.buf import Buf
+from babi.dim import Dim
 
 
 def test_buf_truthiness():
@@ -232,9 +234,29 @@ def fake_wcwidth():
 @pytest.mark.usefixtures('fake_wcwidth')
 def test_line_positions():
     buf = Buf(['a', '🔵b', 'c'])
-    assert buf.line_positions(0) == (0, 1)
-    assert buf.line_positions(1) == (0, 2, 3)
-    assert buf.line_positions(2) == (0, 1)
+    assert list(buf.line_positions(0)) == [0, 1]
+    assert list(buf.line_positions(1)) == [0, 2, 3]
+    assert list(buf.line_positions(2)) == [0, 1]
+
+
+def test_line_positions_ascii_are_not_materialized():
+    buf = Buf(['hello world', 'a\tb', ''])
+    assert buf.line_positions(0) == range(12)
+    assert buf.line_positions(1) == (0, 1, 4, 5)
+    assert buf.line_positions(2) == range(1)
+
+
+def test_vertical_movement_ascii_positions():
+    buf = Buf(['hello world', 'hi', '\thello', 'hello world', ''])
+    dim = Dim(x=0, y=0, width=80, height=24)
+    buf.x = 9
+
+    buf.down(dim)
+    assert (buf.y, buf.x) == (1, 2)
+    buf.down(dim)
+    assert (buf.y, buf.x) == (2, 6)
+    buf.down(dim)
+    assert (buf.y, buf.x) == (3, 9)
 
 
 @pytest.mark.usefixtures('fake_wcwidth')
@@ -244,3 +266,121 @@ def test_set_tab_size():
 
     buf.set_tab_size(8)
     assert buf.line_positions(0) == (0, 8, 9)
+
+
+def test_buf_chunked_lines():
+    with mock.patch.object(babi.buf, 'CHUNKED_LINES', 0):
+        buf = Buf(['a', 'b', 'c'])
+
+    with buf.record() as modifications:
+        del buf[1]
+        buf.insert(0, 'z')
+        buf[-1] = 'y'
+
+    assert list(buf) == ['z', 'a', 'y']
+    assert repr(buf) == "Buf(['z', 'a', 'y'], x=0, y=0, file_y=0)"
+
+    buf.apply(modifications)
+    assert list(buf) == ['a', 'b', 'c']
+
+
+def test_buf_splice():
+    lst = ['a', 'b', 'c', 'd']
+
+    buf = Buf(lst)
+    calls = []
+    buf.add_splice_callback(lambda buf, *args: calls.append(args))
+
+    with buf.record() as modifications:
+        buf.splice(1, 3, ['x', 'y', 'z'])
+
+    assert lst == ['a', 'x', 'y', 'z', 'd']
+    assert calls == [(1, ['b', 'c'], 3)]
+
+    buf.apply(modifications)
+
+    assert lst == ['a', 'b', 'c', 'd']
+    assert calls[-1] == (1, ['x', 'y', 'z'], 2)
+
+
+def test_buf_splice_chunked_lines():
+    with mock.patch.object(babi.buf, 'CHUNKED_LINES', 0):
+        buf = Buf(['a', 'b', 'c'])
+
+    with buf.record() as modifications:
+        buf.splice(0, 2, [])
+        buf.splice(1, 1, ['d', 'e'])
+
+    assert list(buf) == ['c', 'd', 'e']
+
+    buf.apply(modifications)
+
+    assert list(buf) == ['a', 'b', 'c']
+
+
+def test_buf_record_coalesces_line_edits():
+    lst = ['a', 'b', 'c']
+
+    buf = Buf(lst)
+
+    with buf.record() as modifications:
+        # typing on a line, then splitting it
+        buf[1] = 'bx'
+        buf[1] = 'bxy'
+        buf[1] = 'b'
+        buf.insert(2, 'xy')
+        # deleting the following lines
+        del buf[3]
+        del buf[2]
+
+    assert modifications == [babi.buf.Modification(1, 2, ['b', 'c'])]
+
+    buf.apply(modifications)
+
+    assert lst == ['a', 'b', 'c']
+
+
+def test_buf_record_coalesces_backwards_deletes():
+    buf = Buf(['a', 'b', 'c', 'd'])
+
+    with buf.record() as modifications:
+        del buf[2]
+        del buf[1]
+
+    assert modifications == [babi.buf.Modification(1, 1, ['b', 'c'])]
+
+
+def test_buf_record_does_not_coalesce_distant_edits():
+    buf = Buf(['a', 'b', 'c', 'd'])
+
+    with buf.record() as modifications:
+        buf[0] = 'x'
+        buf[3] = 'y'
+
+    assert len(modifications) == 2
+
+
+def test_buf_record_random_edits_roundtrip():
+    rand = random.Random(0)
+    for _ in range(200):
+        lst = [str(i) for i in range(10)]
+        buf = Buf(lst)
+        with buf.record() as modifications:
+            for i in range(10):
+                op = rand.choice(('set', 'ins', 'del', 'splice'))
+                idx = rand.randrange(len(buf))
+                if op == 'set':
+                    buf[idx] = f'set{i}'
+                elif op == 'ins':
+                    buf.insert(idx, f'ins{i}')
+                elif op == 'del' and len(buf) > 1:
+                    del buf[idx]
+                elif op == 'splice':
+                    end = min(idx + rand.randint(0, 3), len(buf))
+                    buf.splice(idx, end, [f'splice{i}'] * rand.randint(0, 3))
+        after = list(buf)
+
+        redo = buf.apply(modifications)
+        assert lst == [str(i) for i in range(10)]
+        buf.apply(redo)
+        assert lst == after
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import random
+from unittest import mock
+
+import pytest
+
+from babi.chunked_list import ChunkedList
+
+
+@pytest.fixture(autouse=True)
+def small_chunks():
+    with mock.patch('babi.chunked_list.CHUNK_SIZE', 4):
+        yield
+
+
+def test_chunked_list_repr():
+    assert repr(ChunkedList([1, 2, 3])) == 'ChunkedList([1, 2, 3])'
+
+
+def test_chunked_list_empty():
+    lst: ChunkedList[int] = ChunkedList()
+    assert not lst
+    assert len(lst) == 0
+    assert list(lst) == []
+    with pytest.raises(IndexError):
+        lst[0]
+
+
+def test_chunked_list_getitem():
+    lst = ChunkedList(range(50))
+    assert [lst[i] for i in range(50)] == list(range(50))
+    assert lst[-1] == 49
+    assert lst[-50] == 0
+    with pytest.raises(IndexError):
+        lst[50]
+    with pytest.raises(IndexError):
+        lst[-51]
+
+
+def test_chunked_list_insert_clamps_like_list():
+    lst = ChunkedList([1, 2])
+    lst.insert(100, 4)
+    lst.insert(-100, 0)
+    lst.insert(-1, 3)
+    assert lst == [0, 1, 2, 3, 4]
+
+
+def test_chunked_list_delete_everything():
+    lst = ChunkedList(range(20))
+    for _ in range(20):
+        del lst[len(lst) // 2]
+    assert lst == []
+    lst.append(1)
+    assert lst == [1]
+
+
+def test_chunked_list_matches_list():
+    rand = random.Random(0)
+    expected = list(range(30))
+    lst = ChunkedList(expected)
+    for i in range(2000):
+        op = rand.choice(('insert', 'delete', 'set'))
+        if op == 'insert' or not expected:
+            idx = rand.randint(0, len(expected))
+            expected.insert(idx, i)
+            lst.insert(idx, i)
+        elif op == 'delete':
+            idx = rand.randrange(len(expected))
+            del expected[idx]
+            del lst[idx]
+        else:
+            idx = rand.randrange(len(expected))
+            expected[idx] = lst[idx] = i
+        assert len(lst) == len(expected)
+    assert list(lst) == expected
+    assert [lst[i] for i in range(len(lst))] == expected
+
+
+def test_chunked_list_extend():
+    lst = ChunkedList([1, 2, 3])
+    lst.extend(range(4, 20))
+    lst.extend(())
+    assert lst == list(range(1, 20))
+    assert lst[10] == 11
+
+
+def test_chunked_list_slices_match_list():
+    rand = random.Random(0)
+    expected = list(range(30))
+    lst = ChunkedList(expected)
+    for i in range(500):
+        start = rand.randint(0, len(expected))
+        stop = rand.randint(start, min(start + 12, len(expected)))
+        assert lst[start:stop] == expected[start:stop]
+        new = list(range(i * 100, i * 100 + rand.randint(0, 12)))
+        expected[start:stop] = new
+        lst[start:stop] = new
+        assert list(lst) == expected
+    assert lst[-3:] == expected[-3:]
+
+
+def test_chunked_list_slice_empty():
+    lst: ChunkedList[int] = ChunkedList()
+    assert lst[0:5] == []
+    lst[0:0] = [1, 2]
+    assert lst == [1, 2]
+    lst[:] = []
+    assert lst == []
+
+
+def test_chunked_list_extended_slice():
+    with pytest.raises(ValueError):
+        ChunkedList([1, 2, 3])[::2]
@@ -3,6 +3,7 @@ from __future__ import annotations
 import contextlib
 import curses
 import os
+import select
 import signal
 import sys
 from typing import NamedTuple
@@ -283,6 +284,7 @@ KEYS = [
     Key('^H', b'^H', '\x08'),
     Key('^K', b'^K', '\x0b'),
     Key('^E', b'^E', '\x05'),
+    Key('^G', b'^G', '\x07'),
     Key('^J', b'^J', '\n'),
     Key('^O', b'^O', '\x0f'),
     Key('^P', b'^P', '\x10'),
@@ -318,7 +320,7 @@ class DeferredRunner:
             'xterm-256color': (256, True),
         }[term]
 
-    def _get_wch(self):
+    def _run_until_keypress(self):
         while not isinstance(self._ops[self._i], KeyPress):
             self._i += 1
             try:
@@ -326,12 +328,41 @@ class DeferredRunner:
             except AssertionError:  # pragma: no cover (only on failures)
                 self.screen.screenshot()
                 raise
+
+    def _get_wch(self):
+        # without blocking only keys which were already pressed are read
+        op = self._ops[self._i]
+        if self.screen.nodelay and not isinstance(op, KeyPress):
+            if isinstance(op, CursesError):
+                self._i += 1
+            raise curses.error()
+
+        self._run_until_keypress()
         self._i += 1
         keypress_event = self._ops[self._i - 1]
         assert isinstance(keypress_event, KeyPress)
         print(f'KEY: {keypress_event.wch!r}')
         return keypress_event.wch
 
+    def _select(self, rlist, wlist, xlist, timeout=None):
+        # language server pipes are real, the terminal blocks like `get_wch`
+        # until the next key is pressed.  awaiting text gives answers which
+        # are on their way a moment to arrive
+        if sys.stdin not in rlist:  # polling only the language servers
+            return self._real_select(rlist, wlist, xlist, timeout)
+
+        fds = [f for f in rlist if f is not sys.stdin]
+        if isinstance(self._ops[self._i], (AwaitText, AwaitTextMissing)):
+            wait = .5
+        else:
+            wait = 0
+        readable, _, _ = self._real_select(fds, (), (), wait)
+        if readable:
+            return readable, [], []
+        else:
+            self._run_until_keypress()
+            return [sys.stdin], [], []
+
     def await_text(self, text, timeout=1):
         self._ops.append(AwaitText(text))
 
@@ -449,7 +480,11 @@ class DeferredRunner:
         return mock.patch.multiple(curses, **patches)
 
     def await_exit(self):
-        with self._patch_curses():
+        self._real_select = select.select
+        with (
+                self._patch_curses(),
+                mock.patch.object(select, 'select', self._select),
+        ):
             main(self.command)
         # we have already exited -- check remaining things
         # KeyPress with failing condition or error
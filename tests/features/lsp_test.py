@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import sys
+import time
+from unittest import mock
+
+import pytest
+
+import babi.file
+
+
+@pytest.fixture
+def fake_lsp(tmpdir):
+    cmd = [
+        sys.executable, '-m', 'testing.fake_lsp',
+        '--log', str(tmpdir.join('lsp.log')),
+    ]
+    with mock.patch.dict(babi.file.LSP_SERVERS, {'py': cmd}):
+        yield
+
+
+def _await_log(tmpdir, s):
+    log = tmpdir.join('lsp.log')
+    deadline = time.monotonic() + 5
+    while not log.exists() or s not in log.read():
+        assert time.monotonic() < deadline
+        time.sleep(.01)
+
+
+def test_keys_stay_in_order_with_a_language_server(
+        run_only_fake, tmpdir, fake_lsp,
+):
+    f = tmpdir.join('f.py')
+    f.write('x = 1\n')
+
+    with run_only_fake(str(f)) as h:
+        h.await_text('x = 1')
+        h.run(lambda: _await_log(tmpdir, 'textDocument/didOpen'))
+        h.press_sequence('a', 'b')
+        h.await_text('abx = 1')
+        h.press('^S')
+        h.press('^X')
+        h.await_exit()
+
+    assert f.read() == 'abx = 1\n'
+
+
+def test_definition(run_only_fake, tmpdir, fake_lsp):
+    f = tmpdir.join('f.py')
+    f.write('x = 1\n')
+
+    with run_only_fake(str(f)) as h:
+        h.await_text('x = 1')
+        h.press('^G')
+        h.await_text('No definition found')
+        h.press('^X')
+        h.await_exit()
+
+
+def test_reverse_search_stays_open_for_language_server_messages(
+        run_only_fake, tmpdir, fake_lsp,
+):
+    f = tmpdir.join('f.py')
+    f.write('x = 1\n')
+
+    with run_only_fake(str(f)) as h:
+        h.await_text('x = 1')
+        h.press('^G')
+        h.press('^W')
+        h.press('^R')
+        # the definition's answer arrives while reverse-searching
+        h.await_text('search(reverse-search)``:')
+        h.press('^C')
+        h.await_text('cancelled')
+        h.press('^X')
+        h.await_exit()
+
+
+def test_definition_answered_after_switching_files(
+        run_only_fake, tmpdir, fake_lsp,
+):
+    f = tmpdir.join('f.py')
+    f.write('x = 1\n')
+    g = tmpdir.join('g.txt')
+    g.write('hello\n')
+
+    with run_only_fake(str(f), str(g)) as h:
+        h.await_text('x = 1')
+        h.press('^G')
+        h.press('M-Right')
+        h.await_text('hello')
+        h.await_text_missing('No definition found')
+        h.press('^X')
+        h.press('^X')
+        h.await_exit()
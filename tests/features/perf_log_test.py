@@ -13,3 +13,6 @@ def test(run, tmpdir, ten_lines):
     expected = ['startup', 'KEY_RIGHT', 'KEY_DOWN', '^X']
     assert [line.split()[-1] for line in lines[1:]] == expected
     assert tmpdir.join('f.log.pstats').exists()
+    frames = tmpdir.join('f.log.frames').read().splitlines()
+    assert frames[0] == 'frames\tskipped\tfps\tmean μs\tmax μs'
+    assert len(frames[1].split('\t')) == 5
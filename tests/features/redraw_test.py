@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from unittest import mock
+
+import pytest
+
+from babi.render_cache import RenderCache
+from testing.runner import and_exit
+
+
+@pytest.fixture
+def drawn_lines():
+    """the file lines whose rows were (re)drawn"""
+    ret: list[int] = []
+    row = RenderCache.row
+
+    def row_cb(self, buf, l_y, *args):
+        ret.append(l_y)
+        return row(self, buf, l_y, *args)
+
+    with mock.patch.object(RenderCache, 'row', row_cb):
+        yield ret
+
+
+def _assert_drawn(drawn_lines, expected):
+    def cb():
+        assert sorted(set(drawn_lines)) == expected
+        drawn_lines.clear()
+    return cb
+
+
+def test_editing_a_line_redraws_only_its_row(
+        run_only_fake, ten_lines, drawn_lines,
+):
+    with run_only_fake(str(ten_lines)) as h, and_exit(h):
+        h.await_text('line_9')
+        h.run(drawn_lines.clear)
+        h.press('Down')
+        h.await_cursor_position(x=0, y=2)
+        h.run(_assert_drawn(drawn_lines, []))
+        h.press('x')
+        h.await_text('xline_1')
+        h.run(_assert_drawn(drawn_lines, [1]))
+        h.press('BSpace')
+        h.await_text_missing('xline_1')
+        h.run(_assert_drawn(drawn_lines, [1]))
+
+
+def test_scrolling_redraws_every_row(run_only_fake, ten_lines, drawn_lines):
+    with run_only_fake(str(ten_lines), height=6) as h, and_exit(h):
+        h.await_text('line_3')
+        h.run(drawn_lines.clear)
+        for _ in range(4):
+            h.press('Down')
+        h.await_text('line_5')
+        h.run(_assert_drawn(drawn_lines, [3, 4, 5, 6]))
+
+
+def test_selection_redraws_the_rows_it_changes(
+        run_only_fake, ten_lines, drawn_lines,
+):
+    with run_only_fake(str(ten_lines)) as h, and_exit(h):
+        h.await_text('line_9')
+        h.press('Down')
+        h.run(drawn_lines.clear)
+        h.press('S-Down')
+        h.await_cursor_position(x=0, y=3)
+        h.run(_assert_drawn(drawn_lines, [1, 2]))
+        h.press('S-Down')
+        h.await_cursor_position(x=0, y=4)
+        # the first line of the selection is unchanged
+        h.run(_assert_drawn(drawn_lines, [2, 3]))
+        # moving clears the selection from every row it covered
+        h.press('Right')
+        h.await_cursor_position(x=1, y=4)
+        h.run(_assert_drawn(drawn_lines, [1, 2, 3]))
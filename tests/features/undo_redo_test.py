@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+from unittest import mock
+
 import pytest
 
+import babi.file
 from testing.runner import and_exit
 
 
@@ -54,6 +57,27 @@ def test_undo_redo_action_interrupts_actions(run):
         h.await_text('hello')
 
 
+def test_undo_redo_keeps_history_size_within_limit(run_only_fake):
+    # `q` stores the empty line (1) and `z` then stores `q` (2)
+    with mock.patch.object(babi.file, 'UNDO_MAX_SIZE', 3):
+        with run_only_fake() as h, and_exit(h):
+            h.press('q')
+            for _ in range(3):
+                h.press('M-u')
+                h.await_text('undo: text')
+                h.press('M-U')
+                h.await_text('redo: text')
+            h.press('Left')
+            h.press('z')
+            h.await_text('zq')
+            h.press('M-u')
+            h.await_text('undo: text')
+            h.press('M-u')
+            h.await_text_missing(' *')
+            h.press('M-u')
+            h.await_text('nothing to undo!')
+
+
 def test_undo_redo_mixed_newlines(run, tmpdir):
     f = tmpdir.join('f')
     f.write_binary(b'foo\nbar\r\n')
@@ -145,3 +169,39 @@ def test_undo_redo_clears_selection(run, ten_lines):
         h.press('M-u')
         h.await_cursor_position(x=0, y=2)
         h.assert_screen_attr_equal(1, [(-1, -1, 0)] * 20)
+
+
+def test_undo_persisted_across_sessions(run, tmpdir, xdg_data_home):
+    xdg_data_home.join('babi/undo_v1').ensure_dir()
+    f = tmpdir.join('f')
+    f.write('hello\n')
+
+    with run(str(f)) as h, and_exit(h):
+        h.press('world')
+        h.await_text('worldhello')
+        h.press('^S')
+        h.await_text('saved!')
+
+    with run(str(f)) as h, and_exit(h):
+        h.await_text('worldhello')
+        h.press('M-u')
+        h.await_text('undo: text')
+        h.await_text_missing('worldhello')
+        h.await_text(' *')
+        h.press('M-U')
+        h.await_text('worldhello')
+        h.await_text_missing(' *')
+
+
+def test_undo_not_persisted_by_default(run, tmpdir):
+    f = tmpdir.join('f')
+    f.write('hello\n')
+
+    with run(str(f)) as h, and_exit(h):
+        h.press('world')
+        h.press('^S')
+        h.await_text('saved!')
+
+    with run(str(f)) as h, and_exit(h):
+        h.press('M-u')
+        h.await_text('nothing to undo!')
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import io
+import json
 
 import pytest
 
+from babi.buf import Modification
 from babi.color_manager import ColorManager
+from babi.file import Action
 from babi.file import File
 from babi.file import get_lines
 from babi.highlight import Grammars
@@ -38,3 +41,37 @@ def test_get_lines_sha256_checksum():
     ret = get_lines(io.StringIO(''))
     sha256 = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
     assert ret == ([''], '\n', False, sha256)
+
+
+def test_action_size_tracks_coalesced_modifications():
+    action = Action(
+        name='test', modifications=[Modification(1, 2, ['hello'])],
+        start_x=0, start_y=0, start_modified=False,
+        end_x=0, end_y=0, end_modified=True,
+        final=False,
+    )
+    assert action.size == 6
+
+    # coalesced: the original text of the line is only stored once
+    action.extend([Modification(1, 2, ['hello world'])])
+    assert action.modifications == [Modification(1, 2, ['hello'])]
+    assert action.size == 6
+
+    action.extend([Modification(5, 5, ['x'])])
+    assert len(action.modifications) == 2
+    assert action.size == 8
+
+
+def test_action_json_roundtrip():
+    action = Action(
+        name='test', modifications=[Modification(1, 3, ['a', 'b'])],
+        start_x=1, start_y=2, start_modified=False,
+        end_x=3, end_y=4, end_modified=True,
+        final=False,
+    )
+    ret = Action.from_json(json.loads(json.dumps(action.to_json())))
+    assert ret.name == 'test'
+    assert ret.modifications == action.modifications
+    assert (ret.start_x, ret.start_y) == (1, 2)
+    assert (ret.end_x, ret.end_y) == (3, 4)
+    assert ret.final
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from babi.grammar_profile import main
+
+GRAMMAR = {
+    'scopeName': 'source.demo',
+    'fileTypes': ['demo'],
+    'patterns': [
+        {'begin': '/\\*', 'end': '\\*/', 'name': 'comment'},
+        {'match': 'int', 'name': 'keyword'},
+    ],
+}
+
+
+@pytest.fixture
+def grammar_dir(tmpdir):
+    grammars = tmpdir.join('grammar_v1').ensure_dir()
+    grammars.join('source.demo.json').write(json.dumps(GRAMMAR))
+    return grammars
+
+
+def test_profile(grammar_dir, tmpdir, capsys):
+    src = tmpdir.join('src').ensure_dir()
+    src.join('f.demo').write('int /* int\nint */ int\n')
+    src.join('g.demo').write('int\n')
+    src.join('binary').write_binary(b'\xff\xfe')
+    src.join('.git').ensure_dir().join('h.demo').write('int\n')
+
+    assert not main(('--grammar-dir', str(grammar_dir), str(src)))
+
+    out, _ = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[1].split()[0] == '3'
+    assert lines[1].split()[-1] == 'source.demo'
+    assert '[2 patterns]' in out
+    assert "source.demo comment: '\\\\*/'" in out
+    assert '         3  source.demo: \'int\'' in out
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import json
+import os
+import pickle
 import stat
+from unittest import mock
 
 import pytest
 
+from babi.highlight import Grammars
 from babi.highlight import highlight_line
+from babi.highlight import highlight_lines
 from babi.highlight import Region
 
 
@@ -674,3 +680,195 @@ def test_buggy_begin_end_grammar(compiler_state):
         Region(5, 6, ('test', 'css')),
         Region(6, 12, ('test',)),
     )
+
+
+NESTED_GRAMMARS = (
+    {
+        'scopeName': 'test',
+        'patterns': [
+            {
+                'begin': '<',
+                'end': '>',
+                'name': 'angle',
+                'patterns': [{'include': 'other'}],
+            },
+            {
+                'begin': '> ',
+                'while': '> ',
+                'name': 'quote',
+                'patterns': [{'include': '$self'}],
+            },
+        ],
+    },
+    {
+        'scopeName': 'other',
+        'patterns': [
+            {'begin': r'\(', 'end': r'\)', 'name': 'paren'},
+            {'match': 'a', 'name': 'a'},
+        ],
+    },
+)
+
+
+@pytest.mark.parametrize('line', ('< (a', '> < (a', '> plain'))
+def test_dump_load_state_roundtrip(make_grammars, line):
+    compiler = make_grammars(*NESTED_GRAMMARS).compiler_for_scope('test')
+    state, _ = highlight_line(compiler, compiler.root_state, line, True)
+
+    data = json.loads(json.dumps(compiler.dump_state(state)))
+    assert compiler.load_state(data) == state
+
+
+def test_load_state_in_new_compiler(make_grammars):
+    compiler = make_grammars(*NESTED_GRAMMARS).compiler_for_scope('test')
+    state, _ = highlight_line(compiler, compiler.root_state, '> < (a', True)
+    data = json.loads(json.dumps(compiler.dump_state(state)))
+    _, expected = highlight_line(compiler, state, '> a) a > x', False)
+
+    new_compiler = make_grammars().compiler_for_scope('test')
+    new_state = new_compiler.load_state(data)
+    _, regions = highlight_line(new_compiler, new_state, '> a) a > x', False)
+
+    assert regions == expected
+
+
+def test_load_state_invalid_rule(make_grammars):
+    compiler = make_grammars(*NESTED_GRAMMARS).compiler_for_scope('test')
+    state, _ = highlight_line(compiler, compiler.root_state, '> plain', True)
+    entries, _ = compiler.dump_state(state)
+    # pretend the quote rule is a while rule in the while stack for `<`
+    entries[1][1] = 0
+
+    with pytest.raises(ValueError):
+        compiler.load_state([entries, [2]])
+
+
+def test_grammar_mtimes(make_grammars):
+    compiler = make_grammars(*NESTED_GRAMMARS).compiler_for_scope('test')
+    highlight_line(compiler, compiler.root_state, '< (a', True)
+
+    mtimes = compiler.grammar_mtimes()
+    assert set(mtimes) == {'test', 'other'}
+    assert compiler.grammar_mtimes_match(mtimes)
+    assert not compiler.grammar_mtimes_match({**mtimes, 'other': 0})
+
+
+WEIRD_GRAMMAR = {
+    'scopeName': 'source.weird',
+    'fileTypes': ['weird'],
+    'patterns': [{'match': 'a', 'name': 'a'}],
+}
+
+
+@pytest.fixture
+def grammar_dir(tmpdir):
+    grammar_dir = tmpdir.join('grammars').ensure_dir()
+    for grammar in (WEIRD_GRAMMAR, NESTED_GRAMMARS[0]):
+        filename = f'{grammar["scopeName"]}.json'
+        grammar_dir.join(filename).write(json.dumps(grammar))
+    return grammar_dir
+
+
+def _scope_for_file(grammar_dir, cache, filename):
+    grammars = Grammars(str(grammar_dir), cache=str(cache))
+    compiler = grammars.compiler_for_file(filename, '')
+    return compiler.root_state.entries[0].scope[0]
+
+
+def test_grammar_cache_skips_json(tmpdir, grammar_dir):
+    cache = tmpdir.join('cache')
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+    assert cache.exists()
+
+    with mock.patch.object(json, 'load', side_effect=AssertionError):
+        grammars = Grammars(str(grammar_dir), cache=str(cache))
+        compiler = grammars.compiler_for_file('f.weird', '')
+        _, regions = highlight_line(compiler, compiler.root_state, 'a', True)
+    assert regions[0].scope == ('source.weird', 'a')
+
+
+def test_grammar_cache_invalidated_by_directory_mtime(tmpdir, grammar_dir):
+    cache = tmpdir.join('cache')
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+
+    # grammars are replaced by writing a new file into the directory
+    tmp = grammar_dir.join('source.weird.json.tmp')
+    tmp.write(json.dumps({**WEIRD_GRAMMAR, 'fileTypes': ['odd']}))
+    os.replace(tmp, grammar_dir.join('source.weird.json'))
+    mtime = os.stat(grammar_dir).st_mtime
+    os.utime(grammar_dir, (mtime + 1, mtime + 1))
+
+    assert _scope_for_file(grammar_dir, cache, 'f.odd') == 'source.weird'
+
+
+def test_grammar_cache_grammar_overwritten_in_place(tmpdir, grammar_dir):
+    cache = tmpdir.join('cache')
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+
+    dir_mtime = os.stat(grammar_dir).st_mtime
+    weird = grammar_dir.join('source.weird.json')
+    patterns = [{'match': 'b', 'name': 'b'}]
+    weird.write(json.dumps({**WEIRD_GRAMMAR, 'patterns': patterns}))
+    mtime = os.stat(weird).st_mtime
+    os.utime(weird, (mtime + 1, mtime + 1))
+    os.utime(grammar_dir, (dir_mtime, dir_mtime))
+
+    grammars = Grammars(str(grammar_dir), cache=str(cache))
+    compiler = grammars.compiler_for_file('f.weird', '')
+    _, regions = highlight_line(compiler, compiler.root_state, 'b', True)
+    assert regions[0].scope == ('source.weird', 'b')
+
+
+def test_grammar_cache_loads_only_used_grammars(tmpdir, grammar_dir):
+    cache = tmpdir.join('cache')
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+
+    # only the used grammar is unpickled, not every grammar in the cache
+    with mock.patch.object(pickle, 'loads', side_effect=pickle.loads) as mck:
+        grammars = Grammars(str(grammar_dir), cache=str(cache))
+        compiler = grammars.compiler_for_file('f.weird', '')
+    assert compiler.root_scope == 'source.weird'
+    assert mck.call_count == 1
+
+
+def test_grammar_cache_corrupt(tmpdir, grammar_dir):
+    cache = tmpdir.join('cache')
+    cache.write('garbage')
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+    assert _scope_for_file(grammar_dir, cache, 'f.weird') == 'source.weird'
+
+
+@pytest.mark.parametrize(
+    ('line', 'expected'),
+    (
+        ('#!/usr/bin/env foo', 'source.foo'),
+        ('bar baz', 'source.bar'),
+        ('foo bar', 'source.unknown'),
+    ),
+)
+def test_grammar_first_line_match(make_grammars, line, expected):
+    grammars = make_grammars(
+        {'scopeName': 'source.bar', 'firstLineMatch': 'bar', 'patterns': []},
+        {'scopeName': 'source.baz', 'firstLineMatch': '.*az', 'patterns': []},
+        {
+            'scopeName': 'source.foo',
+            'firstLineMatch': '(?x)^\\#!.*\\bfoo  # comment',
+            'patterns': [],
+        },
+    )
+    compiler = grammars.compiler_for_file('f', line)
+    assert compiler.root_state.entries[0].scope[0] == expected
+
+
+def test_highlight_lines_matches_highlight_line(make_grammars):
+    compiler = make_grammars(*NESTED_GRAMMARS).compiler_for_scope('test')
+    lines = ['< (a\n', '> a) a\n', '> < x\n', 'plain\n']
+
+    expected = []
+    state = compiler.root_state
+    for i, line in enumerate(lines):
+        state, regions = highlight_line(compiler, state, line, i == 0)
+        expected.append((state, regions))
+
+    ret = highlight_lines(compiler, compiler.root_state, iter(lines))
+    assert list(ret) == expected
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import curses
+
+from babi.hl.interface import attr_index
+from babi.hl.interface import HL
+from babi.hl.interface import iter_hls
+from babi.hl.interface import make_hls
+
+
+def test_attr_index_interned():
+    assert attr_index(curses.A_BOLD) == attr_index(curses.A_BOLD)
+    assert attr_index(curses.A_BOLD) != attr_index(curses.A_DIM)
+
+
+def test_make_hls_roundtrip():
+    # A_ITALIC is `1 << 31` which does not fit in the packed array
+    hls = (
+        HL(x=0, end=3, attr=curses.A_BOLD),
+        HL(x=4, end=9, attr=1 << 31 | 2 << 8),
+    )
+    packed = make_hls(*hls)
+    assert len(packed) == 6
+    assert tuple(iter_hls(packed)) == hls
+
+
+def test_make_hls_empty():
+    assert make_hls() == make_hls()
+    assert tuple(iter_hls(make_hls())) == ()
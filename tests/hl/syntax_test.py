@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import contextlib
 import curses
+import json
+import os
 from unittest import mock
 
 import pytest
@@ -9,6 +11,9 @@ import pytest
 from babi.buf import Buf
 from babi.color_manager import ColorManager
 from babi.hl.interface import HL
+from babi.hl.interface import make_hls
+from babi.hl.syntax import HighlightCache
+from babi.hl.syntax import SPARSE_MARGIN
 from babi.hl.syntax import Syntax
 from babi.theme import Color
 from babi.theme import Theme
@@ -166,6 +171,381 @@ def test_syntax_highlight_cache_first_line(stdscr, make_grammars):
         file_hl = syntax.file_highlighter('foo.demo', '')
         file_hl.highlight_until(Buf(['int', 'int']), 2)
         assert file_hl.regions == [
-            (HL(0, 3, curses.A_BOLD | 2 << 8),),
-            (),
+            make_hls(HL(0, 3, curses.A_BOLD | 2 << 8)),
+            make_hls(),
         ]
+
+
+COMMENT_GRAMMAR = {
+    'scopeName': 'source.demo',
+    'fileTypes': ['demo'],
+    'patterns': [
+        {'begin': '/\\*', 'end': '\\*/', 'name': 'string'},
+        {'match': 'int', 'name': 'keyword'},
+    ],
+}
+
+
+@pytest.fixture
+def demo_syntax(stdscr, make_grammars):
+    with FakeCurses.patch(n_colors=256, can_change_color=False):
+        syntax = Syntax(
+            make_grammars(COMMENT_GRAMMAR), THEME, ColorManager.make(),
+        )
+        syntax._init_screen(stdscr)
+        yield syntax
+
+
+def _full_highlight(syntax, lines):
+    file_hl = syntax.file_highlighter('foo.demo', '')
+    file_hl.highlight_until(Buf(list(lines)), len(lines))
+    return file_hl.regions
+
+
+def _edited_highlight(syntax, lines, edit):
+    buf = Buf(list(lines))
+    file_hl = syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+    edit(buf)
+    file_hl.highlight_until(buf, len(buf))
+    return file_hl, list(buf)
+
+
+LINES = ['int', '/* int', 'int', '*/ int', 'int', 'int', '']
+
+
+def _set_open_comment(buf):
+    buf[0] = '/* int'
+
+
+def _set_close_comment(buf):
+    buf[1] = 'int'
+
+
+def _set_plain(buf):
+    buf[4] = 'x int'
+
+
+def _insert_open_comment(buf):
+    buf.insert(4, '/*')
+
+
+def _insert_close_comment(buf):
+    buf.insert(2, '*/')
+
+
+def _delete_open_comment(buf):
+    del buf[1]
+
+
+def _delete_first_line(buf):
+    del buf[0]
+
+
+def _multiple_edits(buf):
+    buf[5] = '/*'
+    buf.insert(0, 'int')
+    del buf[3]
+
+
+def _splice_open_comment(buf):
+    buf.splice(2, 4, ['int', '/*', 'int'])
+
+
+def _splice_delete_close_comment(buf):
+    buf.splice(2, 4, [])
+
+
+def _splice_insert(buf):
+    buf.splice(0, 0, ['int', '*/'])
+
+
+@pytest.mark.parametrize(
+    'edit',
+    (
+        _set_open_comment,
+        _set_close_comment,
+        _set_plain,
+        _insert_open_comment,
+        _insert_close_comment,
+        _delete_open_comment,
+        _delete_first_line,
+        _multiple_edits,
+        _splice_open_comment,
+        _splice_delete_close_comment,
+        _splice_insert,
+    ),
+)
+def test_incremental_highlight_matches_full_highlight(demo_syntax, edit):
+    file_hl, new_lines = _edited_highlight(demo_syntax, LINES, edit)
+    assert file_hl.regions == _full_highlight(demo_syntax, new_lines)
+    assert file_hl._dirty is None
+
+
+def test_incremental_highlight_stops_when_state_converges(demo_syntax):
+    lines = ['int'] * 100 + ['']
+    buf = Buf(list(lines))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+
+    cache = demo_syntax.cache
+    hits, misses = cache.hits, cache.misses
+    buf[10] = 'x int'
+    file_hl.highlight_until(buf, len(buf))
+
+    # only the edited line is highlighted again
+    assert (cache.hits, cache.misses) == (hits, misses + 1)
+
+
+def test_incremental_highlight_resumes_past_viewport(demo_syntax):
+    lines = ['int'] * 20 + ['']
+    buf = Buf(list(lines))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+
+    buf[2] = '/*'
+    file_hl.highlight_until(buf, 5)
+    assert file_hl._dirty == (5, 6)
+
+    file_hl.highlight_until(buf, len(buf))
+    assert file_hl.regions == _full_highlight(demo_syntax, list(buf))
+
+
+def test_highlight_idle_advances_in_chunks(demo_syntax):
+    buf = Buf(['int'] * 10 + [''])
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, 2)
+
+    file_hl.highlight_idle(buf, 4)
+    assert len(file_hl.regions) == 6
+    assert file_hl.idle_pending(buf)
+
+    file_hl.highlight_idle(buf, 100)
+    assert len(file_hl.regions) == len(buf)
+    assert not file_hl.idle_pending(buf)
+
+
+def test_highlight_idle_rewinds_after_edit(demo_syntax):
+    buf = Buf(['int'] * 10 + [''])
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+
+    buf[1] = '/*'
+    assert file_hl.idle_pending(buf)
+    while file_hl.idle_pending(buf):
+        file_hl.highlight_idle(buf, 3)
+
+    assert file_hl.regions == _full_highlight(demo_syntax, list(buf))
+
+
+@pytest.fixture
+def xdg_data_home(tmpdir):
+    data_home = tmpdir.join('data_home')
+    with mock.patch.dict(os.environ, {'XDG_DATA_HOME': str(data_home)}):
+        yield data_home
+
+
+def _checkpointed(demo_syntax, lines):
+    buf = Buf(list(lines))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, len(buf))
+    file_hl.save_checkpoints('deadbeef')
+
+    buf = Buf(list(lines))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.load_checkpoints('deadbeef')
+    return buf, file_hl
+
+
+CHECKPOINT_LINES = ['int', '/*', 'int'] * 300 + ['*/ int', 'int', '']
+
+
+def test_checkpoints_skip_tokenizing_above_viewport(
+        xdg_data_home,
+        demo_syntax,
+):
+    buf, file_hl = _checkpointed(demo_syntax, CHECKPOINT_LINES)
+    expected = _full_highlight(demo_syntax, CHECKPOINT_LINES)
+
+    buf.file_y = 850
+    file_hl.highlight_until(buf, 875)
+    assert file_hl.regions[:768] == [None] * 768
+    assert file_hl.regions[850:875] == expected[850:875]
+
+    buf.file_y = 0
+    file_hl.highlight_until(buf, len(buf))
+    assert file_hl.regions == expected
+
+
+def test_checkpoints_edit_above_viewport(xdg_data_home, demo_syntax):
+    buf, file_hl = _checkpointed(demo_syntax, CHECKPOINT_LINES)
+
+    buf.file_y = 850
+    file_hl.highlight_until(buf, 875)
+
+    buf[500] = '*/'
+    file_hl.highlight_until(buf, 875)
+    # re-tokenized starting from the checkpoint before the edit
+    assert file_hl.regions[:256] == [None] * 256
+    expected = _full_highlight(demo_syntax, list(buf))
+    assert file_hl.regions[850:875] == expected[850:875]
+
+
+def test_checkpoints_edit_below_base(xdg_data_home, demo_syntax):
+    buf, file_hl = _checkpointed(demo_syntax, CHECKPOINT_LINES)
+
+    buf.file_y = 850
+    file_hl.highlight_until(buf, 875)
+
+    buf.insert(860, '*/')
+    del buf[768]
+    buf.file_y = 0
+    file_hl.highlight_until(buf, len(buf))
+    assert file_hl.regions == _full_highlight(demo_syntax, list(buf))
+
+
+def test_checkpoints_not_loaded_when_grammar_changed(
+        xdg_data_home,
+        demo_syntax,
+):
+    _checkpointed(demo_syntax, CHECKPOINT_LINES)
+
+    (filename,) = xdg_data_home.join('babi/highlight_v1').listdir()
+    data = json.loads(filename.read())
+    data['grammars']['source.demo'] -= 1
+    filename.write(json.dumps(data))
+
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.load_checkpoints('deadbeef')
+    assert file_hl._checkpoints == {}
+
+
+def test_checkpoints_least_recently_used_are_removed(
+        xdg_data_home,
+        demo_syntax,
+):
+    dirname = xdg_data_home.join('babi/highlight_v1')
+    with mock.patch('babi.hl.syntax.CHECKPOINT_FILES', 2):
+        for i, sha256 in enumerate(('a', 'b', 'c')):
+            if sha256 == 'c':  # loading 'a' marks it as recently used
+                file_hl = demo_syntax.file_highlighter('foo.demo', '')
+                file_hl.load_checkpoints('a')
+
+            buf = Buf(list(CHECKPOINT_LINES))
+            file_hl = demo_syntax.file_highlighter('foo.demo', '')
+            file_hl.register_callbacks(buf)
+            file_hl.highlight_until(buf, len(buf))
+            file_hl.save_checkpoints(sha256)
+            os.utime(dirname.join(f'{sha256}-source.demo.json'), (i, i))
+
+    assert sorted(p.basename for p in dirname.listdir()) == [
+        'a-source.demo.json', 'c-source.demo.json',
+    ]
+
+
+def test_checkpoints_not_loaded_when_corrupt(xdg_data_home, demo_syntax):
+    _checkpointed(demo_syntax, CHECKPOINT_LINES)
+
+    (filename,) = xdg_data_home.join('babi/highlight_v1').listdir()
+    filename.write('{"grammars": {}, "checkpoints": [[1, []]]}')
+
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.load_checkpoints('deadbeef')
+    assert file_hl._checkpoints == {}
+
+
+@pytest.fixture
+def sparse():
+    with mock.patch('babi.hl.syntax.SPARSE_LINES', 0):
+        yield
+
+
+def test_sparse_keeps_states_at_intervals(sparse, demo_syntax):
+    buf = Buf(list(CHECKPOINT_LINES))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    file_hl.highlight_until(buf, 20)
+    while file_hl.idle_pending(buf):
+        file_hl.highlight_idle(buf, 100)
+
+    kept = [i for i, state in enumerate(file_hl._states) if state is not None]
+    assert kept == [255, 511, 767, len(buf) - 1]
+    materialized = [i for i, r in enumerate(file_hl.regions) if r is not None]
+    assert materialized == list(range(20 + SPARSE_MARGIN))
+
+
+def test_sparse_regions_follow_viewport(sparse, demo_syntax):
+    buf = Buf(list(CHECKPOINT_LINES))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    expected = _full_highlight(demo_syntax, CHECKPOINT_LINES)
+
+    file_hl.highlight_until(buf, 20)
+    buf.file_y = 850
+    file_hl.highlight_until(buf, 875)
+    assert file_hl.regions[850:875] == expected[850:875]
+    assert set(file_hl.regions[:850 - SPARSE_MARGIN]) == {None}
+
+    buf.file_y = 100
+    file_hl.highlight_until(buf, 125)
+    assert file_hl.regions[100:125] == expected[100:125]
+    assert set(file_hl.regions[125 + SPARSE_MARGIN:]) == {None}
+
+
+def test_sparse_incremental_highlight(sparse, demo_syntax):
+    buf = Buf(list(CHECKPOINT_LINES))
+    file_hl = demo_syntax.file_highlighter('foo.demo', '')
+    file_hl.register_callbacks(buf)
+    buf.file_y = 850
+    file_hl.highlight_until(buf, 875)
+    while file_hl.idle_pending(buf):
+        file_hl.highlight_idle(buf, 100)
+
+    buf[600] = '*/'
+    buf.insert(700, '/*')
+    del buf[300]
+    file_hl.highlight_until(buf, 875)
+    expected = _full_highlight(demo_syntax, list(buf))
+    assert file_hl.regions[850:875] == expected[850:875]
+
+    while file_hl.idle_pending(buf):
+        file_hl.highlight_idle(buf, 100)
+    buf.file_y = 0
+    file_hl.highlight_until(buf, 25)
+    assert file_hl.regions[:25] == expected[:25]
+
+    full = demo_syntax.file_highlighter('foo.demo', '')
+    full.highlight_until(Buf(list(buf)), len(buf))
+    assert file_hl.checkpoints() == full.checkpoints()
+
+
+def test_highlight_cache_shared_between_files(demo_syntax):
+    lines = ['int', '/* int */', '']
+    expected = _full_highlight(demo_syntax, lines)
+    hits, misses = demo_syntax.cache.hits, demo_syntax.cache.misses
+
+    assert _full_highlight(demo_syntax, lines) == expected
+    assert demo_syntax.cache.hits == hits + len(lines)
+    assert demo_syntax.cache.misses == misses
+
+
+def test_highlight_cache_bounded(demo_syntax):
+    cache = HighlightCache(THEME, demo_syntax.color_manager, maxsize=2)
+    compiler = demo_syntax.grammars.compiler_for_scope('source.demo')
+    state = compiler.root_state
+    lines = ['int', 'x', 'int']
+
+    ret = list(cache.highlight_lines(compiler, state, lines, True))
+    assert len(cache._cache) == 2
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    # the first line was evicted, a miss highlights the rest in a batch
+    assert list(cache.highlight_lines(compiler, state, lines, True)) == ret
+    assert (cache.hits, cache.misses) == (0, 6)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+import os
+import select
+import subprocess
+import sys
+
+import pytest
+
+from babi.horizontal_scrolling import wcwidth
+
+# the previous implementation: draw the character and see where curses
+# puts the cursor
+CURSES_WIDTHS = '''\
+import curses
+import json
+import sys
+
+
+def main(stdscr):
+    with open(sys.argv[1], encoding='UTF-8') as f:
+        chars = json.load(f)
+
+    win = curses.newwin(1, 10)
+    widths = []
+    for c in chars:
+        win.addstr(0, 0, c)
+        widths.append(win.getyx()[1])
+        win.erase()
+
+    with open(sys.argv[2], 'w', encoding='UTF-8') as f:
+        json.dump(widths, f)
+
+
+curses.wrapper(main)
+'''
+
+
+def _curses_widths(tmpdir, chars):
+    pty = pytest.importorskip('pty')
+
+    chars_f, widths_f = tmpdir.join('chars.json'), tmpdir.join('widths.json')
+    chars_f.write(json.dumps(chars))
+
+    master, slave = pty.openpty()
+    env = {**os.environ, 'TERM': 'xterm-256color', 'LC_ALL': 'C.UTF-8'}
+    cmd = (sys.executable, '-c', CURSES_WIDTHS, chars_f, widths_f)
+    proc = subprocess.Popen(
+        cmd, env=env, stdin=slave, stdout=slave, stderr=slave,
+    )
+    os.close(slave)
+    try:
+        while proc.poll() is None:  # drain the terminal output
+            if select.select((master,), (), (), .1)[0]:
+                try:
+                    os.read(master, 4096)
+                except OSError:
+                    break
+        proc.wait()
+    finally:
+        os.close(master)
+
+    if proc.returncode != 0:
+        pytest.skip('curses is not usable here')
+    return json.loads(widths_f.read())
+
+
+@pytest.mark.parametrize(
+    ('c', 'expected'),
+    (
+        pytest.param('a', 1, id='ascii'),
+        pytest.param('\x01', 2, id='control character (^A)'),
+        pytest.param('\x7f', 2, id='DEL (^?)'),
+        pytest.param('\x85', 1, id='C1 control character'),
+        pytest.param('\u0301', 0, id='combining mark'),
+        pytest.param('\u200d', 0, id='zero width joiner'),
+        pytest.param('\xad', 1, id='soft hyphen'),
+        pytest.param('\u0600', 1, id='prepended concatenation mark'),
+        pytest.param('一', 2, id='CJK'),
+        pytest.param('！', 2, id='fullwidth'),
+        pytest.param('🔵', 2, id='emoji'),
+    ),
+)
+def test_wcwidth(c, expected):
+    assert wcwidth(c) == expected
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires a pty')
+def test_wcwidth_matches_curses(tmpdir):
+    chars = [
+        chr(cp)
+        for cp in (
+            *range(0x3000),
+            *range(0xac00, 0xac10),
+            *range(0xfe00, 0xff10),
+            *range(0x1f300, 0x1f310),
+        )
+        # newline moves to the next line, tab is handled by the caller
+        if cp not in {0x00, 0x09, 0x0a}
+    ]
+    expected = dict(zip(chars, _curses_widths(tmpdir, chars)))
+    assert {c: wcwidth(c) for c in chars} == expected
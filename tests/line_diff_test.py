@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import difflib
+import random
+
+import pytest
+
+from babi.line_diff import get_opcodes
+
+
+def _apply(a, b, opcodes):
+    ret = []
+    pos = (0, 0)
+    for op, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == pos
+        if op == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+        ret.extend(b[j1:j2])
+        pos = (i2, j2)
+    assert pos == (len(a), len(b))
+    return ret
+
+
+@pytest.mark.parametrize(
+    ('a', 'b'),
+    (
+        ([], []),
+        (['a'], ['a']),
+        ([], ['a', 'b']),
+        (['a', 'b'], []),
+        (['a', 'b', 'c', 'd'], ['a', 'b', 'x', 'd']),
+        (['a', 'b', 'c'], ['a', 'q', 'q', 'c']),
+        (['a', 'b', 'c'], ['a', 'q', 'q', 'q', 'b', 'c']),
+        (['a', 'b', 'c'], ['c']),
+    ),
+)
+def test_get_opcodes_matches_difflib(a, b):
+    expected = difflib.SequenceMatcher(a=a, b=b).get_opcodes()
+    assert get_opcodes(a, b) == expected
+
+
+def test_get_opcodes_anchors_on_rare_lines():
+    a = ['def f():', '    return 1', '', 'def g():', '    return 2', '']
+    b = ['def g():', '    return 2', '', 'def f():', '    return 1', '']
+    assert get_opcodes(a, b) == [
+        ('delete', 0, 3, 0, 0),
+        ('equal', 3, 5, 0, 2),
+        ('insert', 5, 5, 2, 5),
+        ('equal', 5, 6, 5, 6),
+    ]
+
+
+def test_get_opcodes_transforms_random_sequences():
+    rand = random.Random(0)
+    for _ in range(1000):
+        a = [rand.choice('abcdef') for _ in range(rand.randint(0, 20))]
+        b = [rand.choice('abcdef') for _ in range(rand.randint(0, 20))]
+        opcodes = get_opcodes(a, b)
+        assert _apply(a, b, opcodes) == b
+        # adjacent equal blocks are merged
+        for (op1, *_), (op2, *_) in zip(opcodes, opcodes[1:]):
+            assert not (op1 == op2 == 'equal')
+
+
+def test_get_opcodes_unique_lines():
+    a = [f'line {i}' for i in range(1000)]
+    b = list(a)
+    for i in range(0, len(b), 50):
+        b[i] = f'edited {i}'
+    del b[501:504]
+    b.insert(700, 'inserted')
+
+    opcodes = get_opcodes(a, b)
+    assert _apply(a, b, opcodes) == b
+    changed = sum(i2 - i1 for op, i1, i2, _, _ in opcodes if op != 'equal')
+    assert changed == 20 + 3
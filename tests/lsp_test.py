@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from babi.buf import Buf
+from babi.lsp import content_change
+from babi.lsp import LSPClient
+from babi.lsp import LSPServers
+from babi.lsp import split_frames
+from babi.lsp import SYNC_FULL
+from babi.lsp import SYNC_INCREMENTAL
+from testing.fake_lsp import apply_change
+
+URI = 'file:///f.py'
+
+
+def _change(buf, func):
+    before = (len(buf), buf[-1])
+    text = '\n'.join(buf)
+    with buf.record() as modifications:
+        func(buf)
+    change = content_change(buf, '\n', before, modifications)
+    return apply_change(text, change), change
+
+
+@pytest.mark.parametrize(
+    'func',
+    (
+        pytest.param(lambda buf: buf.__setitem__(1, 'B'), id='set'),
+        pytest.param(lambda buf: buf.__delitem__(0), id='delete first'),
+        pytest.param(lambda buf: buf.insert(2, 'new'), id='insert'),
+        pytest.param(lambda buf: buf.splice(0, 4, ['x']), id='everything'),
+        pytest.param(lambda buf: buf.__setitem__(3, 'eof'), id='last line'),
+        pytest.param(lambda buf: buf.append('after'), id='append'),
+        pytest.param(
+            lambda buf: (buf.__setitem__(0, 'A'), buf.__setitem__(3, 'D')),
+            id='separate lines',
+        ),
+    ),
+)
+def test_content_change(func):
+    buf = Buf(['a', 'b', 'c', ''])
+    text, _ = _change(buf, func)
+    assert text == '\n'.join(buf)
+
+
+def test_content_change_is_ranged():
+    buf = Buf([f'line {i}' for i in range(100)] + [''])
+    text, change = _change(buf, lambda buf: buf.__setitem__(50, 'hello'))
+    assert text == '\n'.join(buf)
+    assert change == {
+        'range': {
+            'start': {'line': 50, 'character': 0},
+            'end': {'line': 51, 'character': 0},
+        },
+        'text': 'hello\n',
+    }
+
+
+def test_content_change_utf16_end():
+    buf = Buf(['a', '🔵'])
+    text, change = _change(buf, lambda buf: buf.__setitem__(1, 'b'))
+    assert text == 'a\nb'
+    assert change['range']['end'] == {'line': 1, 'character': 2}
+
+
+def test_content_change_random_edits():
+    rand = random.Random(0)
+    for _ in range(200):
+        buf = Buf([str(i) for i in range(rand.randint(1, 8))])
+
+        def edit(buf):
+            for _ in range(rand.randint(1, 5)):
+                idx = rand.randrange(len(buf))
+                op = rand.randrange(4)
+                if op == 0:
+                    buf[idx] = f'{buf[idx]}!'
+                elif op == 1 and len(buf) > 1:
+                    del buf[idx]
+                elif op == 2:
+                    buf.insert(rand.randint(0, len(buf)), 'new')
+                else:
+                    n = rand.randint(0, 3)
+                    end = min(idx + rand.randint(0, 2), len(buf))
+                    buf.splice(idx, end, ['s'] * n or ['e'])
+
+        text, _ = _change(buf, edit)
+        assert text == '\n'.join(buf)
+
+
+def test_split_frames():
+    buf = bytearray(
+        b'Content-Length: 2\r\n\r\n{}'
+        b'content-length: 7\r\nContent-Type: x\r\n\r\n[1, 2]\n'
+        b'Content-Length: 5\r\n\r\n{"a"',
+    )
+    assert split_frames(buf) == [b'{}', b'[1, 2]\n']
+    assert buf == b'Content-Length: 5\r\n\r\n{"a"'
+    assert split_frames(buf) == []
+    buf += b'}'
+    assert split_frames(buf) == [b'{"a"}']
+    assert buf == b''
+
+
+def test_split_frames_requires_length():
+    with pytest.raises(ValueError):
+        split_frames(bytearray(b'Content-Type: x\r\n\r\n{}'))
+
+
+def _handle_until(client, event):
+    """handle messages the way the ui does until `event` is set"""
+    deadline = time.monotonic() + 10
+    while not event.is_set():
+        timeout = deadline - time.monotonic()
+        assert select.select((client,), (), (), timeout)[0]
+        client.handle_messages()
+
+
+def _fake_cmd(log, sync=SYNC_INCREMENTAL):
+    return [
+        sys.executable, '-m', 'testing.fake_lsp',
+        '--sync', str(sync), '--log', str(log),
+    ]
+
+
+def _fake_client(tmpdir, sync=SYNC_INCREMENTAL, **kwargs):
+    log = tmpdir.join('log')
+    cmd = _fake_cmd(log, sync)
+    client = LSPClient(cmd, **{'sync_delay': 0., **kwargs})
+    initialized = threading.Event()
+    client.initialize({}, lambda result: initialized.set())
+    _handle_until(client, initialized)
+    return client, log
+
+
+def _read_log(client, log):
+    client.shutdown()
+    client.process.wait(timeout=10)
+    client.join(timeout=10)
+    return [json.loads(line) for line in log.read().splitlines()]
+
+
+def test_lsp_shutdown_closes_pipes(tmpdir):
+    client, log = _fake_client(tmpdir)
+    wake_r = client.fileno()
+    _read_log(client, log)
+    client._closer.join(timeout=10)
+
+    assert client.process.stdin.closed
+    assert client.process.stdout.closed
+    with pytest.raises(OSError):
+        os.fstat(wake_r)
+
+
+def _did_change(msgs):
+    return [
+        (msg, text) for msg, text in msgs
+        if msg.get('method') == 'textDocument/didChange'
+    ]
+
+
+def test_lsp_incremental_sync(tmpdir):
+    client, log = _fake_client(tmpdir, SYNC_INCREMENTAL)
+    assert client.sync_kind == SYNC_INCREMENTAL
+
+    buf = Buf(['hello', 'world', ''])
+    client.open_document(URI, '\n'.join(buf))
+    for func in (
+            lambda buf: buf.__setitem__(0, 'héllo 🔵'),
+            lambda buf: buf.insert(1, 'there'),
+            lambda buf: buf.__setitem__(3, 'end'),
+    ):
+        before = (len(buf), buf[-1])
+        with buf.record() as modifications:
+            func(buf)
+        change = content_change(buf, '\n', before, modifications)
+        client.change_document(URI, [change], lambda: '\n'.join(buf))
+
+    changes = _did_change(_read_log(client, log))
+    versions = [msg['params']['textDocument']['version'] for msg, _ in changes]
+    # versions increase, changes batched together skip some
+    assert versions == sorted(set(versions))
+    assert versions[0] >= 1
+    for msg, _ in changes:
+        for change in msg['params']['contentChanges']:
+            assert 'range' in change
+    assert changes[-1][1] == '\n'.join(buf)
+
+
+def test_lsp_changes_are_batched_until_a_request(tmpdir):
+    client, log = _fake_client(tmpdir, SYNC_INCREMENTAL, sync_delay=60)
+
+    buf = Buf(['hello', ''])
+    client.open_document(URI, '\n'.join(buf))
+    for c in 'abc':
+        before = (len(buf), buf[-1])
+        with buf.record() as modifications:
+            buf[0] += c
+        change = content_change(buf, '\n', before, modifications)
+        client.change_document(URI, [change], lambda: '\n'.join(buf))
+    client.get_definition(URI, 0, 0, lambda result: None)
+
+    msgs = _read_log(client, log)
+    methods = [msg.get('method') for msg, _ in msgs]
+    assert methods[-4:] == [
+        'textDocument/didChange', 'textDocument/definition',
+        'shutdown', 'exit',
+    ]
+    (msg, text), = _did_change(msgs)
+    assert len(msg['params']['contentChanges']) == 3
+    assert text == 'helloabc\n'
+
+
+def test_lsp_full_sync(tmpdir):
+    client, log = _fake_client(tmpdir, SYNC_FULL)
+    assert client.sync_kind == SYNC_FULL
+
+    client.open_document(URI, 'hello\n')
+    client.change_document(URI, [{'range': 'unused'}], lambda: 'world\n')
+
+    (msg, text), = _did_change(_read_log(client, log))
+    assert msg['params']['contentChanges'] == [{'text': 'world\n'}]
+    assert text == 'world\n'
+
+
+def test_lsp_superseded_request_is_cancelled(tmpdir):
+    client, log = _fake_client(tmpdir)
+    client.open_document(URI, 'hello\n')
+
+    results = []
+    answered = threading.Event()
+
+    def first(result):
+        results.append(('first', result))
+
+    def second(result):
+        results.append(('second', result))
+        answered.set()
+
+    client.get_definition(URI, 0, 0, first)
+    client.get_definition(URI, 0, 1, second)
+    _handle_until(client, answered)
+
+    msgs = [msg for msg, _ in _read_log(client, log)]
+    first, _ = (
+        msg['id'] for msg in msgs
+        if msg.get('method') == 'textDocument/definition'
+    )
+    cancel = {'jsonrpc': '2.0', 'method': '$/cancelRequest'}
+    assert {**cancel, 'params': {'id': first}} in msgs
+    # the server answered both, but the first answer is dropped
+    assert results == [('second', [])]
+
+
+def test_lsp_request_timeout(tmpdir):
+    client, log = _fake_client(tmpdir, request_timeout=0)
+    client.open_document(URI, 'hello\n')
+
+    results: list[Any] = []
+    client.get_definition(URI, 0, 0, results.append)
+    # `initialize` never times out, its answer comes after the definition's
+    answered = threading.Event()
+    client.initialize({}, lambda result: answered.set())
+    _handle_until(client, answered)
+    _read_log(client, log)
+
+    assert results == []
+
+
+def test_lsp_messages_are_handled_in_batches(tmpdir):
+    client, log = _fake_client(tmpdir)
+    client.open_document(URI, 'hello\n')
+
+    answered = threading.Event()
+    for _ in range(5):
+        client.get_diagnostics(URI)
+    client.get_definition(URI, 0, 0, lambda result: answered.set())
+
+    # wait for all six answers to be queued
+    deadline = time.monotonic() + 10
+    while client._messages.qsize() < 6:
+        assert time.monotonic() < deadline
+        time.sleep(.01)
+
+    client.handle_messages(limit=4)
+    assert not answered.is_set()
+    # the rest are left for the next wake up
+    assert select.select((client,), (), (), 0)[0]
+    client.handle_messages(limit=4)
+    assert answered.is_set()
+
+    _read_log(client, log)
+
+
+def test_lsp_servers_are_shared(tmpdir):
+    servers = LSPServers()
+    cmd = _fake_cmd(tmpdir.join('log'))
+    a = servers.open_document(cmd, Path(tmpdir.join('a.py')), 'a\n')
+    b = servers.open_document(cmd, Path(tmpdir.join('b.py')), 'b\n')
+    a2 = servers.open_document(cmd, Path(tmpdir.join('a.py')), 'a\n')
+    assert a.client is b.client is a2.client
+    other_cmd = _fake_cmd(tmpdir.join('other_log'))
+    other = servers.open_document(other_cmd, Path(tmpdir.join('c.py')), '')
+    assert servers.clients == (a.client, other.client)
+
+    servers.close_document(other)
+    assert other.client.process is not None
+    other.client.process.wait(timeout=10)
+    for document in (a, b):
+        servers.close_document(document)
+        assert servers.clients == (a.client,)
+    servers.close_document(a2)
+    assert servers.clients == ()
+    assert a.client.process is not None
+    a.client.process.wait(timeout=10)
+    a.client.join(timeout=10)
+
+    log = tmpdir.join('log').read().splitlines()
+    msgs = [msg for msg, _ in map(json.loads, log)]
+    uri_a = Path(tmpdir.join('a.py')).as_uri()
+    uri_b = Path(tmpdir.join('b.py')).as_uri()
+    opened_closed = [
+        (msg['method'], msg['params']['textDocument']['uri'])
+        for msg in msgs
+        if msg['method'] in {'textDocument/didOpen', 'textDocument/didClose'}
+    ]
+    assert opened_closed == [
+        ('textDocument/didOpen', uri_a),
+        ('textDocument/didOpen', uri_b),
+        ('textDocument/didClose', uri_b),
+        ('textDocument/didClose', uri_a),
+    ]
+    assert [msg['method'] for msg in msgs][-2:] == ['shutdown', 'exit']
@@ -5,6 +5,10 @@ import pytest
 
 from babi.reg import _Reg
 from babi.reg import _RegSet
+from babi.reg import collect_stats
+from babi.reg import ERR_REG
+from babi.reg import make_reg
+from babi.reg import make_regset
 
 
 def test_reg_first_line():
@@ -73,3 +77,32 @@ def test_regset_neither():
 
 def test_regset_repr():
     assert repr(_RegSet('ohai', r'\Aworld')) == r"_RegSet('ohai', '\\Aworld')"
+
+
+def test_collect_stats():
+    with collect_stats() as stats:
+        reg = make_reg('b', rule='r1')
+        regset = make_regset('a', 'b', rule='r2')
+        assert reg.search('ab', 0, first_line=True, boundary=True)
+        assert not reg.match('ab', 0, first_line=True, boundary=True)
+        assert regset.search('xb', 0, first_line=True, boundary=True)[0] == 1
+
+    assert stats.searches == {('r1', ('b',)): 2, ('r2', ('a', 'b')): 1}
+    assert set(stats.search_time) == {('r1', ('b',)), ('r2', ('a', 'b'))}
+    assert stats.matches == {('r1', 'b'): 1, ('r2', 'b'): 1}
+    assert set(stats.compile_time) == {('r1', 'b'), ('r2', 'a'), ('r2', 'b')}
+
+    # regexes made afterwards are not profiled and are the same as before
+    assert type(make_reg('b')) is _Reg
+    assert type(make_regset('a', 'b')) is _RegSet
+    assert make_reg('$ ^') is ERR_REG
+
+
+def test_collect_stats_same_pattern_in_different_rules():
+    with collect_stats() as stats:
+        for rule in ('r1', 'r2', 'r2'):
+            reg = make_reg('b', rule=rule)
+            assert reg.search('b', 0, first_line=True, boundary=True)
+
+    assert stats.searches == {('r1', ('b',)): 1, ('r2', ('b',)): 2}
+    assert stats.matches == {('r1', 'b'): 1, ('r2', 'b'): 2}
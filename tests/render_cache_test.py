@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import curses
+
+from babi.buf import Buf
+from babi.buf import CHUNKED_LINES
+from babi.dim import Dim
+from babi.hl.interface import HL
+from babi.hl.interface import HLs
+from babi.hl.interface import make_hls
+from babi.render_cache import RenderCache
+
+DIM = Dim(x=0, y=1, width=10, height=5)
+
+
+class FakeHL:
+    include_edge = False
+
+    def __init__(self) -> None:
+        self.regions: dict[int, HLs] = {}
+
+    def highlight_until(self, lines: Buf, idx: int) -> None:
+        pass
+
+    def register_callbacks(self, buf: Buf) -> None:
+        pass
+
+
+def _cache(buf: Buf) -> RenderCache:
+    cache = RenderCache((FakeHL(),))
+    cache.register_callbacks(buf)
+    return cache
+
+
+def test_row_text():
+    buf = Buf(['hello', '\tworld', 'x' * 20])
+    cache = _cache(buf)
+    assert cache.row(buf, 0, DIM, 0, (make_hls(),)) == ('hello     ', ())
+    assert cache.row(buf, 1, DIM, 0, (make_hls(),))[0] == '    world '
+    assert cache.row(buf, 2, DIM, 0, (make_hls(),))[0] == 'xxxxxxxxx»'
+
+
+def test_row_reused():
+    buf = Buf(['hello', 'world'])
+    cache = _cache(buf)
+    regions = (make_hls(),)
+    text, _ = cache.row(buf, 1, DIM, 0, regions)
+    assert cache.row(buf, 1, DIM, 0, regions)[0] is text
+
+
+def test_row_invalidated_when_line_changes():
+    buf = Buf(['hello', 'world'])
+    cache = _cache(buf)
+    regions = (make_hls(),)
+    cache.row(buf, 0, DIM, 0, regions)
+    cache.row(buf, 1, DIM, 0, regions)
+
+    buf[0] = 'howdy'
+    assert cache.row(buf, 0, DIM, 0, regions)[0] == 'howdy     '
+
+    buf.insert(0, 'first')
+    assert cache.row(buf, 0, DIM, 0, regions)[0] == 'first     '
+    assert cache.row(buf, 2, DIM, 0, regions)[0] == 'world     '
+
+    buf.splice(0, 2, ['a', 'b', 'c'])
+    assert cache.row(buf, 1, DIM, 0, regions)[0] == 'b         '
+    assert cache.row(buf, 3, DIM, 0, regions)[0] == 'world     '
+
+
+def test_row_kept_aligned_long_file():
+    buf = Buf([f'line{i}' for i in range(CHUNKED_LINES)])
+    cache = _cache(buf)
+    regions = (make_hls(),)
+    texts = {
+        idx: cache.row(buf, idx, DIM, 0, regions)[0]
+        for idx in (0, 5000, 9999)
+    }
+
+    buf.insert(0, 'first')
+    del buf[5000]
+    buf.splice(9998, 9999, ['a', 'b'])
+    assert cache.row(buf, 0, DIM, 0, regions)[0] == 'first     '
+    assert cache.row(buf, 1, DIM, 0, regions)[0] is texts[0]
+    assert cache.row(buf, 5000, DIM, 0, regions)[0] is texts[5000]
+    assert cache.row(buf, 9998, DIM, 0, regions)[0] == 'a         '
+    assert cache.row(buf, 10000, DIM, 0, regions)[0] is texts[9999]
+
+
+def test_row_spans():
+    buf = Buf(['\thello world'])
+    cache = _cache(buf)
+    regions = (make_hls(HL(x=1, end=6, attr=curses.A_BOLD)),)
+    _, spans = cache.row(buf, 0, DIM, 0, regions)
+    assert spans == ((4, 5, curses.A_BOLD),)
+
+    # a highlight past the right edge stops one before the scroll marker
+    regions = (make_hls(HL(x=5, end=12, attr=curses.A_BOLD)),)
+    _, spans = cache.row(buf, 0, DIM, 0, regions)
+    assert spans == ((8, 1, curses.A_BOLD),)
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import os
+from unittest import mock
+
+import pytest
+
+from babi.undo_log import undo_log_enabled
+from babi.undo_log import UndoLog
+
+
+class FakeAction:
+    def __init__(self, name):
+        self.name = name
+
+
+@pytest.fixture(autouse=True)
+def xdg_data_home(tmpdir):
+    data_home = tmpdir.join('data_home')
+    with mock.patch.dict(os.environ, {'XDG_DATA_HOME': str(data_home)}):
+        data_home.join('babi/undo_v1').ensure_dir()
+        yield data_home
+
+
+def _save(log, sha256, actions):
+    log.save(sha256, actions, lambda action: action.name)
+
+
+def _load(log, sha256):
+    return [action.name for action in log.load(sha256, FakeAction)]
+
+
+def test_undo_log_enabled(xdg_data_home):
+    assert undo_log_enabled()
+    xdg_data_home.join('babi/undo_v1').remove()
+    assert not undo_log_enabled()
+
+
+def test_undo_log_roundtrip(tmpdir):
+    log = UndoLog(str(tmpdir.join('f')))
+    _save(log, 'sha1', [FakeAction('a'), FakeAction('b')])
+
+    assert _load(UndoLog(str(tmpdir.join('f'))), 'sha1') == ['a', 'b']
+    assert _load(UndoLog(str(tmpdir.join('f'))), 'sha2') == []
+    assert _load(UndoLog(str(tmpdir.join('other'))), 'sha1') == []
+
+
+def test_undo_log_only_appends_new_actions(tmpdir):
+    log = UndoLog(str(tmpdir.join('f')))
+    a, b, c = FakeAction('a'), FakeAction('b'), FakeAction('c')
+    _save(log, 'sha1', [a, b])
+    with open(log.filename, 'rb') as f:
+        before = f.read()
+
+    # `b` was undone and replaced by `c`
+    _save(log, 'sha2', [a, c])
+    with open(log.filename, 'rb') as f:
+        after = f.read()
+    assert after.startswith(before)
+    assert after[len(before):].count(b'\n') == 2
+
+    assert _load(UndoLog(str(tmpdir.join('f'))), 'sha1') == ['a', 'b']
+    assert _load(UndoLog(str(tmpdir.join('f'))), 'sha2') == ['a', 'c']
+
+
+def test_undo_log_loaded_actions_are_not_rewritten(tmpdir):
+    _save(UndoLog(str(tmpdir.join('f'))), 'sha1', [FakeAction('a')])
+
+    log = UndoLog(str(tmpdir.join('f')))
+    actions = log.load('sha1', FakeAction)
+    with open(log.filename, 'rb') as f:
+        before = f.read()
+    _save(log, 'sha2', [*actions, FakeAction('b')])
+    with open(log.filename, 'rb') as f:
+        after = f.read()
+    assert after[len(before):].count(b'\n') == 2
+
+    assert _load(UndoLog(str(tmpdir.join('f'))), 'sha2') == ['a', 'b']
+
+
+def test_undo_log_corrupt(tmpdir):
+    log = UndoLog(str(tmpdir.join('f')))
+    with open(log.filename, 'w') as f:
+        f.write('["s","sha1",0]\n')
+    assert _load(log, 'sha1') == []